@@ -6,7 +6,8 @@ G-Finder Lite⚡ - メインアプリケーション
 import streamlit as st
 
 # 認証
-from auth import check_password
+from auth import check_password, is_operator
+from tracing import finish_trace, show_trace_panel, span, start_trace
 
 # ページ設定(認証前に実行)
 st.set_page_config(page_title="G-Finder Lite⚡", layout="wide")
@@ -17,13 +18,19 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 処理時間の計測（再実行ごと）
+rerun_trace = start_trace()
+
 # 認証ゲート
-if not check_password():
+with span("check_password"):
+    authenticated = check_password()
+if not authenticated:
     st.stop()
 
 # 認証後のインポート
 from data_loader import load_jichitai, load_category, get_pref_master
-from elasticsearch_client import get_es_client
+from elasticsearch_client import get_es_client, show_pool_panel
+from search_cancel import finish_search_run, start_search_run
 from query_builder import build_search_query
 from data_fetcher import fetch_kpi
 from ui_components import show_page_header, show_search_info, show_kpi_metrics
@@ -42,106 +49,123 @@ catmap = load_category()
 pref_master = get_pref_master(jichitai)
 
 # ====== Elasticsearch接続 ======
-es = get_es_client()
-
-# ====== サイドバー構築 ======
-sidebar_config = build_sidebar(jichitai, catmap)
-
-# ====== クエリ構築 ======
-query = build_search_query(
-    and_words=sidebar_config["and_words"],
-    or_words=sidebar_config["or_words"],
-    not_words=sidebar_config["not_words"],
-    years=sidebar_config["selected_years"],
-    codes=sidebar_config["codes_for_query"],
-    categories=sidebar_config["sel_categories"],
-    search_fields=sidebar_config["search_fields"],
-    base_query=sidebar_config["restrictions"]["base_query"],
-    can_modify_query=sidebar_config["restrictions"]["can_modify_query"]  # 追加
-)
-
-# ====== KPI取得 ======
-kpi_data = fetch_kpi(es, query)
-
-# ====== ページヘッダー ======
-show_page_header()
-
-# ====== 検索条件表示 ======
-show_search_info(
-    and_words=sidebar_config["and_words"],
-    or_words=sidebar_config["or_words"],
-    not_words=sidebar_config["not_words"],
-    selected_years=sidebar_config["selected_years"],
-    search_fields=sidebar_config["search_fields"]
-)
-
-# ====== KPI表示 ======
-show_kpi_metrics(kpi_data)
-
-# ====== タブ表示（権限で動的に制御） ======
-# ユーザー権限に基づいてタブを動的に構築
-tab_names = ["検索結果"]
-tab_functions = [
-    lambda: render_results_tab(
-        es=es,
-        query=query,
-        jichitai=jichitai,
-        catmap=catmap,
-        result_limit=sidebar_config["result_limit"]
-    )
-]
-
-# 件数タブ（権限がある場合のみ）
-if st.session_state.get("user_can_show_count", True):
-    tab_names.append("件数")
-    tab_functions.append(
-        lambda: render_counts_tab(
-            es=es,
-            query=query,
-            jichitai=jichitai,
-            pref_master=pref_master,
-            catmap=catmap,
-            short_unique=sidebar_config["short_unique"],
-            filtered_codes=sidebar_config["filtered_codes"],  # UIで選択された自治体
-            restricted_codes=sidebar_config["restrictions"]["allowed_codes"],  # ベースクエリの制限
-            selected_city_types=sidebar_config["selected_city_types"]  # UIで選択された自治体区分
-        )
+with span("get_es_client"):
+    es = get_es_client()
+
+# この再実行の検索に識別子を付け、同じセッションの前の再実行の検索が残っていれば取り消す
+start_search_run(es, rerun_trace.session_id, rerun_trace.run_id)
+
+try:
+    # ====== サイドバー構築 ======
+    sidebar_config = build_sidebar(jichitai, catmap)
+    
+    # ====== クエリ構築 ======
+    query = build_search_query(
+        and_words=sidebar_config["and_words"],
+        or_words=sidebar_config["or_words"],
+        not_words=sidebar_config["not_words"],
+        years=sidebar_config["selected_years"],
+        codes=sidebar_config["codes_for_query"],
+        categories=sidebar_config["sel_categories"],
+        search_fields=sidebar_config["search_fields"],
+        base_query=sidebar_config["restrictions"]["base_query"],
+        can_modify_query=sidebar_config["restrictions"]["can_modify_query"],  # 追加
+        base_filter=sidebar_config["restriction_context"].base_filter  # ログイン時に分類済み
     )
-
-# 最新収集月タブ（権限がある場合のみ）
-if st.session_state.get("user_can_show_latest", True):
-    tab_names.append("最新収集月")
-    tab_functions.append(
-        lambda: render_latest_tab(
-            es=es,
-            query=query,
-            jichitai=jichitai,
-            pref_master=pref_master,
-            catmap=catmap,
-            short_unique=sidebar_config["short_unique"],
-            filtered_codes=sidebar_config["filtered_codes"],  # UIで選択された自治体
-            restricted_codes=sidebar_config["restrictions"]["allowed_codes"],  # ベースクエリの制限
-            selected_city_types=sidebar_config["selected_city_types"]  # UIで選択された自治体区分
-        )
+    
+    # ====== KPI取得 ======
+    kpi_data = fetch_kpi(es, query)
+    
+    # ====== ページヘッダー ======
+    show_page_header()
+    
+    # ====== 検索条件表示 ======
+    show_search_info(
+        and_words=sidebar_config["and_words"],
+        or_words=sidebar_config["or_words"],
+        not_words=sidebar_config["not_words"],
+        selected_years=sidebar_config["selected_years"],
+        search_fields=sidebar_config["search_fields"]
     )
-
-# AI要約タブ（権限がある場合のみ）
-if st.session_state.get("user_can_show_summary", True):
-    tab_names.append("🤖 AI要約")
-    tab_functions.append(
-        lambda: render_summary_tab(
+    
+    # ====== KPI表示 ======
+    with span("show_kpi_metrics"):
+        show_kpi_metrics(kpi_data)
+    
+    # ====== タブ表示（権限で動的に制御） ======
+    # ユーザー権限に基づいてタブを動的に構築
+    tab_names = ["検索結果"]
+    tab_functions = [
+        lambda: render_results_tab(
             es=es,
             query=query,
             jichitai=jichitai,
             catmap=catmap,
             result_limit=sidebar_config["result_limit"]
         )
-    )
-
-# タブを作成
-tabs = st.tabs(tab_names)
-
-# 各タブの内容をレンダリング
-for tab, render_func in zip(tabs, tab_functions):
-    with tab:
-        render_func()
\ No newline at end of file
+    ]
+    
+    # 件数タブ（権限がある場合のみ）
+    if st.session_state.get("user_can_show_count", True):
+        tab_names.append("件数")
+        tab_functions.append(
+            lambda: render_counts_tab(
+                es=es,
+                query=query,
+                jichitai=jichitai,
+                pref_master=pref_master,
+                catmap=catmap,
+                short_unique=sidebar_config["short_unique"],
+                filtered_codes=sidebar_config["filtered_codes"],  # UIで選択された自治体
+                restricted_codes=sidebar_config["restrictions"]["allowed_codes"],  # ベースクエリの制限
+                selected_city_types=sidebar_config["selected_city_types"]  # UIで選択された自治体区分
+            )
+        )
+    
+    # 最新収集月タブ（権限がある場合のみ）
+    if st.session_state.get("user_can_show_latest", True):
+        tab_names.append("最新収集月")
+        tab_functions.append(
+            lambda: render_latest_tab(
+                es=es,
+                query=query,
+                jichitai=jichitai,
+                pref_master=pref_master,
+                catmap=catmap,
+                short_unique=sidebar_config["short_unique"],
+                filtered_codes=sidebar_config["filtered_codes"],  # UIで選択された自治体
+                restricted_codes=sidebar_config["restrictions"]["allowed_codes"],  # ベースクエリの制限
+                selected_city_types=sidebar_config["selected_city_types"]  # UIで選択された自治体区分
+            )
+        )
+    
+    # AI要約タブ（権限がある場合のみ）
+    if st.session_state.get("user_can_show_summary", True):
+        tab_names.append("🤖 AI要約")
+        tab_functions.append(
+            lambda: render_summary_tab(
+                es=es,
+                query=query,
+                jichitai=jichitai,
+                catmap=catmap,
+                result_limit=sidebar_config["result_limit"],
+                total_hits=kpi_data["total_pages"]
+            )
+        )
+    
+    # タブを作成
+    tabs = st.tabs(tab_names)
+    
+    # 各タブの内容をレンダリング
+    for tab_name, tab, render_func in zip(tab_names, tabs, tab_functions):
+        with tab, span(f"タブ: {tab_name}"):
+            render_func()
+finally:
+    # st.stop()・再実行・置き換えで途中終了した場合も管理から外す
+    finish_search_run()
+
+# ====== 処理時間の内訳・接続プールの状況（運用担当者のみ） ======
+trace = finish_trace()
+if is_operator():
+    show_trace_panel(trace)
+    show_pool_panel()
\ No newline at end of file
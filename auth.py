@@ -5,7 +5,7 @@ GCSからauth.xlsxを読み込んでユーザー認証を実施
 
 import streamlit as st
 from config import get_secret
-from gcs_loader import load_auth_from_gcs
+from gcs_loader import get_auth_store, get_query_store, load_auth_from_gcs
 
 
 def check_password() -> bool:
@@ -23,24 +23,26 @@ def check_password() -> bool:
     if st.session_state.get("_authed", False):
         return True
     
-    # GCSからauth.xlsxを読み込み
+    # GCSからauth.xlsxを読み込み（世代が変わった場合のみ再読み込み）
     auth_df = load_auth_from_gcs()
     
     # auth.xlsxが存在する場合 → ユーザー管理モード
     if auth_df is not None and not auth_df.empty:
-        return _auth_with_user_db(auth_df)
+        # ログイン後すぐ使うクエリファイルを入力中に先読み
+        get_query_store().warm_up()
+        return _auth_with_user_db(get_auth_store())
     
     # auth.xlsxが無い場合 → 簡易認証モード
     else:
         return _auth_with_simple_password()
 
 
-def _auth_with_user_db(auth_df) -> bool:
+def _auth_with_user_db(auth_store) -> bool:
     """
     auth.xlsxを使ったユーザー認証
     
     Args:
-        auth_df: 認証データベース（DataFrame）
+        auth_store: 認証データ（ユーザー名の索引付き）
     
     Returns:
         bool: 認証成功ならTrue
@@ -63,18 +65,14 @@ def _auth_with_user_db(auth_df) -> bool:
             submit = st.button("ログイン", use_container_width=True)
         
         if submit:
-            # ユーザー検索
-            user_row = auth_df[
-                (auth_df["username"] == username) &
-                (auth_df["password"] == password) &
-                (auth_df["enabled"] == True)
-            ]
+            # ユーザー検索（ユーザー名の索引を参照）
+            user_info = auth_store.authenticate(username, password)
             
-            if not user_row.empty:
+            if user_info is not None:
                 # 認証成功
-                user_info = user_row.iloc[0]
                 
                 st.session_state["_authed"] = True
+                st.session_state["user_name"] = username
                 st.session_state["user_display_name"] = user_info["display_name"]
                 
                 # query_fileが空欄（NaN, None, 空文字列）の場合はNoneを設定
@@ -143,6 +141,7 @@ def _auth_with_simple_password() -> bool:
         if submit:
             if pw == required_pw:
                 st.session_state["_authed"] = True
+                st.session_state["user_name"] = "guest"
                 st.session_state["user_display_name"] = "ゲスト"
                 st.session_state["user_query_file"] = None
                 st.session_state["user_openai_api_key"] = None  # 簡易認証の場合はNone
@@ -155,4 +154,17 @@ def _auth_with_simple_password() -> bool:
             else:
                 st.error("パスワードが違います。")
     
-    return False
\ No newline at end of file
+    return False
+
+
+def is_operator() -> bool:
+    """
+    ログイン中のユーザーが運用担当者か判定
+    
+    Secretsの OPERATOR_USERS（カンマ区切りのユーザー名）に含まれるユーザーを運用担当者とする
+    
+    Returns:
+        bool: 運用担当者ならTrue
+    """
+    operators = {name.strip() for name in str(get_secret("OPERATOR_USERS")).split(",") if name.strip()}
+    return st.session_state.get("user_name") in operators
@@ -0,0 +1,168 @@
+"""
+バッチ分割モジュール
+文書ごとのトークン数を計測し、トークン予算いっぱいまでバッチに詰める（自治体・都道府県単位の分割にも対応）
+"""
+
+from typing import Callable, List
+
+
+def pack_batches(
+    documents: List[dict],
+    token_budget: int,
+    count_doc_tokens: Callable[[dict], int],
+    group_key: str = "団体コード",
+    max_docs_per_batch: int = 0
+) -> List[List[dict]]:
+    """
+    トークン予算に収まるように文書をバッチに分割（同じ自治体の文書はなるべく同じバッチに入れる）
+    
+    文書の並び順は維持する。1自治体の文書だけで予算を超える場合はその自治体を複数バッチに分割する
+    
+    Args:
+        documents: 文書のリスト（group_keyで並び替え済み）
+        token_budget: 1バッチあたりの文書部分のトークン予算
+        count_doc_tokens: 文書1件のトークン数を返す関数
+        group_key: まとめて扱うキー（団体コード）
+        max_docs_per_batch: 1バッチあたりの最大文書数（0なら無制限）
+    
+    Returns:
+        List[List[dict]]: バッチごとの文書リスト
+    """
+    # 連続する同一自治体の文書をグループ化
+    groups = []
+    for doc in documents:
+        tokens = count_doc_tokens(doc)
+        if groups and groups[-1]["key"] == doc.get(group_key):
+            groups[-1]["docs"].append((doc, tokens))
+            groups[-1]["tokens"] += tokens
+        else:
+            groups.append({"key": doc.get(group_key), "docs": [(doc, tokens)], "tokens": tokens})
+    
+    def fits(batch_tokens: int, batch_len: int, add_tokens: int, add_len: int) -> bool:
+        if max_docs_per_batch and batch_len + add_len > max_docs_per_batch:
+            return False
+        return batch_tokens + add_tokens <= token_budget
+    
+    batches = []
+    current, current_tokens = [], 0
+    for group in groups:
+        # 自治体ごと現在のバッチに入る場合
+        if fits(current_tokens, len(current), group["tokens"], len(group["docs"])):
+            current.extend(doc for doc, _ in group["docs"])
+            current_tokens += group["tokens"]
+            continue
+        
+        # 新しいバッチなら自治体ごと入る場合
+        if current and fits(0, 0, group["tokens"], len(group["docs"])):
+            batches.append(current)
+            current = [doc for doc, _ in group["docs"]]
+            current_tokens = group["tokens"]
+            continue
+        
+        # 1自治体で予算を超える場合は文書単位で詰める
+        for doc, tokens in group["docs"]:
+            if current and not fits(current_tokens, len(current), tokens, 1):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(doc)
+            current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _group_consecutive(items: list, key: Callable) -> list:
+    """連続して同じキーを持つ要素をまとめる"""
+    groups = []
+    for item in items:
+        if groups and key(groups[-1][0]) == key(item):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+
+def pack_batches_by_entity(
+    documents: List[dict],
+    token_budget: int,
+    count_doc_tokens: Callable[[dict], int],
+    group_key: str = "団体コード",
+    parent_key: str = "都道府県"
+) -> List[List[dict]]:
+    """
+    自治体単位でバッチに分割（各バッチが自治体を丸ごと受け持ち、統合は連結で済むようにする）
+    
+    都道府県ごと予算に収まる場合は都道府県単位でまとめ、収まらない場合は自治体単位で詰める。
+    1自治体だけで予算を超える場合のみ、その自治体を連続する複数バッチに分割する（find_split_groupsで検出）
+    
+    Args:
+        documents: 文書のリスト（group_keyで並び替え済み）
+        token_budget: 1バッチあたりの文書部分のトークン予算
+        count_doc_tokens: 文書1件のトークン数を返す関数
+        group_key: 自治体を表すキー（団体コード）
+        parent_key: 小さな自治体をまとめる単位のキー（都道府県）
+    
+    Returns:
+        List[List[dict]]: バッチごとの文書リスト
+    """
+    batches = []
+    current, current_tokens = [], 0
+    
+    def place(docs: list, tokens: int) -> bool:
+        """文書のまとまりを現在のバッチか新しいバッチに丸ごと入れる（入らなければFalse）"""
+        nonlocal current, current_tokens
+        if current_tokens + tokens <= token_budget:
+            current.extend(docs)
+            current_tokens += tokens
+            return True
+        if tokens <= token_budget:
+            batches.append(current)
+            current, current_tokens = list(docs), tokens
+            return True
+        return False
+    
+    with_tokens = [(doc, count_doc_tokens(doc)) for doc in documents]
+    for parent in _group_consecutive(with_tokens, lambda item: item[0].get(parent_key)):
+        if place([doc for doc, _ in parent], sum(tokens for _, tokens in parent)):
+            continue
+        for entity in _group_consecutive(parent, lambda item: item[0].get(group_key)):
+            if place([doc for doc, _ in entity], sum(tokens for _, tokens in entity)):
+                continue
+            # 1自治体で予算を超える場合は新しいバッチから文書単位で詰める
+            if current:
+                batches.append(current)
+                current, current_tokens = [], 0
+            for doc, tokens in entity:
+                if current and current_tokens + tokens > token_budget:
+                    batches.append(current)
+                    current, current_tokens = [], 0
+                current.append(doc)
+                current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    return [batch for batch in batches if batch]
+
+
+def find_split_groups(batches: List[List[dict]], group_key: str = "団体コード") -> List[List[int]]:
+    """
+    同じ自治体を分け合っている連続したバッチをまとめる
+    
+    Args:
+        batches: バッチごとの文書リスト
+        group_key: 自治体を表すキー（団体コード）
+    
+    Returns:
+        List[List[int]]: バッチ番号のグループ（自治体を丸ごと受け持つバッチは1件だけのグループ）
+    """
+    groups = []
+    for batch_idx, batch in enumerate(batches):
+        if (
+            groups and batch and batches[batch_idx - 1]
+            and batches[batch_idx - 1][-1].get(group_key) == batch[0].get(group_key)
+        ):
+            groups[-1].append(batch_idx)
+        else:
+            groups.append([batch_idx])
+    return groups
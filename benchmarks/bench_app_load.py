@@ -0,0 +1,579 @@
+"""
+アプリ全体の同時利用の負荷試験
+Streamlit の AppTest で app.py をヘッドレスに実行し、複数の利用者が
+ログイン → 検索条件の変更 → タブ内の表示切替 → AI要約 を行うシナリオを同時に実行して、
+同時利用者数ごとの再実行の所要時間（パーセンタイル）・スループット・1セッションあたりのメモリ・キャッシュ利用率を計測
+
+Elasticsearch・GCS・OpenAI はローカルの代替（es_stub・ローカルディレクトリの保存先・openai_stub）を使うため、外部への接続は不要
+全セッションを1つのプロセスのスレッドで実行するため、アプリの1レプリカ（1プロセス）の性能に相当する
+
+使い方:
+    python -m benchmarks.bench_app_load --concurrency 1,4,8 --pages 300000 --json load.jsonl
+    python -m benchmarks.bench_app_load --concurrency 8 --summary-rate 0.5 --think-ms 1000 --es-latency-ms 20
+"""
+
+import argparse
+import gc
+import io
+import json
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+
+from benchmarks.es_corpus import Corpus, CorpusConfig, load_masters
+from benchmarks.es_stub import ESStubConfig, ESStubServer
+from benchmarks.openai_stub import StubConfig, StubServer
+from elasticsearch_client import get_pool_stats, reset_pool_stats
+from gcs_loader import AUTH_BLOB_NAME, QUERY_PREFIX
+from storage_backend import LocalBackend
+
+
+APP_PATH = str(Path(__file__).resolve().parent.parent / "app.py")
+JOB_POLL_SECONDS = 1.0  # 要約ジョブの実行中に画面を再実行する間隔（summary_tab の JOB_POLL_INTERVAL と同じ）
+PASSWORD = "load-test"
+
+# 検索に使うキーワード（合成コーパスの政策分野。利用者間で重なるほどキャッシュが効く）
+KEYWORDS = ["子育て", "防災", "脱炭素", "高齢者", "公共交通", "DX", "観光", "移住", "地域医療", "学校教育"]
+
+# ウィジェットのラベル（sidebar.py）
+AND_LABEL = "AND条件(スペース区切り)"
+YEAR_LABEL = "年度(複数選択可)"
+
+
+def make_accounts(root: str, jichitai: pd.DataFrame, users: int, seed: int = 0) -> List[str]:
+    """
+    負荷試験用のauth.xlsxとクエリファイルを保存先ディレクトリに書き出す
+    
+    3人に1人は都道府県単位のクエリファイルで自治体を制限し、そのうち半数は検索条件の変更を不可とする
+    
+    Args:
+        root: 保存先ディレクトリ（STORAGE_LOCAL_DIR）
+        jichitai: 自治体マスターデータ
+        users: 利用者数
+        seed: 乱数シード
+    
+    Returns:
+        List[str]: ユーザー名のリスト（パスワードは共通）
+    """
+    rng = random.Random(seed)
+    backend = LocalBackend(root)
+    prefs = sorted(jichitai["affiliation_code"].unique())
+    rows = []
+    for i in range(users):
+        query_file = ""
+        if i % 3 == 0:
+            pref = rng.choice(prefs)
+            codes = jichitai.loc[jichitai["affiliation_code"] == pref, "code"].tolist()
+            query_file = f"load_{i:04d}.json"
+            query = {"query": {"bool": {"must": [{"terms": {"code": codes}}]}}}
+            backend.write(f"{QUERY_PREFIX}{query_file}", json.dumps(query, ensure_ascii=False).encode("utf-8"))
+        rows.append({
+            "username": f"load{i:04d}",
+            "password": PASSWORD,
+            "display_name": f"負荷試験{i}",
+            "query_file": query_file,
+            "can_modify_query": "FALSE" if query_file and i % 2 else "",
+            "enabled": "TRUE",
+            "can_show_count": "",
+            "can_show_latest": "",
+            "can_show_summary": "",
+            "openai_api_key": "",
+        })
+    output = io.BytesIO()
+    pd.DataFrame(rows).to_excel(output, index=False)
+    backend.write(AUTH_BLOB_NAME, output.getvalue())
+    return [row["username"] for row in rows]
+
+
+def install_shared_runtime():
+    """
+    AppTest を複数のスレッドで同時に実行できるようにする
+    
+    AppTest は実行のたびに Streamlit の Runtime を作り直し、終了時に消すため、
+    同時に実行すると他のセッションの実行中に Runtime が無くなる。
+    サーバーの1プロセスと同じく全セッションで共有する Runtime を1つ設定し、AppTest からの差し替えは無効にする
+    （Streamlit の内部構造に依存するため、Streamlit の更新時は動作を確認すること）
+    """
+    from unittest.mock import MagicMock
+    
+    from streamlit import config
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+    
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    components = BidiComponentManager()
+    components.discover_and_register_components(start_file_watching=False)
+    runtime.bidi_component_registry = components
+    Runtime._instance = runtime
+    
+    # AppTest が実行ごとに設定・削除する Runtime は、実際の Runtime とは別のクラスに向ける
+    app_test.Runtime = type("AppTestRuntime", (), {"_instance": None})
+    config.set_option("global.appTest", True)
+
+
+def configure_secrets(values: Dict[str, str]):
+    """
+    全セッション共通のSecretsを設定（AppTest.secrets は実行ごとに全体を差し替えるため、同時実行では使わない）
+    
+    Args:
+        values: Secretsの値
+    """
+    from streamlit.runtime.secrets import Secrets
+    
+    secrets = Secrets()
+    secrets._secrets = dict(values)
+    st.secrets = secrets
+
+
+def rss_mb() -> float:
+    """プロセスの現在のメモリ使用量（RSS、MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        # /proc が無い環境は最大RSSで代用（macOSはバイト、Linuxはキロバイト）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def state_mb(app) -> float:
+    """
+    セッション状態のおおよそのサイズ（MB、DataFrameは内容を含めて計算）
+    
+    Args:
+        app: AppTest
+    
+    Returns:
+        float: サイズ（MB）
+    """
+    def size_of(value, seen: set) -> int:
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(size_of(k, seen) + size_of(v, seen) for k, v in value.items())
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return sys.getsizeof(value) + sum(size_of(v, seen) for v in value)
+        return sys.getsizeof(value)
+    
+    state = {key: app.session_state[key] for key in app.session_state}
+    return size_of(state, set()) / 1024 / 1024
+
+
+def _percentiles(values: List[float]) -> dict:
+    """p50 / p90 / p99 / 最大（ミリ秒）"""
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+    
+    def pick(q: float) -> float:
+        return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 1)
+    
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1], 1)}
+
+
+def _find(widgets, label: str):
+    """ラベルでウィジェットを取得"""
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"widget not found: {label}")
+
+
+class UserSession:
+    """
+    1人の利用者のシナリオ（ログイン → 検索条件の変更 → タブ内の表示切替 → AI要約）
+    
+    画面操作ごとに1回の再実行を行い、所要時間を記録する
+    """
+    
+    def __init__(self, username: str, rng: random.Random, think: float, timeout: float):
+        """
+        Args:
+            username: ログインするユーザー名
+            rng: 乱数生成器（キーワード・年度の選択）
+            think: 操作の間の待ち時間（秒）
+            timeout: 1回の再実行のタイムアウト（秒）
+        """
+        from streamlit.testing.v1 import AppTest
+        
+        self.username = username
+        self.rng = rng
+        self.think = think
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.records: List[dict] = []
+        self.summary_seconds: Optional[float] = None
+    
+    def step(self, name: str, action) -> bool:
+        """
+        画面操作を1回実行して所要時間を記録
+        
+        Args:
+            name: 操作名
+            action: 操作（再実行を含む）
+        
+        Returns:
+            bool: エラーなく完了したか
+        """
+        started = time.perf_counter()
+        error = ""
+        try:
+            action()
+            if self.app.exception:
+                error = str(self.app.exception[0].value)[:200]
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+        self.records.append({
+            "step": name,
+            "ms": (time.perf_counter() - started) * 1000,
+            "error": error,
+        })
+        if self.think:
+            time.sleep(self.think)
+        return not error
+    
+    def run(self, rounds: int, summary: bool, summary_timeout: float):
+        """
+        シナリオを実行
+        
+        Args:
+            rounds: 検索条件の変更〜表示切替を繰り返す回数
+            summary: AI要約を実行するか
+            summary_timeout: 要約ジョブの完了を待つ上限（秒）
+        """
+        app = self.app
+        if not self.step("open", app.run):
+            return
+        
+        def login():
+            _find(app.text_input, "ユーザー名").input(self.username)
+            _find(app.text_input, "パスワード").input(PASSWORD)
+            _find(app.button, "ログイン").click().run()
+        
+        if not self.step("login", login):
+            return
+        
+        for _ in range(rounds):
+            keyword = self.rng.choice(KEYWORDS)
+            year = self.rng.randint(2015, 2025)
+            self.step("search", lambda: _find(app.sidebar.text_input, AND_LABEL).input(keyword).run())
+            self.step("year", lambda: _find(app.sidebar.multiselect, YEAR_LABEL).set_value([year]).run())
+            self.step("counts_unit", lambda: app.radio(key="counts_display_unit").set_value(
+                self.rng.choice(["都道府県", "市区町村"])).run())
+            self.step("counts_mode", lambda: app.radio(key="counts_count_mode").set_value(
+                self.rng.choice(["ファイル数", "ページ数"])).run())
+            self.step("latest_unit", lambda: app.radio(key="latest_display_unit").set_value(
+                self.rng.choice(["都道府県", "市区町村"])).run())
+        
+        if summary:
+            self._run_summary(summary_timeout)
+    
+    def _run_summary(self, timeout: float):
+        """AI要約を実行し、完了するまで画面の再実行（進捗表示）を続ける"""
+        from summary_jobs import get_job_manager
+        
+        app = self.app
+        started = time.perf_counter()
+        if not self.step("summary_start", lambda: app.button(key="execute_summary_button").click().run()):
+            return
+        job_id = app.session_state["summary_job_id"] if "summary_job_id" in app.session_state else None
+        if job_id is None:
+            return
+        job_manager = get_job_manager()
+        while time.perf_counter() - started < timeout:
+            job = job_manager.get(job_id)
+            if job is None or job.is_finished:
+                break
+            time.sleep(JOB_POLL_SECONDS)
+            self.step("summary_poll", app.run)
+        self.step("summary_result", app.run)
+        self.summary_seconds = time.perf_counter() - started
+
+
+def cache_hit_rates(trace_path: str, since: float) -> Dict[str, dict]:
+    """
+    スパンの記録から、キャッシュを使う処理ごとの利用率を集計
+    
+    Args:
+        trace_path: スパンの記録ファイル（TRACE_PATH）
+        since: 集計対象とする再実行の開始時刻（epoch秒）
+    
+    Returns:
+        Dict[str, dict]: 処理名 → {"hits", "calls", "rate"}（"全体" は合計）
+    """
+    counts: Dict[str, list] = {}
+    try:
+        with open(trace_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                cache = (record.get("attrs") or {}).get("cache")
+                if cache is None or record.get("rerun_started_at", 0) < since:
+                    continue
+                hits, calls = counts.setdefault(record["name"], [0, 0])
+                counts[record["name"]] = [hits + (cache == "hit"), calls + 1]
+    except OSError:
+        return {}
+    result = {
+        name: {"hits": hits, "calls": calls, "rate": round(hits / calls, 3)}
+        for name, (hits, calls) in sorted(counts.items())
+    }
+    hits = sum(v["hits"] for v in result.values())
+    calls = sum(v["calls"] for v in result.values())
+    result["全体"] = {"hits": hits, "calls": calls, "rate": round(hits / calls, 3) if calls else 0.0}
+    return result
+
+
+def run_level(
+    concurrency: int,
+    usernames: List[str],
+    args: argparse.Namespace,
+    es_server: ESStubServer,
+    openai_server: StubServer,
+    secrets: Dict[str, str],
+    root: Path,
+) -> dict:
+    """
+    同時利用者数1段階分の負荷試験
+    
+    Args:
+        concurrency: 同時利用者数
+        usernames: ログインに使うユーザー名
+        args: コマンドライン引数
+        es_server: Elasticsearchのスタブ
+        openai_server: OpenAIのスタブ
+        secrets: Secretsの値（段階ごとにAI要約のキャッシュ先を変える）
+        root: 作業ディレクトリ
+    
+    Returns:
+        dict: 計測結果
+    """
+    from gcs_loader import get_storage_backend
+    from llm_cache import get_llm_cache
+    
+    # 段階ごとに検索・集計のキャッシュとAI要約のキャッシュを空にする（--warm で前の段階のキャッシュを引き継ぐ）
+    if not args.warm:
+        st.cache_data.clear()
+        configure_secrets({**secrets, "LLM_CACHE_DIR": str(root / "llm" / f"x{concurrency}")})
+        get_llm_cache.clear()
+    es_server.reset()
+    reset_pool_stats()
+    openai_server.reset()
+    storage = get_storage_backend()
+    storage_before = {op: s["calls"] for op, s in storage.stats.snapshot().items()}
+    
+    rng = random.Random(args.seed + concurrency)
+    sessions = [
+        UserSession(usernames[i % len(usernames)], random.Random(rng.random()), args.think_ms / 1000, args.timeout)
+        for i in range(concurrency)
+    ]
+    summary_flags = [rng.random() < args.summary_rate for _ in sessions]
+    failures = []
+    
+    def worker(index: int):
+        time.sleep(args.ramp * index / max(concurrency, 1))
+        try:
+            sessions[index].run(args.rounds, summary_flags[index], args.summary_timeout)
+        except Exception:
+            failures.append(traceback.format_exc())
+    
+    gc.collect()
+    rss_before = rss_mb()
+    since = time.time()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), name=f"load-user-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = rss_mb()
+    
+    records = [r for s in sessions for r in s.records]
+    latencies = [r["ms"] for r in records]
+    errors = [r for r in records if r["error"]]
+    by_step = {}
+    for name in dict.fromkeys(r["step"] for r in records):
+        by_step[name] = {"count": sum(r["step"] == name for r in records),
+                         **_percentiles([r["ms"] for r in records if r["step"] == name])}
+    summaries = [s.summary_seconds for s in sessions if s.summary_seconds is not None]
+    storage_after = storage.stats.snapshot()
+    
+    result = {
+        "concurrency": concurrency,
+        "sessions": concurrency,
+        "reruns": len(records),
+        "errors": len(errors) + len(failures),
+        "error_samples": sorted({r["error"] for r in errors})[:3] + [f.splitlines()[-1] for f in failures[:3]],
+        "elapsed_seconds": round(elapsed, 2),
+        "reruns_per_second": round(len(records) / elapsed, 3) if elapsed else 0.0,
+        "rerun_ms": _percentiles(latencies),
+        "by_step": by_step,
+        "summary_runs": len(summaries),
+        "summary_seconds_avg": round(sum(summaries) / len(summaries), 2) if summaries else None,
+        "rss_mb_before": round(rss_before, 1),
+        "rss_mb_after": round(rss_after, 1),
+        "rss_mb_per_session": round((rss_after - rss_before) / concurrency, 2),
+        "state_mb_per_session": round(sum(state_mb(s.app) for s in sessions) / concurrency, 3),
+        "cache": cache_hit_rates(secrets["TRACE_PATH"], since),
+        "es_requests": es_server.stats.requests,
+        "es_search_ms": round(es_server.stats.search_ms, 1),
+        "es_bytes_sent": es_server.stats.bytes_sent,
+        "es_pool": get_pool_stats(),
+        "openai_requests": openai_server.stats.requests,
+        "openai_cached_tokens": openai_server.stats.cached_tokens,
+        "storage_calls": {
+            op: s["calls"] - storage_before.get(op, 0) for op, s in storage_after.items()
+        },
+    }
+    # セッションを解放してから次の段階へ
+    sessions.clear()
+    gc.collect()
+    return result
+
+
+def format_result(result: dict) -> str:
+    """計測結果の表示用の文字列"""
+    ms = result["rerun_ms"]
+    cache = result["cache"]
+    cache_text = ", ".join(
+        f"{name} {v['rate'] * 100:.0f}%" for name, v in cache.items() if name != "全体"
+    )
+    lines = [
+        f"[x{result['concurrency']:<3}] {result['reruns']} reruns ({result['errors']} errors) "
+        f"in {result['elapsed_seconds']:.1f}s, {result['reruns_per_second']:.2f} rerun/s | "
+        f"rerun p50 {ms['p50']:.0f}ms / p90 {ms['p90']:.0f}ms / p99 {ms['p99']:.0f}ms / max {ms['max']:.0f}ms",
+        f"        memory: RSS {result['rss_mb_before']:.0f} → {result['rss_mb_after']:.0f}MB "
+        f"(+{result['rss_mb_per_session']:.1f}MB/session), session_state {result['state_mb_per_session']:.3f}MB/session",
+        f"        cache: {cache.get('全体', {}).get('rate', 0) * 100:.0f}% ({cache_text})",
+        f"        backends: ES {result['es_requests']} requests ({result['es_search_ms']:.0f}ms), "
+        f"OpenAI {result['openai_requests']} requests, storage {result['storage_calls']}",
+    ]
+    for node in result["es_pool"]:
+        lines.append(
+            f"        es pool {node['node']}: peak {node['peak_in_flight']}/{node['pool_size']} in flight, "
+            f"{node['connections_opened']} connections, {node['waited']} waited, {node['failures']} failures, "
+            f"avg {node['avg_ms']:.0f}ms"
+        )
+    if result["summary_runs"]:
+        lines.append(f"        summary: {result['summary_runs']} runs, avg {result['summary_seconds_avg']:.1f}s")
+    for name, step in result["by_step"].items():
+        lines.append(
+            f"        {name:<15} n={step['count']:<4} p50 {step['p50']:>7.0f}ms  p90 {step['p90']:>7.0f}ms  "
+            f"max {step['max']:>7.0f}ms"
+        )
+    for sample in result["error_samples"]:
+        lines.append(f"        error: {sample}")
+    return "\n".join(lines)
+
+
+def main():
+    """コマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="アプリ全体の同時利用の負荷試験（AppTest・ローカルの代替サーバー使用）")
+    parser.add_argument("--concurrency", default="1,4,8", help="同時利用者数（カンマ区切り）")
+    parser.add_argument("--users", type=int, default=30, help="auth.xlsx に登録する利用者数")
+    parser.add_argument("--rounds", type=int, default=2, help="1セッションで検索条件の変更〜表示切替を繰り返す回数")
+    parser.add_argument("--summary-rate", type=float, default=0.25, help="AI要約を実行するセッションの割合")
+    parser.add_argument("--summary-timeout", type=float, default=300.0)
+    parser.add_argument("--think-ms", type=float, default=500.0, help="操作の間の待ち時間（ミリ秒）")
+    parser.add_argument("--ramp", type=float, default=2.0, help="全セッションの開始をずらす時間（秒）")
+    parser.add_argument("--timeout", type=float, default=300.0, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--warm", action="store_true", help="段階ごとにキャッシュを空にしない")
+    parser.add_argument("--pages", type=int, default=300_000, help="合成コーパスのページ数")
+    parser.add_argument("--es-latency-ms", type=float, default=5.0)
+    parser.add_argument("--es-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--storage-latency-ms", type=int, default=0, help="保存先（GCSの代替）の1操作あたりの遅延")
+    parser.add_argument("--openai-latency-mean", type=float, default=0.3, help="初回トークンまでの平均秒数")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="結果をJSON Lines形式で書き出すファイル")
+    parser.add_argument("--keep-workdir", action="store_true", help="作業ディレクトリ（記録・キャッシュ）を削除しない")
+    args = parser.parse_args()
+    
+    from streamlit.logger import set_log_level
+    
+    # Streamlitの実行環境外の警告・非推奨の警告を抑止
+    set_log_level("error")
+    install_shared_runtime()
+    
+    root = Path(tempfile.mkdtemp(prefix="gfinder-load-"))
+    jichitai, catmap = load_masters()
+    usernames = make_accounts(str(root / "storage"), jichitai, args.users, seed=args.seed)
+    
+    started = time.perf_counter()
+    corpus = Corpus(jichitai, catmap, CorpusConfig(pages=args.pages, seed=args.seed))
+    print(f"コーパス: {corpus.describe()}（{time.perf_counter() - started:.1f}秒）")
+    es_server = ESStubServer(corpus, ESStubConfig(
+        latency_ms=args.es_latency_ms, jitter_ms=args.es_jitter_ms, seed=args.seed
+    )).start()
+    openai_server = StubServer(StubConfig(
+        latency_mean=args.openai_latency_mean,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed,
+    )).start()
+    
+    secrets = {
+        "ES_HOST": es_server.base_url,
+        "ES_USERNAME": "load-test",
+        "ES_PASSWORD": "load-test",
+        "STORAGE_BACKEND": "local",
+        "STORAGE_LOCAL_DIR": str(root / "storage"),
+        "STORAGE_LATENCY_MS": str(args.storage_latency_ms),
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": openai_server.base_url,
+        "LLM_CACHE_DIR": str(root / "llm" / "shared"),
+        "LLM_TELEMETRY_PATH": str(root / "telemetry.jsonl"),
+        "SUMMARY_JOB_DIR": str(root / "jobs"),
+        "TRACE_PATH": str(root / "spans.jsonl"),
+        "TRACE_MAX_RECORDS": "200000",
+    }
+    configure_secrets(secrets)
+    
+    results = []
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            result = run_level(concurrency, usernames, args, es_server, openai_server, secrets, root)
+            results.append(result)
+            print(format_result(result), flush=True)
+    finally:
+        es_server.stop()
+        openai_server.stop()
+        if args.keep_workdir:
+            print(f"作業ディレクトリ: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+ログイン・ユーザー制限の読み込みのベンチマーク
+auth.xlsx とクエリファイルを合成し、保存先（ローカル / メモリ、遅延・エラーの注入あり）ごとに
+初回読み込み・ログイン・クエリ取得・更新確認の所要時間と、保存先の操作回数を計測（GCSへの接続は不要）
+
+使い方:
+    python -m benchmarks.bench_auth_loading --users 500 --backends local,memory --latency-ms 0,50
+    python -m benchmarks.bench_auth_loading --error-rate 0.1 --json results.jsonl
+"""
+
+import argparse
+import io
+import json
+import random
+import tempfile
+import time
+from typing import List
+
+import pandas as pd
+
+from gcs_loader import AUTH_BLOB_NAME, QUERY_PREFIX, AuthStore, QueryFileStore
+from storage_backend import LocalBackend, MemoryBackend, StorageBackend, StorageFaults, load_directory
+
+
+def make_auth_files(root: str, users: int, query_files: int, seed: int = 0) -> List[dict]:
+    """
+    合成したauth.xlsxとクエリファイルをディレクトリに書き出す
+    
+    Args:
+        root: 書き出し先ディレクトリ
+        users: ユーザー数
+        query_files: クエリファイル数（ユーザーに順番に割り当てる）
+        seed: 乱数シード
+    
+    Returns:
+        List[dict]: ユーザーのリスト（username, password, query_file）
+    """
+    rng = random.Random(seed)
+    backend = LocalBackend(root)
+    for i in range(query_files):
+        codes = sorted({f"{rng.randint(1, 47):02d}{rng.randint(0, 9999):04d}" for _ in range(rng.randint(5, 200))})
+        query = {"query": {"bool": {"must": [{"terms": {"code": codes}}, {"terms": {"category": [11, 12]}}]}}}
+        backend.write(f"{QUERY_PREFIX}user_{i:04d}.json", json.dumps(query, ensure_ascii=False).encode("utf-8"))
+    
+    rows = []
+    for i in range(users):
+        rows.append({
+            "username": f"user{i:05d}",
+            "password": f"pw{i:05d}",
+            "display_name": f"ユーザー{i}",
+            "query_file": f"user_{i % query_files:04d}.json" if query_files and i % 3 else "",
+            "can_modify_query": "FALSE" if i % 2 else "",
+            "enabled": "TRUE",
+            "can_show_count": "",
+            "can_show_latest": "",
+            "can_show_summary": "FALSE",
+            "openai_api_key": "",
+        })
+    output = io.BytesIO()
+    pd.DataFrame(rows).to_excel(output, index=False)
+    backend.write(AUTH_BLOB_NAME, output.getvalue())
+    return rows
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """パーセンタイル（ミリ秒に換算して丸める）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000, 3)
+
+
+def run_backend(backend: StorageBackend, users: List[dict], logins: int, seed: int = 0) -> dict:
+    """
+    1つの保存先でログイン・クエリ取得を計測
+    
+    Args:
+        backend: 保存先
+        users: ユーザーのリスト
+        logins: ログインを試行する回数
+        seed: 乱数シード
+    
+    Returns:
+        dict: 計測結果
+    """
+    rng = random.Random(seed)
+    auth_store = AuthStore(backend, refresh_seconds=3600)
+    query_store = QueryFileStore(backend, refresh_seconds=3600)
+    
+    # 初回読み込み（ログイン画面の表示時に同期で行う分と、バックグラウンドで先読みする分）
+    started = time.perf_counter()
+    auth_store.ensure_fresh()
+    auth_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    query_store.ensure_fresh()
+    query_seconds = time.perf_counter() - started
+    
+    # ログインとユーザー制限の取得（初回読み込み後）
+    login_times, query_times, failures = [], [], 0
+    for _ in range(logins):
+        user = rng.choice(users)
+        started = time.perf_counter()
+        record = auth_store.authenticate(user["username"], user["password"])
+        login_times.append(time.perf_counter() - started)
+        if record is None:
+            failures += 1
+            continue
+        if record["query_file"]:
+            started = time.perf_counter()
+            query_store.get(record["query_file"])
+            query_times.append(time.perf_counter() - started)
+    
+    # 内容が変わっていない場合の更新確認
+    started = time.perf_counter()
+    auth_store.refresh()
+    query_store.refresh()
+    revalidate_seconds = time.perf_counter() - started
+    
+    return {
+        "backend": backend.kind,
+        "latency_ms": round(backend.faults.latency * 1000, 1),
+        "error_rate": backend.faults.error_rate,
+        "users": len(users),
+        "query_files": len(query_store._queries),
+        "auth_load_seconds": round(auth_seconds, 4),
+        "query_load_seconds": round(query_seconds, 4),
+        "revalidate_seconds": round(revalidate_seconds, 4),
+        "login_p50_ms": _percentile(login_times, 0.5),
+        "login_p99_ms": _percentile(login_times, 0.99),
+        "query_p50_ms": _percentile(query_times, 0.5),
+        "query_p99_ms": _percentile(query_times, 0.99),
+        "login_failures": failures,
+        "auth_error": auth_store.error,
+        "query_error": query_store.error,
+        "auth_downloads": auth_store.downloads,
+        "query_downloads": query_store.downloads,
+        "storage": backend.stats.snapshot(),
+    }
+
+
+def main():
+    """コマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="ログイン・ユーザー制限の読み込みのベンチマーク（GCS不要）")
+    parser.add_argument("--users", type=int, default=500, help="ユーザー数")
+    parser.add_argument("--query-files", type=int, default=100, help="クエリファイル数")
+    parser.add_argument("--logins", type=int, default=2000, help="ログインを試行する回数")
+    parser.add_argument("--backends", default="local,memory", help="保存先（カンマ区切り: local, memory）")
+    parser.add_argument("--latency-ms", default="0,20", help="注入する遅延（ミリ秒、カンマ区切り）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入するエラーの割合（0〜1）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="結果をJSON Lines形式で書き出すファイル")
+    args = parser.parse_args()
+    
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        users = make_auth_files(root, args.users, args.query_files, seed=args.seed)
+        for kind in [k.strip() for k in args.backends.split(",") if k.strip()]:
+            for latency_ms in [float(v) for v in args.latency_ms.split(",")]:
+                faults = StorageFaults(
+                    latency=latency_ms / 1000,
+                    jitter=args.jitter_ms / 1000,
+                    error_rate=args.error_rate,
+                    seed=args.seed,
+                )
+                if kind == "local":
+                    backend = LocalBackend(root, faults=faults)
+                elif kind == "memory":
+                    backend = MemoryBackend(load_directory(root), faults=faults)
+                else:
+                    raise SystemExit(f"未対応の保存先です: {kind}")
+                result = run_backend(backend, users, args.logins, seed=args.seed)
+                results.append(result)
+                print(
+                    f"[{kind:>6} +{latency_ms:g}ms] "
+                    f"auth {result['auth_load_seconds'] * 1000:7.1f}ms / "
+                    f"query files {result['query_load_seconds'] * 1000:7.1f}ms "
+                    f"({result['query_files']} files) / "
+                    f"revalidate {result['revalidate_seconds'] * 1000:6.1f}ms / "
+                    f"login p50 {result['login_p50_ms']}ms p99 {result['login_p99_ms']}ms / "
+                    f"query p50 {result['query_p50_ms']}ms p99 {result['query_p99_ms']}ms"
+                )
+                print(f"         {backend.describe()}")
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
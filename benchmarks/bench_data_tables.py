@@ -0,0 +1,439 @@
+"""
+検索結果の整形・集計テーブル構築のマイクロベンチマーク
+全国規模の合成（または記録した）Elasticsearchの応答（検索ヒット・composite集計・KPI集計）を使い、
+data_fetcher / table_builder / sidebar / ui_components のpandas処理の所要時間とメモリ使用量を計測（ES・GCSへの接続は不要）
+
+使い方:
+    python -m benchmarks.bench_data_tables --hits 1000,10000 --repeat 5 --json bench_tables.jsonl
+    python -m benchmarks.bench_data_tables --save-fixtures fixtures.json          # 合成した応答を保存
+    python -m benchmarks.bench_data_tables --fixtures fixtures.json --baseline bench_tables.jsonl
+"""
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+from streamlit.logger import set_log_level
+
+from data_fetcher import _qkey, fetch_counts, fetch_kpi, fetch_latest_month, fetch_search_results
+from data_loader import get_pref_master, load_category, load_jichitai
+from sidebar import build_jichitai_tree
+from table_builder import build_counts_table, build_latest_table
+from ui_components import show_df
+
+
+COMPOSITE_PAGE_SIZE = 500  # data_fetcher の composite 集計と同じページサイズ
+TOPICS = ["脱炭素", "再生可能エネルギー", "子育て支援", "防災", "公共交通", "DX推進", "観光振興", "移住定住"]
+
+
+# ===== 合成した応答（フィクスチャ） =====
+def _composite_pages(buckets: List[dict]) -> List[dict]:
+    """バケットを composite 集計の応答のページに分割（最後のページ以外に after_key を付ける）"""
+    pages = []
+    for start in range(0, len(buckets), COMPOSITE_PAGE_SIZE):
+        page = buckets[start:start + COMPOSITE_PAGE_SIZE]
+        aggregation = {"buckets": page}
+        if start + COMPOSITE_PAGE_SIZE < len(buckets):
+            aggregation["after_key"] = page[-1]["key"]
+        pages.append({"aggregations": {"by_pair": aggregation}})
+    return pages or [{"aggregations": {"by_pair": {"buckets": []}}}]
+
+
+def make_fixtures(
+    jichitai: pd.DataFrame,
+    catmap: pd.DataFrame,
+    hits: int,
+    density: float = 0.6,
+    body_chars: int = 2000,
+    seed: int = 0
+) -> Dict:
+    """
+    全国規模の検索・集計の応答を合成
+    
+    Args:
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+        hits: 検索ヒット数
+        density: 自治体×カテゴリの組み合わせのうち件数がある割合（0〜1）
+        body_chars: 1ページあたりの本文の文字数
+        seed: 乱数シード
+    
+    Returns:
+        Dict: 応答（search, counts_city, counts_pref, latest_city, latest_pref, kpi）
+    """
+    rng = random.Random(seed)
+    codes = jichitai["code"].tolist()
+    categories = sorted(catmap["category"].astype(int).unique().tolist())
+    now_ms = int(time.time() * 1000)
+    
+    # 検索ヒット（_source とハイライト断片）
+    search_hits = []
+    for i in range(hits):
+        topic = rng.choice(TOPICS)
+        file_id = f"BDH{rng.randint(0, 999999):06d}G" if rng.random() < 0.8 else f"DD{rng.randint(0, 9999999):07d}"
+        body = (f"{topic}に関する取組を推進する。" * (body_chars // 16 + 1))[:body_chars]
+        start_year = rng.randint(2015, 2025)
+        search_hits.append({
+            "_source": {
+                "code": int(rng.choice(codes)),
+                "category": rng.choice(categories),
+                "file_id": file_id,
+                "file_page": rng.randint(1, 200),
+                "number_of_pages": 200,
+                "title": f"第{rng.randint(1, 9)}次{topic}計画",
+                "source_url": f"https://example.lg.jp/{file_id}.pdf",
+                "content_text": body,
+                "fiscal_year_start": start_year,
+                "fiscal_year_end": start_year + rng.randint(0, 5) if rng.random() < 0.7 else None,
+            },
+            "highlight": {"content_text": [f"…<em>{topic}</em>に関する取組を推進する。" * 5] * 3},
+        })
+    
+    # 自治体×カテゴリ・都道府県×カテゴリの composite 集計
+    counts_city, latest_city = [], []
+    pref_pages: Dict[tuple, list] = {}
+    pref_of = dict(zip(jichitai["code"], jichitai["affiliation_code"]))
+    for code in codes:
+        for category in categories:
+            if rng.random() >= density:
+                continue
+            pages = int(rng.lognormvariate(4, 1.5)) + 1
+            files = max(1, pages // rng.randint(5, 50))
+            collected = now_ms - rng.randint(0, 3 * 365) * 86_400_000
+            key = {"g": code, "category": category}
+            counts_city.append({"key": key, "doc_count": pages, "file_count": {"value": files}})
+            latest_city.append({"key": key, "doc_count": pages, "max_collected": {"value": collected}})
+            pref_key = (str(int(pref_of[code])), category)
+            totals = pref_pages.setdefault(pref_key, [0, 0, 0])
+            totals[0] += pages
+            totals[1] += files
+            totals[2] = max(totals[2], collected)
+    counts_pref = [
+        {"key": {"g": g, "category": c}, "doc_count": t[0], "file_count": {"value": t[1]}}
+        for (g, c), t in sorted(pref_pages.items(), key=lambda item: (int(item[0][0]), item[0][1]))
+    ]
+    latest_pref = [
+        {"key": {"g": g, "category": c}, "doc_count": t[0], "max_collected": {"value": t[2]}}
+        for (g, c), t in sorted(pref_pages.items(), key=lambda item: (int(item[0][0]), item[0][1]))
+    ]
+    
+    return {
+        "search": {"hits": {"total": {"value": hits}, "hits": search_hits}},
+        "counts_city": _composite_pages(counts_city),
+        "counts_pref": _composite_pages(counts_pref),
+        "latest_city": _composite_pages(latest_city),
+        "latest_pref": _composite_pages(latest_pref),
+        "kpi": {
+            "hits": {"total": {"value": sum(b["doc_count"] for b in counts_city)}},
+            "aggregations": {
+                "uniq_files": {"value": sum(b["file_count"]["value"] for b in counts_city)},
+                "max_collected": {"value": now_ms},
+            },
+        },
+    }
+
+
+class FixtureES:
+    """フィクスチャの応答を返すElasticsearchクライアントの代わり（search・options のみ）"""
+    
+    def __init__(self, fixtures: Dict):
+        """
+        Args:
+            fixtures: make_fixtures の戻り値（または同じ形式で記録した応答）
+        """
+        self.fixtures = fixtures
+        self.calls = 0
+    
+    def options(self, **kwargs):
+        """呼び出しごとの設定（タイムアウトなど）は使わないため自身を返す"""
+        return self
+    
+    def search(self, index=None, body=None, **kwargs):
+        """リクエストの形から対応する応答を返す"""
+        self.calls += 1
+        body = body or {}
+        aggs = body.get("aggs", {})
+        if "by_pair" in aggs:
+            composite = aggs["by_pair"]["composite"]
+            unit = "city" if composite["sources"][0]["g"]["terms"]["field"] == "code" else "pref"
+            kind = "latest" if "max_collected" in aggs["by_pair"].get("aggs", {}) else "counts"
+            pages = self.fixtures[f"{kind}_{unit}"]
+            after = composite.get("after")
+            index_of_page = 0
+            if after:
+                index_of_page = next(
+                    i + 1 for i, page in enumerate(pages)
+                    if page["aggregations"]["by_pair"].get("after_key") == after
+                )
+            return pages[index_of_page]
+        if "uniq_files" in aggs:
+            return self.fixtures["kpi"]
+        search = self.fixtures["search"]
+        size = body.get("size", len(search["hits"]["hits"]))
+        return {"hits": {"total": search["hits"]["total"], "hits": search["hits"]["hits"][:size]}}
+
+
+# ===== 計測 =====
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """
+    関数の所要時間（repeat回）と1回あたりのメモリ使用量のピークを計測
+    
+    Args:
+        func: 計測する関数（戻り値がDataFrameなら行数・列数・メモリ量も記録）
+        repeat: 繰り返し回数
+        setup: 毎回の計測前に呼ぶ関数（キャッシュの削除など、計測に含めない）
+    
+    Returns:
+        dict: 計測結果（ミリ秒・MB）
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    
+    # メモリはtracemallocの負荷で時間が伸びるため、別に1回だけ実行して計測
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    ordered = sorted(times)
+    measured = {
+        "repeat": repeat,
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "peak_mb": round(peak / 1024 / 1024, 3),
+    }
+    if isinstance(result, pd.DataFrame):
+        measured["rows"] = len(result)
+        measured["columns"] = len(result.columns)
+        measured["result_mb"] = round(result.memory_usage(deep=True).sum() / 1024 / 1024, 3)
+    elif isinstance(result, tuple) and result and isinstance(result[0], list):
+        measured["rows"] = len(result[0])
+    return measured
+
+
+def run_suite(fixtures: Dict, jichitai: pd.DataFrame, catmap: pd.DataFrame, repeat: int, hits: int) -> List[dict]:
+    """
+    全ケースを計測
+    
+    Args:
+        fixtures: 応答
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+        repeat: 繰り返し回数
+        hits: 検索結果として取得する件数
+    
+    Returns:
+        List[dict]: ケースごとの計測結果
+    """
+    es = FixtureES(fixtures)
+    pref_master = get_pref_master(jichitai)
+    short_unique = catmap.sort_values("order").drop_duplicates(subset=["short_name"], keep="first")
+    query_key = _qkey({"match_all": {}})
+    city_types = sorted(jichitai["city_type"].dropna().unique().tolist())
+    
+    # テーブル構築の入力（fetch_* の結果）は先に作っておく
+    counts = {}
+    latest = {}
+    for unit, field in [("市区町村", "code"), ("都道府県", "affiliation_code")]:
+        for include_file in (True, False):
+            fetch_counts.clear()
+            counts[(unit, include_file)] = fetch_counts(es, query_key, field, include_file)
+        fetch_latest_month.clear()
+        latest[unit] = fetch_latest_month(es, query_key, field)
+    search_df = fetch_search_results(es, {"match_all": {}}, jichitai, catmap, hits)
+    counts_table = build_counts_table(
+        counts[("市区町村", False)], jichitai, pref_master, catmap, "市区町村", "ページ数", short_unique, include_zero=True
+    )
+    
+    cases = []
+    
+    def add(name: str, func: Callable, setup: Optional[Callable] = None, **params):
+        cases.append((name, params, func, setup))
+    
+    # 検索結果の整形（ヒット → 検索結果のDataFrame）
+    for excerpt_chars in (0, 500):
+        add(
+            "fetch_search_results",
+            lambda excerpt_chars=excerpt_chars: fetch_search_results(es, {"match_all": {}}, jichitai, catmap, hits, excerpt_chars),
+            excerpt_chars=excerpt_chars,
+        )
+    add("fetch_kpi", lambda: fetch_kpi(es, {"match_all": {}}))
+    
+    # composite 集計の応答 → DataFrame（キャッシュを削除して毎回実行）
+    for unit, field in [("市区町村", "code"), ("都道府県", "affiliation_code")]:
+        for include_file in (True, False):
+            add(
+                "fetch_counts",
+                lambda field=field, include_file=include_file: fetch_counts(es, query_key, field, include_file),
+                setup=fetch_counts.clear,
+                unit=unit,
+                include_file=include_file,
+            )
+        add(
+            "fetch_latest_month",
+            lambda field=field: fetch_latest_month(es, query_key, field),
+            setup=fetch_latest_month.clear,
+            unit=unit,
+        )
+    
+    # 件数テーブル（0件を含む / 含まない × 表示単位 × 集計単位）
+    for unit in ("市区町村", "都道府県"):
+        for count_mode in ("ファイル数", "ページ数"):
+            for include_zero in (True, False):
+                df = counts[(unit, count_mode == "ファイル数")]
+                add(
+                    "build_counts_table",
+                    lambda df=df, unit=unit, count_mode=count_mode, include_zero=include_zero: build_counts_table(
+                        df, jichitai, pref_master, catmap, unit, count_mode, short_unique, include_zero=include_zero
+                    ),
+                    unit=unit,
+                    count_mode=count_mode,
+                    include_zero=include_zero,
+                )
+    
+    # 最新収集月テーブル
+    for unit in ("市区町村", "都道府県"):
+        add(
+            "build_latest_table",
+            lambda unit=unit: build_latest_table(latest[unit], jichitai, pref_master, catmap, unit, short_unique),
+            unit=unit,
+        )
+    
+    # 自治体ツリー（区分の選択なし / 市のみ）
+    add("build_jichitai_tree", lambda: build_jichitai_tree(jichitai, []), city_types="")
+    if "市" in city_types:
+        add("build_jichitai_tree", lambda: build_jichitai_tree(jichitai, ["市"]), city_types="市")
+    
+    # 表の整形・表示（数値列のカンマ区切り + st.dataframe のシリアライズ）
+    add("show_df", lambda: show_df(counts_table), table="counts")
+    add("show_df", lambda: show_df(search_df), table="search")
+    
+    results = []
+    for name, params, func, setup in cases:
+        measured = measure(func, repeat, setup)
+        results.append({"case": name, "params": params, **measured})
+        label = ", ".join(f"{k}={v}" for k, v in params.items())
+        print(
+            f"{name:<22} {label:<48} "
+            f"median {measured['median_ms']:9.2f}ms  p95 {measured['p95_ms']:9.2f}ms  "
+            f"peak {measured['peak_mb']:8.2f}MB"
+        )
+    return results
+
+
+def case_id(result: dict) -> str:
+    """ベースラインとの照合に使うケースの識別子"""
+    return result["case"] + json.dumps(result["params"], sort_keys=True, ensure_ascii=False)
+
+
+def compare_with_baseline(results: List[dict], baseline_path: str, threshold: float) -> List[dict]:
+    """
+    ベースラインの計測結果と比較し、中央値が閾値を超えて遅くなったケースを返す
+    
+    Args:
+        results: 今回の計測結果
+        baseline_path: ベースライン（--json で書き出したファイル）
+        threshold: 許容する増加率（0.2なら20%）
+    
+    Returns:
+        List[dict]: 遅くなったケース（case, params, baseline_ms, median_ms, ratio）
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case_id(r): r for r in (json.loads(line) for line in f if line.strip())}
+    regressions = []
+    for result in results:
+        base = baseline.get(case_id(result))
+        if not base or not base.get("median_ms"):
+            continue
+        ratio = result["median_ms"] / base["median_ms"]
+        if ratio > 1 + threshold:
+            regressions.append({
+                "case": result["case"],
+                "params": result["params"],
+                "baseline_ms": base["median_ms"],
+                "median_ms": result["median_ms"],
+                "ratio": round(ratio, 2),
+            })
+    return regressions
+
+
+def main():
+    """コマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="検索結果の整形・集計テーブル構築のマイクロベンチマーク（ES不要）")
+    parser.add_argument("--hits", default="1000,10000", help="検索ヒット数（カンマ区切り）")
+    parser.add_argument("--density", type=float, default=0.6, help="自治体×カテゴリのうち件数がある割合")
+    parser.add_argument("--body-chars", type=int, default=2000, help="1ページあたりの本文の文字数")
+    parser.add_argument("--repeat", type=int, default=5, help="ケースごとの繰り返し回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", default="", help="記録した応答（--save-fixtures と同じ形式）を使う")
+    parser.add_argument("--save-fixtures", default="", help="合成した応答をJSONで保存して終了")
+    parser.add_argument("--json", default="", help="結果をJSON Lines形式で書き出すファイル")
+    parser.add_argument("--baseline", default="", help="比較するベースライン（--json の出力）")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="許容する中央値の増加率")
+    args = parser.parse_args()
+    
+    # Streamlitの実行環境外で呼ぶため、キャッシュ・表示の警告を抑止
+    set_log_level("error")
+    
+    jichitai = load_jichitai()
+    catmap = load_category()
+    hit_counts = [int(h) for h in args.hits.split(",") if h.strip()]
+    
+    if args.fixtures:
+        with open(args.fixtures, encoding="utf-8") as f:
+            recorded = json.load(f)
+        fixture_sets = [(len(recorded["search"]["hits"]["hits"]), recorded)]
+    else:
+        fixture_sets = [
+            (hits, make_fixtures(jichitai, catmap, hits, args.density, args.body_chars, args.seed))
+            for hits in hit_counts
+        ]
+    
+    if args.save_fixtures:
+        with open(args.save_fixtures, "w", encoding="utf-8") as f:
+            json.dump(fixture_sets[-1][1], f, ensure_ascii=False)
+        print(f"応答を保存しました: {args.save_fixtures}（検索ヒット {fixture_sets[-1][0]:,}件）")
+        return
+    
+    print(f"自治体 {len(jichitai):,} / カテゴリ {catmap['category'].nunique()} / 繰り返し {args.repeat}回")
+    results = []
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    for hits, fixtures in fixture_sets:
+        print(f"--- 検索ヒット {hits:,}件 ---")
+        for result in run_suite(fixtures, jichitai, catmap, args.repeat, hits):
+            result["params"]["hits"] = hits
+            result["started_at"] = started_at
+            results.append(result)
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        for r in regressions:
+            print(f"⚠️ {r['case']} {r['params']}: {r['baseline_ms']}ms → {r['median_ms']}ms（×{r['ratio']}）")
+        if regressions:
+            raise SystemExit(1)
+        print(f"ベースラインからの{args.max_regression * 100:.0f}%超の遅延はありません")
+
+
+if __name__ == "__main__":
+    main()
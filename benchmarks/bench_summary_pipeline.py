@@ -0,0 +1,267 @@
+"""
+AI要約パイプライン（map / reduce / 最終統合）のベンチマーク
+OpenAI互換のスタブサーバーに対して、同時実行数・エラー発生率ごとのスループット・リトライ数・全体の所要時間を計測
+
+使い方:
+    python -m benchmarks.bench_summary_pipeline --docs 300 --concurrency 1,4,8 --profiles clean,429,5xx
+    python -m benchmarks.bench_summary_pipeline --base-url http://127.0.0.1:8901/v1  # 起動済みのスタブを使う場合
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import List, Optional
+
+from openai import OpenAI
+
+from batch_packer import pack_batches
+from openai_helper import CallStats, stream_summary
+from prompt import (
+    format_document,
+    get_merge_prompt,
+    get_prompt_cache_key,
+    get_summary_integration_prompt,
+    get_summary_prompt,
+)
+from summary_pipeline import RateLimiter, call_with_retry, estimate_request_tokens, run_map_phase, run_tree_reduce
+from token_counter import count_tokens
+from benchmarks.openai_stub import StubConfig, StubServer
+
+
+# エラー発生率のプロファイル（429の確率, 5xxの確率）
+ERROR_PROFILES = {
+    "clean": (0.0, 0.0),
+    "429": (0.10, 0.0),
+    "5xx": (0.0, 0.05),
+    "mixed": (0.05, 0.03),
+}
+
+PREFECTURES = ["北海道", "東京都", "神奈川県", "愛知県", "大阪府", "福岡県"]
+TOPICS = ["脱炭素", "再生可能エネルギー", "子育て支援", "防災", "公共交通", "DX推進", "観光振興"]
+
+
+def make_documents(count: int, seed: int = 0) -> List[dict]:
+    """
+    要約対象の合成文書を作成（AI要約タブに渡す文書と同じキー）
+    
+    Args:
+        count: 文書数
+        seed: 乱数シード
+    
+    Returns:
+        List[dict]: 文書のリスト（団体コード順）
+    """
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        code = f"{10000 + (i // 5) * 10:06d}"
+        topic = rng.choice(TOPICS)
+        body = "".join(
+            f"{topic}に関する取組として、{rng.choice(TOPICS)}と連携した施策を{rng.randint(2020, 2030)}年度までに実施する。"
+            for _ in range(rng.randint(8, 16))
+        )
+        documents.append({
+            "団体コード": code,
+            "都道府県": rng.choice(PREFECTURES),
+            "市区町村": f"市{i // 5}",
+            "資料カテゴリ": "計画",
+            "資料名": f"{topic}推進計画",
+            "本文": body[:800],
+            "開始年度": rng.randint(2018, 2024),
+            "終了年度": "",
+            "URL(原本)": f"https://example.jp/{code}.pdf#page={i % 10 + 1}",
+            "URL(GF)": f"https://www.gfinder.jp/#/source/BDH{i:06d}G",
+        })
+    return documents
+
+
+def run_pipeline(
+    client: OpenAI,
+    model: str,
+    documents: List[dict],
+    token_budget: int,
+    concurrency: int,
+    limiter: Optional[RateLimiter],
+    max_retries: int
+) -> dict:
+    """
+    AI要約タブと同じ手順（バッチ分割 → map → 多段統合 → 最終統合）を実行して計測
+    
+    Args:
+        client: OpenAIクライアント（スタブ向け、SDKのリトライは無効）
+        model: モデル名
+        documents: 文書のリスト
+        token_budget: 1バッチあたりのトークン予算
+        concurrency: 同時実行数
+        limiter: 共有レート制限
+        max_retries: 1呼び出しあたりの最大リトライ回数
+    
+    Returns:
+        dict: 計測結果
+    """
+    started = time.time()
+    prompt_overhead = count_tokens(get_summary_prompt([]), model)
+    batches = pack_batches(
+        documents,
+        token_budget=max(token_budget - prompt_overhead, 1),
+        count_doc_tokens=lambda doc: count_tokens(format_document(doc, 1, 800), model)
+    )
+    prompts = [get_summary_prompt(batch) for batch in batches]
+    call_stats = []
+    
+    def stream_call(prompt_text: str) -> str:
+        stats = CallStats(model=model)
+        text = "".join(stream_summary(
+            client, prompt_text, model=model, stats=stats, cache_key=get_prompt_cache_key(prompt_text)
+        ))
+        call_stats.append(stats)
+        return text
+    
+    # map
+    map_result = run_map_phase(
+        lambda i: stream_call(prompts[i]),
+        len(prompts),
+        limiter=limiter,
+        estimate_tokens=lambda i: estimate_request_tokens(prompts[i]),
+        max_workers=concurrency,
+        max_retries=max_retries
+    )
+    batch_results = [r for r in map_result.results if r]
+    
+    # reduce（多段統合）
+    merge_overhead = count_tokens(get_merge_prompt([], "", 1), model)
+    reduce_result = run_tree_reduce(
+        batch_results,
+        lambda texts, level: stream_call(get_merge_prompt(texts, "", level)),
+        count_tokens=lambda text: count_tokens(text, model),
+        token_budget=max(token_budget - merge_overhead, 1),
+        limiter=limiter,
+        estimate_tokens=lambda texts: estimate_request_tokens("".join(texts)),
+        max_workers=concurrency,
+        max_retries=max_retries
+    )
+    
+    # 最終統合
+    integration_started = time.time()
+    integration_retries = []
+    integration_error = ""
+    try:
+        integration_prompt = get_summary_integration_prompt(reduce_result.summaries, len(documents))
+        call_with_retry(
+            lambda: stream_call(integration_prompt),
+            limiter=limiter,
+            estimated_tokens=estimate_request_tokens(integration_prompt),
+            max_retries=max_retries,
+            on_retry=lambda attempt, error, delay: integration_retries.append(delay)
+        )
+    except Exception as e:
+        integration_error = str(e)
+    integration_time = time.time() - integration_started
+    total_time = time.time() - started
+    
+    completion_tokens = sum(s.completion_tokens or 0 for s in call_stats)
+    prompt_tokens = sum(s.prompt_tokens or 0 for s in call_stats)
+    cached_tokens = sum(s.cached_tokens or 0 for s in call_stats)
+    ttfts = sorted(s.time_to_first_token for s in call_stats if s.time_to_first_token is not None)
+    return {
+        "documents": len(documents),
+        "batches": len(batches),
+        "concurrency": concurrency,
+        "total_seconds": round(total_time, 3),
+        "map_seconds": round(map_result.wall_time, 3),
+        "reduce_seconds": round(reduce_result.wall_time, 3),
+        "integration_seconds": round(integration_time, 3),
+        "reduce_levels": reduce_result.levels,
+        "batches_per_second": round(len(batches) / map_result.wall_time, 3) if map_result.wall_time else None,
+        "completion_tokens_per_second": round(completion_tokens / total_time, 1) if total_time else None,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "cached_rate": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+        "successful_calls": len(call_stats),
+        "retries": map_result.retries + reduce_result.retries + len(integration_retries),
+        "failed_batches": len(map_result.errors),
+        "integration_error": integration_error,
+        "ttft_p50": round(ttfts[len(ttfts) // 2], 3) if ttfts else None,
+        "ttft_max": round(ttfts[-1], 3) if ttfts else None,
+    }
+
+
+def main():
+    """コマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="AI要約パイプラインのベンチマーク（スタブサーバー使用）")
+    parser.add_argument("--docs", type=int, default=200, help="文書数")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--budget", type=int, default=8000, help="1バッチあたりのトークン予算")
+    parser.add_argument("--concurrency", default="1,4,8", help="同時実行数（カンマ区切り）")
+    parser.add_argument("--profiles", default="clean,429,5xx", help=f"エラープロファイル（{', '.join(ERROR_PROFILES)}）")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--rpm", type=int, default=500, help="レート制限（リクエスト/分）")
+    parser.add_argument("--tpm", type=int, default=2_000_000, help="レート制限（トークン/分）")
+    parser.add_argument("--latency", default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024, help="0でプロンプトキャッシュなし")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", default="", help="起動済みのスタブサーバー（指定時はエラープロファイルを適用しない）")
+    parser.add_argument("--json", default="", help="結果をJSON Lines形式で書き出すファイル")
+    args = parser.parse_args()
+    
+    documents = make_documents(args.docs, seed=args.seed)
+    stub = None
+    if not args.base_url:
+        stub = StubServer(StubConfig(seed=args.seed)).start()
+    base_url = args.base_url or stub.base_url
+    
+    results = []
+    try:
+        for profile in args.profiles.split(","):
+            error_429, error_5xx = ERROR_PROFILES[profile.strip()]
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                if stub is not None:
+                    stub.config = StubConfig(
+                        latency=args.latency,
+                        latency_mean=args.latency_mean,
+                        tokens_per_second=args.tokens_per_second,
+                        completion_tokens=args.completion_tokens,
+                        error_429=error_429,
+                        error_5xx=error_5xx,
+                        retry_after=args.retry_after,
+                        prompt_cache_min_tokens=args.prompt_cache_min_tokens,
+                        seed=args.seed,
+                    )
+                    stub.reset()
+                client = OpenAI(api_key="stub", base_url=base_url, max_retries=0)
+                limiter = RateLimiter(args.rpm, args.tpm)
+                result = run_pipeline(
+                    client, args.model, documents, args.budget, concurrency, limiter, args.max_retries
+                )
+                result["profile"] = profile.strip()
+                if stub is not None:
+                    result["stub_requests"] = stub.stats.requests
+                    result["stub_429"] = stub.stats.rate_limited
+                    result["stub_5xx"] = stub.stats.server_errors
+                results.append(result)
+                print(
+                    f"[{result['profile']:>5} x{concurrency:<2}] "
+                    f"total {result['total_seconds']:7.2f}s "
+                    f"(map {result['map_seconds']:.2f}s / reduce {result['reduce_seconds']:.2f}s / "
+                    f"final {result['integration_seconds']:.2f}s) "
+                    f"{result['batches']} batches, {result['batches_per_second']} batch/s, "
+                    f"retries {result['retries']}, failed {result['failed_batches']}, "
+                    f"cached {result['cached_rate'] * 100:.0f}%"
+                )
+    finally:
+        if stub is not None:
+            stub.stop()
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+全国規模の合成コーパス（ページ単位の文書）
+jichitai.xlsx・category.xlsx の自治体×カテゴリ×年度に、アプリが使うフィールド
+（code, affiliation_code, category, file_id, file_page, number_of_pages, collected_at,
+fiscal_year_start, fiscal_year_end, title, content_text, source_url）を持つページを生成する
+
+数百万ページでもメモリに収まるよう、項目は列ごとのnumpy配列で保持し、本文は文の番号から必要な時だけ組み立てる
+
+使い方:
+    python -m benchmarks.es_corpus --pages 200000 --output corpus.ndjson --index gfinder-pages  # _bulk 形式で書き出し
+"""
+
+import argparse
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# 政策分野（出現頻度は先頭ほど高い）
+TOPICS = [
+    "子育て支援", "防災", "脱炭素", "高齢者福祉", "公共交通", "DX", "観光振興", "移住定住", "地域医療",
+    "学校教育", "再生可能エネルギー", "空き家対策", "中心市街地活性化", "農業振興", "男女共同参画",
+    "文化財保護", "スポーツ振興", "上下水道", "道路整備", "公共施設マネジメント", "ごみ減量", "健康づくり",
+    "障害者福祉", "地域包括ケア", "商工振興", "ふるさと納税", "国際交流", "生涯学習", "消防・救急",
+    "治水対策", "森林保全", "漁業振興", "景観形成", "住宅政策", "行財政改革", "人口減少対策",
+    "地域公共交通計画", "ゼロカーボンシティ", "GIGAスクール", "カーボンニュートラル",
+]
+
+# 本文の文の型（{topic} を分野名に置き換える）
+SENTENCE_PATTERNS = [
+    "{topic}の推進に向けて、関係部局が連携して取組を進める。",
+    "本市における{topic}の現状と課題を整理した。",
+    "{topic}に関する市民アンケートを実施し、意見を施策に反映する。",
+    "令和6年度は{topic}に係る予算を重点的に配分する。",
+    "{topic}の数値目標として、2030年度までの達成を目指す。",
+    "議員から{topic}の進捗状況について質問があった。",
+    "{topic}について、国の補助制度を活用して事業を拡充する。",
+    "{topic}の成果指標（KPI）の達成状況を評価する。",
+]
+
+# カテゴリ名に含まれる語 → 資料名の型と1ファイルあたりの平均ページ数（先に一致したものを使う）
+TITLE_TEMPLATES = [
+    ("予算", "令和{year}年度当初予算書", 90),
+    ("決算", "令和{year}年度決算書", 70),
+    ("審議会", "{topic}審議会 第{n}回会議録", 15),
+    ("議事録", "令和{year}年第{n}回定例会会議録", 60),
+    ("広報", "広報 令和{year}年{n}月号", 16),
+    ("記者", "{topic}に関する記者発表資料", 3),
+    ("施政方針", "令和{year}年度施政方針", 10),
+    ("基本構想", "第{n}次総合計画 基本計画", 60),
+    ("総合戦略", "まち・ひと・しごと創生総合戦略（第{n}期）", 40),
+    ("実施計画", "令和{year}年度実施計画", 30),
+]
+DEFAULT_TITLE = ("{topic}計画（第{n}期）", 25)
+
+# 自治体区分ごとの資料の多さ（相対値）
+CITY_TYPE_WEIGHTS = {
+    "都道府県庁": 8.0, "政令指定都市": 10.0, "中核市": 5.0, "特別区": 4.0, "市": 2.0, "町": 1.0, "村": 0.5,
+}
+
+
+@dataclass
+class CorpusConfig:
+    """合成コーパスの設定"""
+    pages: int = 1_000_000  # 生成するページ数（おおよそ）
+    first_year: int = 2010  # 年度の範囲
+    last_year: int = 2025
+    sentences_per_page: int = 12  # 1ページあたりの文の数
+    collected_days: int = 3 * 365  # 収集日時の範囲（現在から遡る日数）
+    seed: int = 0
+
+
+class Corpus:
+    """
+    列ごとの配列で保持した合成コーパス
+    
+    キーワード項目（code, affiliation_code, file_id）は昇順に並べた辞書の番号で保持し、
+    並び順が値の順と一致するため、composite集計のキーの比較にも番号を使える
+    """
+    
+    def __init__(self, jichitai: pd.DataFrame, catmap: pd.DataFrame, config: Optional[CorpusConfig] = None):
+        """
+        Args:
+            jichitai: 自治体マスターデータ
+            catmap: カテゴリマスターデータ
+            config: 生成の設定
+        """
+        self.config = config or CorpusConfig()
+        self.generated_at_ms = int(time.time() * 1000)
+        rng = np.random.default_rng(self.config.seed)
+        
+        # ===== 自治体・カテゴリ =====
+        masters = jichitai.sort_values("code")
+        self.codes = np.array(masters["code"].astype(str).tolist(), dtype=object)
+        self.prefs = np.array(sorted(masters["affiliation_code"].astype(str).str.zfill(2).unique()), dtype=object)
+        pref_index = {p: i for i, p in enumerate(self.prefs)}
+        self.code_to_pref = np.array(
+            [pref_index[str(p).zfill(2)] for p in masters["affiliation_code"]], dtype=np.int16
+        )
+        code_weights = masters["city_type"].map(CITY_TYPE_WEIGHTS).fillna(1.0).to_numpy(dtype=float)
+        categories = catmap.drop_duplicates("category").sort_values("category")
+        self.categories = categories["category"].astype(int).to_numpy()
+        category_templates = []
+        for category_name in categories["category_name"].astype(str):
+            template = next(((t, p) for key, t, p in TITLE_TEMPLATES if key in category_name), DEFAULT_TITLE)
+            category_templates.append(template)
+        category_pages = np.array([p for _, p in category_templates], dtype=float)
+        
+        # ===== 文の辞書 =====
+        self.sentences = [
+            pattern.format(topic=topic) for topic in TOPICS for pattern in SENTENCE_PATTERNS
+        ]
+        topic_weights = 1.0 / np.arange(1, len(TOPICS) + 1)  # Zipf分布
+        topic_weights /= topic_weights.sum()
+        
+        # ===== ファイル =====
+        mean_pages = float(np.average(category_pages))
+        files = max(1, int(self.config.pages / mean_pages))
+        file_code = rng.choice(len(self.codes), size=files, p=code_weights / code_weights.sum())
+        file_category_idx = rng.integers(0, len(self.categories), size=files)
+        file_topic = rng.choice(len(TOPICS), size=files, p=topic_weights)
+        # ページ数は対数正規分布（カテゴリごとの平均）
+        sigma = 0.8
+        mu = np.log(category_pages[file_category_idx]) - sigma ** 2 / 2
+        file_pages = np.maximum(1, rng.lognormal(mu, sigma)).astype(np.int32)
+        # 目標ページ数に合わせて切り詰める
+        cumulative = np.cumsum(file_pages)
+        files = int(np.searchsorted(cumulative, self.config.pages) + 1) if cumulative[-1] > self.config.pages else files
+        file_code, file_category_idx, file_topic, file_pages = (
+            file_code[:files], file_category_idx[:files], file_topic[:files], file_pages[:files]
+        )
+        file_year = rng.integers(self.config.first_year, self.config.last_year + 1, size=files).astype(np.int16)
+        has_end = rng.random(files) < 0.6
+        file_year_end = np.where(has_end, file_year + rng.integers(0, 10, size=files), 0).astype(np.int16)
+        file_collected = self.generated_at_ms - rng.integers(0, self.config.collected_days * 86_400_000, size=files)
+        file_number = rng.integers(1, 13, size=files)
+        
+        # file_id（新形式・旧形式）。昇順の辞書番号で保持
+        file_ids = np.array(
+            [f"DD{i:07d}" if i % 5 == 0 else f"BDH{i:06d}G" for i in range(files)], dtype=object
+        )
+        order = np.argsort(file_ids, kind="stable")
+        self.file_ids = file_ids[order]
+        file_rank = np.empty(files, dtype=np.int32)
+        file_rank[order] = np.arange(files, dtype=np.int32)
+        
+        # 資料名（ファイルごと）
+        self.titles = np.array([
+            category_templates[c][0].format(topic=TOPICS[t], year=max(1, int(y) - 2018), n=int(n))
+            for c, t, y, n in zip(file_category_idx, file_topic, file_year, file_number)
+        ], dtype=object)
+        
+        # ===== ページ（ファイルの項目をページ数分だけ繰り返す） =====
+        page_file = np.repeat(np.arange(files, dtype=np.int32), file_pages)
+        self.size = len(page_file)
+        starts = np.cumsum(file_pages) - file_pages
+        self.file_page = (np.arange(self.size) - np.repeat(starts, file_pages) + 1).astype(np.int32)
+        self.file = page_file
+        self.file_rank = file_rank[page_file]
+        self.number_of_pages = file_pages[page_file]
+        self.code = file_code[page_file].astype(np.int32)
+        self.pref = self.code_to_pref[self.code]
+        self.category = self.categories[file_category_idx[page_file]].astype(np.int32)
+        self.fiscal_year_start = file_year[page_file]
+        self.fiscal_year_end = file_year_end[page_file]
+        self.collected_at = file_collected[page_file].astype(np.int64)
+        
+        # 本文: 7割はファイルの分野の文、3割は他の分野の文
+        k = self.config.sentences_per_page
+        patterns = len(SENTENCE_PATTERNS)
+        own_topic = np.repeat(file_topic, file_pages)[:, None]
+        other_topic = rng.choice(len(TOPICS), size=(self.size, k), p=topic_weights)
+        topic = np.where(rng.random((self.size, k)) < 0.7, own_topic, other_topic)
+        self.sentence_ids = (topic * patterns + rng.integers(0, patterns, size=(self.size, k))).astype(np.int16)
+    
+    # ===== 項目の値 =====
+    def keyword_dictionary(self, field: str) -> Optional[np.ndarray]:
+        """キーワード項目の辞書（昇順の値の配列）、数値項目はNone"""
+        return {"code": self.codes, "affiliation_code": self.prefs, "file_id": self.file_ids}.get(field)
+    
+    def column(self, field: str) -> np.ndarray:
+        """
+        項目の値の配列（キーワード項目は辞書の番号）
+        
+        Args:
+            field: 項目名
+        
+        Returns:
+            np.ndarray: ページごとの値
+        
+        Raises:
+            KeyError: 未対応の項目
+        """
+        columns = {
+            "code": self.code,
+            "affiliation_code": self.pref,
+            "file_id": self.file_rank,
+            "category": self.category,
+            "file_page": self.file_page,
+            "number_of_pages": self.number_of_pages,
+            "fiscal_year_start": self.fiscal_year_start,
+            "fiscal_year_end": self.fiscal_year_end,
+            "collected_at": self.collected_at,
+        }
+        return columns[field]
+    
+    def exists(self, field: str) -> np.ndarray:
+        """項目が存在するページ（fiscal_year_end のみ欠損あり）"""
+        if field == "fiscal_year_end":
+            return self.fiscal_year_end > 0
+        if field in ("content_text", "title") or self.keyword_dictionary(field) is not None:
+            return np.ones(self.size, dtype=bool)
+        self.column(field)  # 未対応の項目はKeyError
+        return np.ones(self.size, dtype=bool)
+    
+    def decode(self, field: str, values: np.ndarray) -> list:
+        """列の値をJSONで返す値に変換"""
+        dictionary = self.keyword_dictionary(field)
+        if dictionary is not None:
+            return dictionary[values].tolist()
+        return [int(v) for v in values]
+    
+    # ===== 文書 =====
+    def content_text(self, doc: int) -> str:
+        """ページの本文"""
+        return "".join(self.sentences[i] for i in self.sentence_ids[doc])
+    
+    def source(self, doc: int) -> Dict:
+        """
+        ページの _source（Elasticsearchに登録する文書と同じ形）
+        
+        Args:
+            doc: ページの番号
+        
+        Returns:
+            Dict: 文書
+        """
+        file = int(self.file[doc])
+        file_id = self.file_ids[self.file_rank[doc]]
+        source = {
+            "code": self.codes[self.code[doc]],
+            "affiliation_code": self.prefs[self.pref[doc]],
+            "category": int(self.category[doc]),
+            "file_id": file_id,
+            "file_page": int(self.file_page[doc]),
+            "number_of_pages": int(self.number_of_pages[doc]),
+            "title": self.titles[file],
+            "source_url": f"https://www.example.lg.jp/doc/{file_id}.pdf",
+            "collected_at": int(self.collected_at[doc]),
+            "fiscal_year_start": int(self.fiscal_year_start[doc]),
+            "content_text": self.content_text(doc),
+        }
+        if self.fiscal_year_end[doc]:
+            source["fiscal_year_end"] = int(self.fiscal_year_end[doc])
+        return source
+    
+    def describe(self) -> str:
+        """規模の説明（表示用）"""
+        return (
+            f"{self.size:,}ページ / {len(self.titles):,}ファイル / 自治体{len(self.codes):,} / "
+            f"カテゴリ{len(self.categories)} / 年度{self.config.first_year}〜{self.config.last_year}"
+        )
+
+
+# Elasticsearchに登録する場合のマッピング
+INDEX_MAPPING = {
+    "mappings": {
+        "properties": {
+            "code": {"type": "keyword"},
+            "affiliation_code": {"type": "keyword"},
+            "category": {"type": "integer"},
+            "file_id": {"type": "keyword"},
+            "file_page": {"type": "integer"},
+            "number_of_pages": {"type": "integer"},
+            "title": {"type": "text"},
+            "source_url": {"type": "keyword", "index": False},
+            "collected_at": {"type": "date", "format": "epoch_millis"},
+            "fiscal_year_start": {"type": "integer"},
+            "fiscal_year_end": {"type": "integer"},
+            "content_text": {"type": "text"},
+        }
+    }
+}
+
+
+def write_bulk(corpus: Corpus, path: str, index: str, limit: Optional[int] = None) -> int:
+    """
+    コーパスをElasticsearchの _bulk API の形式（NDJSON）で書き出す
+    
+    Args:
+        corpus: コーパス
+        path: 書き出し先
+        index: 登録先のインデックス名
+        limit: 書き出すページ数の上限
+    
+    Returns:
+        int: 書き出したページ数
+    """
+    count = min(corpus.size, limit or corpus.size)
+    with open(path, "w", encoding="utf-8") as f:
+        for doc in range(count):
+            f.write(json.dumps({"index": {"_index": index, "_id": str(doc)}}) + "\n")
+            f.write(json.dumps(corpus.source(doc), ensure_ascii=False) + "\n")
+    return count
+
+
+def load_masters() -> tuple:
+    """
+    自治体・カテゴリのマスターデータを読み込み（アプリと同じ読み込み処理）
+    
+    Returns:
+        tuple: (jichitai, catmap)
+    """
+    from streamlit.logger import set_log_level
+    from data_loader import load_category, load_jichitai
+    
+    # Streamlitの実行環境外で呼ぶため、キャッシュの警告を抑止
+    set_log_level("error")
+    return load_jichitai(), load_category()
+
+
+def main():
+    """コマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="全国規模の合成コーパスを生成して _bulk 形式で書き出す")
+    parser.add_argument("--pages", type=int, default=200_000, help="生成するページ数")
+    parser.add_argument("--sentences-per-page", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="", help="_bulk 形式（NDJSON）の書き出し先")
+    parser.add_argument("--index", default="gfinder-pages", help="登録先のインデックス名")
+    parser.add_argument("--mapping", default="", help="インデックスのマッピングをJSONで書き出すファイル")
+    args = parser.parse_args()
+    
+    jichitai, catmap = load_masters()
+    started = time.perf_counter()
+    corpus = Corpus(jichitai, catmap, CorpusConfig(
+        pages=args.pages, sentences_per_page=args.sentences_per_page, seed=args.seed
+    ))
+    print(f"生成: {corpus.describe()}（{time.perf_counter() - started:.1f}秒）")
+    
+    if args.mapping:
+        with open(args.mapping, "w", encoding="utf-8") as f:
+            json.dump(INDEX_MAPPING, f, ensure_ascii=False, indent=2)
+    if args.output:
+        started = time.perf_counter()
+        count = write_bulk(corpus, args.output, args.index)
+        print(f"書き出し: {args.output}（{count:,}ページ、{time.perf_counter() - started:.1f}秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,897 @@
+"""
+Elasticsearch互換のスタブサーバー（合成コーパスを検索）
+本番のElasticsearchを使わずに、アプリ全体をオフラインで動かして負荷試験・ベンチマークを行うためのローカルサーバー
+
+data_fetcher が使う _search の範囲に対応:
+    クエリ: bool（must / should / must_not / filter、minimum_should_match）、match_phrase、match、term、terms、
+            range、exists、match_all
+    集計: composite（terms、after）、cardinality、max、min、top_hits
+    その他: size / from、_source の includes / excludes、highlight、track_total_hits
+    タスク: GET /_tasks（actions）で処理中の検索の一覧（X-Opaque-Id を含む）、POST /_tasks/{task_id}/_cancel で取り消し
+
+使い方:
+    python -m benchmarks.es_stub --port 9200 --pages 1000000 --latency-ms 20
+    
+    .streamlit/secrets.toml に ES_HOST = "http://127.0.0.1:9200"（ES_USERNAME / ES_PASSWORD は任意の値）を設定するとアプリから利用できる
+"""
+
+import argparse
+import bisect
+import fnmatch
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+
+from benchmarks.es_corpus import Corpus, CorpusConfig, load_masters
+
+
+ES_VERSION = "8.13.0"
+NODE_ID = "stub"  # タスクAPIで返すノードの識別子
+SEARCH_ACTION = "indices:data/read/search"  # 検索のタスクの種類
+TRACK_TOTAL_HITS_DEFAULT = 10_000  # track_total_hits 未指定時に正確に数える上限
+MAX_RESULT_WINDOW = 10_000  # from + size の上限（index.max_result_window の既定値）
+MAX_INNER_RESULT_WINDOW = 100  # top_hits の from + size の上限（index.max_inner_result_window の既定値）
+CACHE_ENTRIES = 32  # フレーズ・composite集計の結果を保持する件数
+GZIP_MIN_BYTES = 1024  # これより小さい応答は圧縮しない
+
+
+class QueryError(ValueError):
+    """未対応・不正なクエリ（400で返す）"""
+
+
+@dataclass
+class ESStubConfig:
+    """スタブサーバーの応答設定"""
+    latency_ms: float = 0.0  # 1リクエストごとに加える待機時間（ミリ秒）
+    jitter_ms: float = 0.0  # 待機時間のばらつき（±幅、ミリ秒）
+    error_5xx: float = 0.0  # 503を返す確率
+    seed: Optional[int] = None  # 乱数シード（再現用）
+
+
+@dataclass
+class ESStubStats:
+    """スタブサーバーの集計値"""
+    requests: int = 0
+    searches: int = 0
+    composite_pages: int = 0
+    errors: int = 0
+    server_errors: int = 0
+    search_ms: float = 0.0  # 検索処理の合計時間（待機時間を除く）
+    bytes_sent: int = 0  # 応答の送信バイト数（圧縮した場合は圧縮後）
+    compressed: int = 0  # 圧縮して返した応答の数
+    cancelled: int = 0  # タスクAPIで取り消された検索
+    kinds: dict = field(default_factory=dict)  # 検索の種類（hits / composite / aggs）→ リクエスト数
+
+
+@dataclass
+class StubTask:
+    """処理中の検索（タスクAPIで一覧・取り消し）"""
+    task_id: int
+    opaque_id: str  # リクエストの X-Opaque-Id
+    description: str  # 検索対象のインデックス
+    started_at: float = field(default_factory=time.time)
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    
+    def to_dict(self) -> dict:
+        """_tasks の応答の1件"""
+        return {
+            "node": NODE_ID,
+            "id": self.task_id,
+            "type": "transport",
+            "action": SEARCH_ACTION,
+            "description": self.description,
+            "start_time_in_millis": int(self.started_at * 1000),
+            "running_time_in_nanos": int((time.time() - self.started_at) * 1e9),
+            "cancellable": True,
+            "cancelled": self.cancelled.is_set(),
+            "headers": {"X-Opaque-Id": self.opaque_id} if self.opaque_id else {},
+        }
+
+
+class SearchEngine:
+    """
+    合成コーパスに対する _search の評価
+    
+    クエリはページ数分の真偽値の配列として評価し、スコアは一致したフレーズを含む文の数とする
+    """
+    
+    def __init__(self, corpus: Corpus):
+        """
+        Args:
+            corpus: 検索対象のコーパス
+        """
+        self.corpus = corpus
+        self._lock = threading.Lock()
+        self._phrase_cache = OrderedDict()  # (項目, フレーズ) → ページごとの一致数
+        self._composite_cache = OrderedDict()  # 集計条件 → composite集計の結果
+    
+    # ===== キャッシュ =====
+    def _cached(self, cache: OrderedDict, key, build):
+        """LRUキャッシュから取得（なければ作成）"""
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = build()
+        with self._lock:
+            cache[key] = value
+            while len(cache) > CACHE_ENTRIES:
+                cache.popitem(last=False)
+        return value
+    
+    # ===== クエリ =====
+    def phrase_counts(self, field_name: str, phrase: str) -> np.ndarray:
+        """
+        フレーズを含む文（title は資料名）の数をページごとに数える
+        
+        Args:
+            field_name: content_text または title
+            phrase: フレーズ
+        
+        Returns:
+            np.ndarray: ページごとの一致数
+        """
+        corpus = self.corpus
+        
+        def build():
+            if field_name == "content_text":
+                matched = [i for i, s in enumerate(corpus.sentences) if phrase in s]
+                if not matched:
+                    return np.zeros(corpus.size, dtype=np.int8)
+                return np.isin(corpus.sentence_ids, matched).sum(axis=1, dtype=np.int8)
+            if field_name == "title":
+                matched = np.array([phrase in t for t in corpus.titles], dtype=np.int8)
+                return matched[corpus.file]
+            raise QueryError(f"match_phrase is not supported on field [{field_name}]")
+        
+        return self._cached(self._phrase_cache, (field_name, phrase), build)
+    
+    def _field_values(self, field_name: str, values: list) -> np.ndarray:
+        """検索条件の値を列の値（キーワード項目は辞書の番号）に変換。辞書にない値は除く"""
+        dictionary = self.corpus.keyword_dictionary(field_name)
+        if dictionary is None:
+            try:
+                return np.array([float(v) for v in values])
+            except (TypeError, ValueError):
+                raise QueryError(f"failed to parse values of field [{field_name}]")
+        values = [str(v) for v in values]
+        positions = np.searchsorted(dictionary, values)
+        positions = np.minimum(positions, len(dictionary) - 1)
+        return positions[dictionary[positions] == np.array(values, dtype=object)]
+    
+    def _column(self, field_name: str) -> np.ndarray:
+        """項目の列（未対応の項目は400）"""
+        try:
+            return self.corpus.column(field_name)
+        except KeyError:
+            raise QueryError(f"unknown field [{field_name}]")
+    
+    def _range_bound(self, field_name: str, value) -> float:
+        """range の境界値を列の値に変換（キーワード項目は辞書上の位置）"""
+        dictionary = self.corpus.keyword_dictionary(field_name)
+        if dictionary is None:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise QueryError(f"failed to parse range value [{value}] of field [{field_name}]")
+        return float(np.searchsorted(dictionary, str(value))) - 0.5
+    
+    @staticmethod
+    def _single(clause: dict, name: str) -> Tuple[str, object]:
+        """{field: value} 形式の句から項目名と値を取り出す"""
+        if not isinstance(clause, dict) or len(clause) != 1:
+            raise QueryError(f"[{name}] query must have exactly one field")
+        return next(iter(clause.items()))
+    
+    def evaluate(self, query: Optional[dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        クエリを評価
+        
+        Args:
+            query: クエリ（Noneならmatch_all）
+        
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (一致したページの真偽値, スコア)
+        """
+        size = self.corpus.size
+        if not query:
+            return np.ones(size, dtype=bool), np.ones(size, dtype=np.float32)
+        if not isinstance(query, dict) or len(query) != 1:
+            raise QueryError("query must have exactly one clause")
+        kind, clause = next(iter(query.items()))
+        
+        if kind == "match_all":
+            return np.ones(size, dtype=bool), np.ones(size, dtype=np.float32)
+        if kind == "bool":
+            return self._evaluate_bool(clause)
+        if kind in ("match_phrase", "match"):
+            field_name, value = self._single(clause, kind)
+            phrase = value.get("query", "") if isinstance(value, dict) else value
+            counts = self.phrase_counts(field_name, str(phrase))
+            return counts > 0, counts.astype(np.float32)
+        if kind == "term":
+            field_name, value = self._single(clause, kind)
+            value = value.get("value") if isinstance(value, dict) else value
+            mask = np.isin(self._column(field_name), self._field_values(field_name, [value]))
+            return mask, np.ones(size, dtype=np.float32)
+        if kind == "terms":
+            field_name, values = self._single(clause, kind)
+            if not isinstance(values, list):
+                raise QueryError("[terms] query requires an array of values")
+            mask = np.isin(self._column(field_name), self._field_values(field_name, values))
+            return mask, np.ones(size, dtype=np.float32)
+        if kind == "range":
+            field_name, bounds = self._single(clause, kind)
+            column = self._column(field_name)
+            mask = self.corpus.exists(field_name).copy()
+            for op, compare in (("gte", np.greater_equal), ("gt", np.greater),
+                                ("lte", np.less_equal), ("lt", np.less)):
+                if op in bounds:
+                    mask &= compare(column, self._range_bound(field_name, bounds[op]))
+            return mask, np.ones(size, dtype=np.float32)
+        if kind == "exists":
+            try:
+                mask = self.corpus.exists(clause.get("field", ""))
+            except KeyError:
+                mask = np.zeros(size, dtype=bool)
+            return mask, np.ones(size, dtype=np.float32)
+        raise QueryError(f"unknown query [{kind}]")
+    
+    def _evaluate_bool(self, clause: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """bool クエリを評価"""
+        size = self.corpus.size
+        mask = np.ones(size, dtype=bool)
+        score = np.zeros(size, dtype=np.float32)
+        
+        def clauses(name: str) -> list:
+            value = clause.get(name) or []
+            return value if isinstance(value, list) else [value]
+        
+        for sub in clauses("must"):
+            sub_mask, sub_score = self.evaluate(sub)
+            mask &= sub_mask
+            score += sub_score
+        for sub in clauses("filter"):
+            sub_mask, _ = self.evaluate(sub)
+            mask &= sub_mask
+        for sub in clauses("must_not"):
+            sub_mask, _ = self.evaluate(sub)
+            mask &= ~sub_mask
+        
+        should = clauses("should")
+        if should:
+            default_minimum = 0 if clause.get("must") or clause.get("filter") else 1
+            minimum = clause.get("minimum_should_match", default_minimum)
+            try:
+                minimum = int(minimum)
+            except (TypeError, ValueError):
+                raise QueryError(f"unsupported minimum_should_match [{minimum}]")
+            matched = np.zeros(size, dtype=np.int16)
+            for sub in should:
+                sub_mask, sub_score = self.evaluate(sub)
+                matched += sub_mask
+                score += np.where(sub_mask, sub_score, 0)
+            if minimum > 0:
+                mask &= matched >= minimum
+        elif not clause.get("must"):
+            score += 1.0  # filter / must_not のみ（定数スコア）
+        return mask, score
+    
+    # ===== 文書 =====
+    def _source(self, doc: int, options) -> Optional[dict]:
+        """_source の絞り込み（includes / excludes）"""
+        if options is False:
+            return None
+        source = self.corpus.source(doc)
+        includes, excludes = [], []
+        if isinstance(options, (list, str)):
+            includes = [options] if isinstance(options, str) else options
+        elif isinstance(options, dict):
+            includes = options.get("includes") or options.get("include") or []
+            excludes = options.get("excludes") or options.get("exclude") or []
+        if includes:
+            source = {k: v for k, v in source.items() if k in includes}
+        return {k: v for k, v in source.items() if k not in excludes}
+    
+    def _highlight(self, doc: int, options: dict, phrases: List[str]) -> dict:
+        """
+        ハイライトの断片を作成（一致した文を fragment_size 文字程度で切り出す）
+        
+        Args:
+            doc: ページの番号
+            options: highlight の設定
+            phrases: content_text に対するフレーズ
+        
+        Returns:
+            dict: 項目名 → 断片のリスト
+        """
+        result = {}
+        for field_name, field_options in (options.get("fields") or {}).items():
+            settings = {**options, **(field_options or {})}
+            pre = (settings.get("pre_tags") or ["<em>"])[0]
+            post = (settings.get("post_tags") or ["</em>"])[0]
+            fragment_size = int(settings.get("fragment_size", 100))
+            fragments_max = int(settings.get("number_of_fragments", 5))
+            no_match_size = int(settings.get("no_match_size", 0))
+            if field_name == "content_text":
+                sentences = [self.corpus.sentences[i] for i in self.corpus.sentence_ids[doc]]
+            elif field_name == "title":
+                sentences = [self.corpus.titles[self.corpus.file[doc]]]
+            else:
+                continue
+            
+            fragments = []
+            for sentence in sentences:
+                hit = [p for p in phrases if p and p in sentence]
+                if not hit:
+                    continue
+                fragment = sentence[:fragment_size]
+                for p in hit:
+                    fragment = fragment.replace(p, f"{pre}{p}{post}")
+                fragments.append(fragment)
+                if len(fragments) >= fragments_max > 0:
+                    break
+            if fragments:
+                result[field_name] = fragments if fragments_max > 0 else ["".join(fragments)]
+            elif no_match_size > 0:
+                result[field_name] = ["".join(sentences)[:no_match_size]]
+        return result
+    
+    @staticmethod
+    def _phrases(query: Optional[dict]) -> List[str]:
+        """クエリに含まれるフレーズ（ハイライト用、must_not は除く）"""
+        phrases = []
+        if not isinstance(query, dict):
+            return phrases
+        for kind, clause in query.items():
+            if kind in ("match_phrase", "match") and isinstance(clause, dict):
+                for value in clause.values():
+                    phrases.append(str(value.get("query", "") if isinstance(value, dict) else value))
+            elif kind == "bool" and isinstance(clause, dict):
+                for name in ("must", "should", "filter"):
+                    subs = clause.get(name) or []
+                    for sub in subs if isinstance(subs, list) else [subs]:
+                        phrases.extend(SearchEngine._phrases(sub))
+        return phrases
+    
+    def _hit(self, doc: int, score: float, body: dict, phrases: List[str], index: str) -> dict:
+        """検索結果の1件"""
+        hit = {"_index": index, "_id": str(doc), "_score": float(score)}
+        source = self._source(doc, body.get("_source", True))
+        if source is not None:
+            hit["_source"] = source
+        if body.get("highlight"):
+            highlight = self._highlight(doc, body["highlight"], phrases)
+            if highlight:
+                hit["highlight"] = highlight
+        return hit
+    
+    @staticmethod
+    def _top(docs: np.ndarray, scores: np.ndarray, start: int, count: int) -> np.ndarray:
+        """スコアの降順（同点はページ番号順）で start 件目から count 件"""
+        if count <= 0 or start >= len(docs):
+            return docs[:0]
+        end = min(len(docs), start + count)
+        if end < len(docs):
+            # 上位だけを部分ソート
+            part = np.argpartition(-scores, end - 1)[:end]
+            docs, scores = docs[part], scores[part]
+        order = np.lexsort((docs, -scores))
+        return docs[order][start:end]
+    
+    # ===== 集計 =====
+    def _metric(self, kind: str, options: dict, docs: np.ndarray) -> dict:
+        """cardinality / max / min"""
+        field_name = options.get("field", "")
+        column = self._column(field_name)
+        mask = self.corpus.exists(field_name)[docs]
+        values = column[docs][mask]
+        if kind == "cardinality":
+            return {"value": int(len(np.unique(values)))}
+        if len(values) == 0:
+            return {"value": None}
+        value = values.max() if kind == "max" else values.min()
+        result = {"value": float(value)}
+        if field_name == "collected_at":
+            result["value_as_string"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(float(value) / 1000))
+        return result
+    
+    def _composite(self, options: dict, sub_aggs: dict, mask: np.ndarray, scores: np.ndarray,
+                   cache_key: str, body: dict, phrases: List[str], index: str) -> dict:
+        """
+        composite集計（terms の組み合わせ、after によるページング）
+        
+        同じ集計条件の続きのページが連続して要求されるため、全バケットをまとめて計算してキャッシュし、
+        ページごとに切り出して返す
+        """
+        sources = []
+        for source in options.get("sources") or []:
+            name, spec = next(iter(source.items()))
+            if "terms" not in spec:
+                raise QueryError("composite sources support [terms] only")
+            sources.append((name, spec["terms"]["field"]))
+        if not sources:
+            raise QueryError("[composite] requires sources")
+        
+        def build():
+            docs = np.flatnonzero(mask)
+            columns = [self._column(f)[docs].astype(np.int64) for _, f in sources]
+            # 欠損値のあるページは除く（terms の既定の動作）
+            present = np.ones(len(docs), dtype=bool)
+            for _, f in sources:
+                present &= self.corpus.exists(f)[docs]
+            docs = docs[present]
+            columns = [c[present] for c in columns]
+            order = np.lexsort((docs, *reversed(columns)))  # キーの昇順、同じキー内はページ番号順
+            docs = docs[order]
+            columns = [c[order] for c in columns]
+            if len(docs):
+                change = np.zeros(len(docs), dtype=bool)
+                change[0] = True
+                for c in columns:
+                    change[1:] |= c[1:] != c[:-1]
+                starts = np.flatnonzero(change)
+            else:
+                starts = np.array([], dtype=np.int64)
+            keys = [tuple(int(c[s]) for c in columns) for s in starts]
+            return {"docs": docs, "columns": columns, "starts": starts, "keys": keys}
+        
+        groups = self._cached(self._composite_cache, cache_key, build)
+        keys, starts, docs = groups["keys"], groups["starts"], groups["docs"]
+        
+        first = 0
+        after = options.get("after")
+        if after:
+            after_key = []
+            for name, f in sources:
+                value = after.get(name)
+                dictionary = self.corpus.keyword_dictionary(f)
+                if dictionary is None:
+                    after_key.append(float(value))
+                else:
+                    # 辞書にない値は直前の値との間として扱う
+                    position = int(np.searchsorted(dictionary, str(value)))
+                    exact = position < len(dictionary) and dictionary[position] == str(value)
+                    after_key.append(position if exact else position - 0.5)
+            first = bisect.bisect_right(keys, tuple(after_key))
+        size = int(options.get("size", 10))
+        page = range(first, min(len(keys), first + size))
+        
+        buckets = []
+        for g in page:
+            start = starts[g]
+            end = starts[g + 1] if g + 1 < len(starts) else len(docs)
+            group_docs = docs[start:end]
+            key = {
+                name: self.corpus.decode(f, np.array([value]))[0]
+                for (name, f), value in zip(sources, keys[g])
+            }
+            bucket = {"key": key, "doc_count": int(end - start)}
+            bucket.update(self._aggregate(sub_aggs, group_docs, scores, body, phrases, index))
+            buckets.append(bucket)
+        
+        result = {"buckets": buckets}
+        if buckets:
+            result["after_key"] = buckets[-1]["key"]
+        return result
+    
+    def _aggregate(self, aggs: dict, docs: np.ndarray, scores: np.ndarray,
+                   body: dict, phrases: List[str], index: str, mask: Optional[np.ndarray] = None,
+                   query_key: str = "") -> dict:
+        """
+        集計を評価
+        
+        Args:
+            aggs: 集計の定義
+            docs: 対象のページ番号
+            scores: ページごとのスコア
+            body: リクエスト本文
+            phrases: ハイライト用のフレーズ
+            index: 結果に入れるインデックス名
+            mask: 対象ページの真偽値（composite用、最上位のみ）
+            query_key: キャッシュのキーにするクエリ（最上位のみ）
+        
+        Returns:
+            dict: 集計名 → 結果
+        """
+        results = {}
+        for name, definition in (aggs or {}).items():
+            definition = dict(definition)
+            sub_aggs = definition.pop("aggs", None) or definition.pop("aggregations", None) or {}
+            if len(definition) != 1:
+                raise QueryError(f"aggregation [{name}] must have exactly one type")
+            kind, options = next(iter(definition.items()))
+            if kind in ("cardinality", "max", "min"):
+                results[name] = self._metric(kind, options, docs)
+            elif kind == "value_count":
+                results[name] = {"value": int(self.corpus.exists(options.get("field", ""))[docs].sum())}
+            elif kind == "top_hits":
+                start, size = int(options.get("from", 0)), int(options.get("size", 3))
+                if start + size > MAX_INNER_RESULT_WINDOW:
+                    raise QueryError(
+                        f"Top hits result window is too large, the top hits aggregator [{name}]'s from + size must be "
+                        f"less than or equal to: [{MAX_INNER_RESULT_WINDOW}] but was [{start + size}]. This limit can be "
+                        "set by changing the [index.max_inner_result_window] index level setting."
+                    )
+                top = self._top(docs, scores[docs], start, size)
+                hits_body = {"_source": options.get("_source", True), "highlight": options.get("highlight")}
+                results[name] = {"hits": {
+                    "total": {"value": int(len(docs)), "relation": "eq"},
+                    "max_score": float(scores[docs].max()) if len(docs) else None,
+                    "hits": [self._hit(int(d), scores[d], hits_body, phrases, index) for d in top],
+                }}
+            elif kind == "composite":
+                if mask is None:
+                    mask = np.zeros(self.corpus.size, dtype=bool)
+                    mask[docs] = True
+                options_key = {k: v for k, v in options.items() if k != "after"}
+                cache_key = json.dumps([query_key, options_key, sub_aggs], sort_keys=True, ensure_ascii=False)
+                results[name] = self._composite(options, sub_aggs, mask, scores, cache_key, body, phrases, index)
+            else:
+                raise QueryError(f"unknown aggregation type [{kind}]")
+        return results
+    
+    def search(self, body: dict, index: str = "corpus") -> Tuple[dict, str]:
+        """
+        _search を実行
+        
+        Args:
+            body: リクエスト本文
+            index: 結果に入れるインデックス名
+        
+        Returns:
+            Tuple[dict, str]: (応答, 検索の種類)
+        """
+        started = time.perf_counter()
+        query = body.get("query")
+        mask, scores = self.evaluate(query)
+        docs = np.flatnonzero(mask)
+        total = len(docs)
+        phrases = self._phrases(query)
+        
+        size = int(body.get("size", 10))
+        start = int(body.get("from", 0))
+        if start + size > MAX_RESULT_WINDOW:
+            raise QueryError(
+                f"Result window is too large, from + size must be less than or equal to: [{MAX_RESULT_WINDOW}] "
+                f"but was [{start + size}]. This limit can be set by changing the [index.max_result_window] index level setting."
+            )
+        hits = [
+            self._hit(int(d), scores[d], body, phrases, index)
+            for d in self._top(docs, scores[docs], start, size)
+        ]
+        
+        track = body.get("track_total_hits", TRACK_TOTAL_HITS_DEFAULT)
+        if track is True:
+            limit = total
+        elif track is False:
+            limit = None
+        else:
+            limit = int(track)
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "max_score": float(scores[docs].max()) if total and size else None,
+                "hits": hits,
+            },
+        }
+        if limit is not None:
+            response["hits"]["total"] = (
+                {"value": total, "relation": "eq"} if total <= limit else {"value": limit, "relation": "gte"}
+            )
+        
+        aggs = body.get("aggs") or body.get("aggregations")
+        kind = "hits"
+        if aggs:
+            query_key = json.dumps(query, sort_keys=True, ensure_ascii=False)
+            response["aggregations"] = self._aggregate(aggs, docs, scores, body, phrases, index, mask, query_key)
+            kind = "composite" if any("composite" in a for a in aggs.values()) else "aggs"
+        response["took"] = int((time.perf_counter() - started) * 1000)
+        return response, kind
+
+
+class ESStubServer:
+    """
+    Elasticsearch互換のスタブサーバー（/、/{index}/_search、/_tasks、/_stub/stats、/_stub/reset）
+    
+    ベンチマークからはスレッドで起動し、base_urlをElasticsearchクライアントに渡して使用する
+    インデックス名は区別せず、すべて同じコーパスを検索する
+    """
+    
+    def __init__(self, corpus: Corpus, config: Optional[ESStubConfig] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            corpus: 検索対象のコーパス
+            config: 応答設定
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0なら空きポート）
+        """
+        self.corpus = corpus
+        self.engine = SearchEngine(corpus)
+        self.config = config or ESStubConfig()
+        self.stats = ESStubStats()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._tasks: Dict[int, StubTask] = {}
+        self._task_ids = itertools.count(1)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        """Elasticsearchクライアントに渡す接続先"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self) -> "ESStubServer":
+        """バックグラウンドスレッドで起動"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="es-stub", daemon=True)
+        self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        """現在のスレッドで起動（Ctrl+Cで停止）"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+    
+    def stop(self):
+        """停止"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def reset(self):
+        """集計値をリセット"""
+        with self._lock:
+            self.stats = ESStubStats()
+    
+    def begin_task(self, opaque_id: str, description: str) -> StubTask:
+        """処理中の検索として登録"""
+        with self._lock:
+            task = StubTask(next(self._task_ids), opaque_id, description)
+            self._tasks[task.task_id] = task
+        return task
+    
+    def end_task(self, task: StubTask):
+        """処理中の検索から外す"""
+        with self._lock:
+            self._tasks.pop(task.task_id, None)
+    
+    def list_tasks(self, actions: str = "") -> dict:
+        """
+        処理中の検索の一覧（_tasks の応答）
+        
+        Args:
+            actions: タスクの種類（カンマ区切り、ワイルドカード可。空ならすべて）
+        
+        Returns:
+            dict: ノードごとのタスク
+        """
+        patterns = [a for a in actions.split(",") if a]
+        if patterns and not any(fnmatch.fnmatchcase(SEARCH_ACTION, p) for p in patterns):
+            return {"nodes": {}}
+        with self._lock:
+            tasks = {f"{NODE_ID}:{t.task_id}": t.to_dict() for t in self._tasks.values()}
+        return {"nodes": {NODE_ID: {"name": "es-stub", "tasks": tasks}}} if tasks else {"nodes": {}}
+    
+    def cancel_task(self, task_id: str) -> Optional[dict]:
+        """
+        検索を取り消す
+        
+        Args:
+            task_id: タスクの識別子（"ノード:番号"）
+        
+        Returns:
+            Optional[dict]: _cancel の応答（タスクが無ければNone）
+        """
+        node, _, number = task_id.partition(":")
+        with self._lock:
+            task = self._tasks.get(int(number)) if node == NODE_ID and number.isdigit() else None
+            if task is None:
+                return None
+            if not task.cancelled.is_set():
+                task.cancelled.set()
+                self.stats.cancelled += 1
+        return {"nodes": {NODE_ID: {"name": "es-stub", "tasks": {task_id: task.to_dict()}}}}
+    
+    def _decide(self) -> Tuple[int, float]:
+        """リクエストごとの応答内容（エラー・待機時間）を決定して集計"""
+        with self._lock:
+            self.stats.requests += 1
+            latency = self.config.latency_ms
+            if self.config.jitter_ms:
+                latency += self._rng.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+            if self._rng.random() < self.config.error_5xx:
+                self.stats.server_errors += 1
+                return 503, max(0.0, latency) / 1000
+            return 200, max(0.0, latency) / 1000
+    
+    def _record(self, kind: str, elapsed_ms: float, composite: bool):
+        """検索の集計"""
+        with self._lock:
+            self.stats.searches += 1
+            self.stats.search_ms += elapsed_ms
+            self.stats.kinds[kind] = self.stats.kinds.get(kind, 0) + 1
+            if composite:
+                self.stats.composite_pages += 1
+    
+    def _make_handler(self):
+        """リクエストハンドラーを作成"""
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # クライアントの接続プールを再利用できるようにする
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def _send_json(self, status: int, payload: Optional[dict]):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+                # クライアントが受け付ける場合は圧縮して返す（http_compress）
+                compress = len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", "")
+                if compress:
+                    body = gzip.compress(body, compresslevel=1)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if compress:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-Elastic-Product", "Elasticsearch")  # クライアントが製品確認に使う
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+                    with server._lock:
+                        server.stats.bytes_sent += len(body)
+                        server.stats.compressed += int(compress)
+            
+            def _send_error(self, status: int, error_type: str, reason: str):
+                self._send_json(status, {
+                    "error": {"root_cause": [{"type": error_type, "reason": reason}], "type": error_type, "reason": reason},
+                    "status": status,
+                })
+            
+            def _read_body(self) -> dict:
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                if raw and self.headers.get("Content-Encoding", "") == "gzip":
+                    raw = gzip.decompress(raw)
+                return json.loads(raw) if raw else {}
+            
+            def _info(self):
+                self._send_json(200, {
+                    "name": "es-stub",
+                    "cluster_name": "gfinder-stub",
+                    "version": {"number": ES_VERSION, "build_flavor": "default", "lucene_version": "9.10.0"},
+                    "tagline": "You Know, for Search",
+                })
+            
+            def do_HEAD(self):
+                self._info()
+            
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip("/")
+                if path == "":
+                    self._info()
+                elif path == "/_stub/stats":
+                    with server._lock:
+                        self._send_json(200, asdict(server.stats))
+                elif path == "/_tasks":
+                    actions = parse_qs(urlparse(self.path).query).get("actions", [""])[0]
+                    self._send_json(200, server.list_tasks(actions))
+                elif path.endswith("/_search"):
+                    self._search(path)
+                else:
+                    self._send_error(404, "resource_not_found_exception", f"no handler for [{path}]")
+            
+            def do_POST(self):
+                path = urlparse(self.path).path.rstrip("/")
+                if path == "/_stub/reset":
+                    server.reset()
+                    self._send_json(200, {"acknowledged": True})
+                elif path.startswith("/_tasks/") and path.endswith("/_cancel"):
+                    task_id = unquote(path[len("/_tasks/"):-len("/_cancel")])
+                    response = server.cancel_task(task_id)
+                    if response is None:
+                        self._send_error(404, "resource_not_found_exception", f"task [{task_id}] is missing")
+                    else:
+                        self._send_json(200, response)
+                elif path.endswith("/_search"):
+                    self._search(path)
+                else:
+                    self._send_error(404, "resource_not_found_exception", f"no handler for [{path}]")
+            
+            def _search(self, path: str):
+                try:
+                    body = self._read_body()
+                except (ValueError, OSError) as e:  # 不正なJSON・gzip
+                    self._send_error(400, "parse_exception", str(e))
+                    return
+                index = path[:-len("/_search")].strip("/").split(",")[0] or "corpus"
+                task = server.begin_task(self.headers.get("X-Opaque-Id", ""), f"indices[{index}]")
+                try:
+                    self._run_search(body, index, task)
+                finally:
+                    server.end_task(task)
+            
+            def _run_search(self, body: dict, index: str, task: StubTask):
+                status, latency = server._decide()
+                task.cancelled.wait(latency)  # 待機中に取り消されたらすぐに返す
+                if status != 200:
+                    self._send_error(status, "unavailable_shards_exception", "stub: simulated failure")
+                    return
+                if task.cancelled.is_set():
+                    self._send_error(400, "task_cancelled_exception", "task cancelled [by user request]")
+                    return
+                
+                started = time.perf_counter()
+                try:
+                    response, kind = server.engine.search(body, index)
+                except QueryError as e:
+                    with server._lock:
+                        server.stats.errors += 1
+                    self._send_error(400, "parsing_exception", str(e))
+                    return
+                except Exception as e:
+                    with server._lock:
+                        server.stats.errors += 1
+                    self._send_error(500, "exception", f"{type(e).__name__}: {e}")
+                    return
+                server._record(kind, (time.perf_counter() - started) * 1000, kind == "composite")
+                if task.cancelled.is_set():
+                    self._send_error(400, "task_cancelled_exception", "task cancelled [by user request]")
+                    return
+                try:
+                    self._send_json(200, response)
+                except (BrokenPipeError, ConnectionResetError):
+                    # クライアントが接続を閉じた（タイムアウト・中断）
+                    pass
+        
+        return Handler
+
+
+def main():
+    """コマンドラインから起動"""
+    parser = argparse.ArgumentParser(description="Elasticsearch互換のスタブサーバー（合成コーパス）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--pages", type=int, default=1_000_000, help="合成コーパスのページ数")
+    parser.add_argument("--sentences-per-page", type=int, default=12)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="1リクエストごとに加える待機時間")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="503を返す確率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    jichitai, catmap = load_masters()
+    started = time.perf_counter()
+    corpus = Corpus(jichitai, catmap, CorpusConfig(
+        pages=args.pages, sentences_per_page=args.sentences_per_page, seed=args.seed
+    ))
+    print(f"コーパス: {corpus.describe()}（{time.perf_counter() - started:.1f}秒）")
+    config = ESStubConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_5xx=args.error_5xx, seed=args.seed
+    )
+    server = ESStubServer(corpus, config, host=args.host, port=args.port)
+    print(f"Elasticsearch stub listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+OpenAI互換のChat Completionsスタブサーバー
+実APIを使わずにAI要約の負荷試験・ベンチマークを行うためのローカルサーバー
+
+使い方:
+    python -m benchmarks.openai_stub --port 8901 --latency lognormal --latency-mean 1.5 --error-429 0.05
+    
+    .streamlit/secrets.toml に OPENAI_BASE_URL = "http://127.0.0.1:8901/v1" を設定するとアプリから利用できる
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from token_counter import count_tokens
+
+
+PROMPT_CACHE_INCREMENT = 128  # キャッシュ済みトークン数の刻み
+PROMPT_CACHE_ENTRIES = 256  # 先頭一致を調べる直近のプロンプト数
+
+# 応答本文の素材（自治体別分析の形式に似せたテキスト）
+RESPONSE_SENTENCES = [
+    "【全体の傾向】\n各自治体で脱炭素・再生可能エネルギーに関する計画の策定が進んでいます。\n",
+    "■ 東京都 千代田区\n- 特徴: 公共施設への太陽光発電設備の導入を計画しています。\n",
+    "- 根拠となる記載: 「2030年度までに公共施設の電力を100%再生可能エネルギーとする」\n",
+    "- 根拠となる資料名: 「千代田区地球温暖化対策実行計画」（2023年度）\n",
+    "■ 大阪府 大阪市\n- 特徴: 市民・事業者との協働による省エネルギー施策を重視しています。\n",
+    "【時期的な変化】\n2020年度以降、目標年度の前倒しと数値目標の具体化が見られます。\n",
+    "【重要キーワード】\n脱炭素、再生可能エネルギー、省エネルギー、地域循環共生圏\n",
+]
+
+
+@dataclass
+class StubConfig:
+    """スタブサーバーの応答設定"""
+    latency: str = "lognormal"  # 初回トークンまでの時間の分布（fixed / uniform / exponential / lognormal）
+    latency_mean: float = 1.0  # 初回トークンまでの平均時間（秒）
+    latency_sigma: float = 0.5  # 分布のばらつき（uniformは±幅の割合、lognormalは対数の標準偏差）
+    tokens_per_second: float = 80.0  # 生成速度（0なら待機なし）
+    completion_tokens: int = 400  # 1回の応答の出力トークン数（max_tokensで頭打ち）
+    error_429: float = 0.0  # 429（レート制限）を返す確率
+    error_5xx: float = 0.0  # 500/503を返す確率
+    retry_after: float = 1.0  # 429応答のretry-after秒数
+    prompt_cache_min_tokens: int = 1024  # プロンプトキャッシュが効く先頭一致の最小トークン数（0ならキャッシュなし）
+    seed: Optional[int] = None  # 乱数シード（再現用）
+
+
+@dataclass
+class StubStats:
+    """スタブサーバーの集計値"""
+    requests: int = 0
+    streamed: int = 0
+    rate_limited: int = 0
+    server_errors: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    models: dict = field(default_factory=dict)  # モデル名 → リクエスト数
+
+
+def sample_latency(config: StubConfig, rng: random.Random) -> float:
+    """
+    設定した分布から初回トークンまでの時間をサンプリング
+    
+    Args:
+        config: 応答設定
+        rng: 乱数生成器
+    
+    Returns:
+        float: 待機秒数
+    """
+    mean = max(config.latency_mean, 0.0)
+    if mean == 0 or config.latency == "fixed":
+        return mean
+    if config.latency == "uniform":
+        width = mean * config.latency_sigma
+        return max(0.0, rng.uniform(mean - width, mean + width))
+    if config.latency == "exponential":
+        return rng.expovariate(1.0 / mean)
+    # lognormal: 平均がlatency_meanになるようにmuを調整
+    sigma = max(config.latency_sigma, 1e-6)
+    mu = math.log(mean) - sigma ** 2 / 2
+    return rng.lognormvariate(mu, sigma)
+
+
+def build_completion_text(tokens: int, model: str) -> str:
+    """
+    指定トークン数程度の応答テキストを作成
+    
+    Args:
+        tokens: 出力トークン数
+        model: モデル名（トークン数の計測に使用）
+    
+    Returns:
+        str: 応答テキスト
+    """
+    text = ""
+    i = 0
+    while count_tokens(text, model) < tokens:
+        text += RESPONSE_SENTENCES[i % len(RESPONSE_SENTENCES)]
+        i += 1
+    return text
+
+
+class StubServer:
+    """
+    OpenAI互換のスタブサーバー（/v1/chat/completions、/stats、/reset）
+    
+    ベンチマークからはスレッドで起動し、base_urlをOpenAIクライアントに渡して使用する
+    """
+    
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            config: 応答設定
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0なら空きポート）
+        """
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._texts = {}
+        self._recent_prompts = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        """OpenAIクライアントに渡す接続先"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def start(self) -> "StubServer":
+        """バックグラウンドスレッドで起動"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="openai-stub", daemon=True)
+        self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        """現在のスレッドで起動（Ctrl+Cで停止）"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+    
+    def stop(self):
+        """停止"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def reset(self):
+        """集計値とプロンプトキャッシュをリセット"""
+        with self._lock:
+            self.stats = StubStats()
+            self._recent_prompts = []
+    
+    def _completion_text(self, tokens: int, model: str) -> str:
+        """出力トークン数ごとの応答テキスト（作成済みなら再利用）"""
+        key = (tokens, model)
+        if key not in self._texts:
+            self._texts[key] = build_completion_text(tokens, model)
+        return self._texts[key]
+    
+    def _cached_tokens(self, model: str, prompt: str) -> int:
+        """
+        直近のプロンプトとの先頭一致部分から、プロンプトキャッシュが効くトークン数を計算
+        （OpenAIと同様に最小トークン数以上・一定の刻みで切り捨て）
+        """
+        minimum = self.config.prompt_cache_min_tokens
+        with self._lock:
+            recent = [p for m, p in self._recent_prompts if m == model]
+            self._recent_prompts.append((model, prompt))
+            del self._recent_prompts[:-PROMPT_CACHE_ENTRIES]
+        if minimum <= 0 or not recent:
+            return 0
+        common = max(len(os.path.commonprefix([prompt, p])) for p in recent)
+        tokens = count_tokens(prompt[:common], model)
+        if tokens < minimum:
+            return 0
+        return tokens // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+    
+    def _decide(self, model: str, stream: bool, prompt_tokens: int):
+        """リクエストごとの応答内容（エラー・待機時間）を決定して集計"""
+        with self._lock:
+            roll = self._rng.random()
+            latency = sample_latency(self.config, self._rng)
+            self.stats.requests += 1
+            self.stats.models[model] = self.stats.models.get(model, 0) + 1
+            if roll < self.config.error_429:
+                self.stats.rate_limited += 1
+                return 429, latency
+            if roll < self.config.error_429 + self.config.error_5xx:
+                self.stats.server_errors += 1
+                return self._rng.choice([500, 503]), latency
+            self.stats.prompt_tokens += prompt_tokens
+            if stream:
+                self.stats.streamed += 1
+            return 200, latency
+    
+    def _make_handler(self):
+        """リクエストハンドラーを作成"""
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                if self.path.rstrip("/") == "/stats":
+                    with server._lock:
+                        self._send_json(200, asdict(server.stats))
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+            
+            def do_POST(self):
+                if self.path.rstrip("/") == "/reset":
+                    server.reset()
+                    self._send_json(200, {"ok": True})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                model = request.get("model", "gpt-4o-mini")
+                stream = bool(request.get("stream"))
+                prompt = "".join(str(m.get("content", "")) for m in request.get("messages", []))
+                prompt_tokens = count_tokens(prompt, model)
+                status, latency = server._decide(model, stream, prompt_tokens)
+                
+                time.sleep(latency)
+                if status == 429:
+                    self._send_json(429, {"error": {
+                        "message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded",
+                    }}, headers={"retry-after": f"{server.config.retry_after:g}"})
+                    return
+                if status != 200:
+                    self._send_json(status, {"error": {"message": f"Server error {status} (stub)", "type": "server_error"}})
+                    return
+                
+                completion_tokens = min(server.config.completion_tokens, request.get("max_tokens") or 10 ** 9)
+                text = server._completion_text(completion_tokens, model)
+                completion_tokens = count_tokens(text, model)
+                cached_tokens = server._cached_tokens(model, prompt)
+                with server._lock:
+                    server.stats.completion_tokens += completion_tokens
+                    server.stats.cached_tokens += cached_tokens
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                }
+                completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+                created = int(time.time())
+                
+                if not stream:
+                    # 非ストリーミングは生成時間分待ってからまとめて返す
+                    if server.config.tokens_per_second > 0:
+                        time.sleep(completion_tokens / server.config.tokens_per_second)
+                    self._send_json(200, {
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+                    return
+                
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                
+                def send_chunk(choices: list, chunk_usage: Optional[dict] = None):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": choices,
+                    }
+                    if chunk_usage is not None:
+                        chunk["usage"] = chunk_usage
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                
+                # 約4文字ずつ生成速度に合わせて送信
+                step = 4
+                interval = step / server.config.tokens_per_second if server.config.tokens_per_second > 0 else 0
+                try:
+                    send_chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+                    for i in range(0, len(text), step):
+                        send_chunk([{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}])
+                        if interval:
+                            time.sleep(interval)
+                    send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        send_chunk([], usage)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # クライアントが接続を閉じた（中断）
+                    pass
+        
+        return Handler
+
+
+def main():
+    """コマンドラインから起動"""
+    parser = argparse.ArgumentParser(description="OpenAI互換のChat Completionsスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=1.0, help="初回トークンまでの平均秒数")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--error-429", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="500/503を返す確率")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024, help="0でプロンプトキャッシュなし")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    
+    config = StubConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        retry_after=args.retry_after,
+        prompt_cache_min_tokens=args.prompt_cache_min_tokens,
+        seed=args.seed,
+    )
+    server = StubServer(config, host=args.host, port=args.port)
+    print(f"OpenAI stub listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
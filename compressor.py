@@ -0,0 +1,223 @@
+"""
+文書の抽出型圧縮モジュール
+検索語との一致・対象文書全体に対するTF-IDF（文字バイグラム）・文書内の位置で文を採点し、
+文書ごとの文字数予算内で上位の文だけを残す（NumPyでベクトル化、形態素解析・機械学習ライブラリは不要）
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+
+SENTENCE_DELIMITERS = "。．！？!?\n"  # 文の区切り文字（区切り文字は直前の文に含める）
+HASH_BUCKETS = 1 << 18  # 文字バイグラムのハッシュのバケット数
+KEYWORD_WEIGHT = 0.5  # 検索語との一致の重み
+TFIDF_WEIGHT = 0.35  # TF-IDFの重み
+POSITION_WEIGHT = 0.15  # 文書内の位置（先頭ほど高い）の重み
+DEFAULT_CHARS_PER_DOC = 400  # 1文書あたりの文字数予算
+GAP_MARKER = "…"  # 省略した文の位置に入れる記号
+
+_DELIMITER_CODES = np.array([ord(c) for c in SENTENCE_DELIMITERS], dtype=np.uint32)
+_SPACE_CODES = np.array([ord(c) for c in " \t\r　"], dtype=np.uint32)
+
+
+@dataclass
+class CompressionResult:
+    """抽出型圧縮の結果"""
+    texts: List[str]  # 圧縮後のテキスト（入力と同じ順）
+    chars_before: int = 0  # 圧縮前の文字数
+    chars_after: int = 0  # 圧縮後の文字数
+    sentences_before: int = 0  # 圧縮前の文数
+    sentences_after: int = 0  # 圧縮後の文数
+    elapsed: float = 0.0  # 処理時間（秒）
+    
+    @property
+    def ratio(self) -> float:
+        """圧縮後の文字数の割合（0〜1）"""
+        return self.chars_after / self.chars_before if self.chars_before else 1.0
+
+
+def _unique_counts(keys: np.ndarray):
+    """
+    整数キーの重複除去と出現回数（ソートベース、ハッシュ表を使うnp.uniqueより大きな配列で高速）
+    
+    Args:
+        keys: 整数キーの配列
+    
+    Returns:
+        tuple: (昇順の一意なキー, キーごとの出現回数)
+    """
+    keys = np.sort(keys)
+    if keys.size == 0:
+        return keys, np.zeros(0, dtype=np.int64)
+    flags = np.empty(keys.size, dtype=bool)
+    flags[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=flags[1:])
+    starts = np.flatnonzero(flags)
+    return keys[starts], np.diff(np.append(starts, keys.size))
+
+
+def _sentence_scores(
+    codes: np.ndarray,
+    sentence_ids: np.ndarray,
+    sentence_docs: np.ndarray,
+    char_docs: np.ndarray,
+    n_sentences: int,
+    n_docs: int
+) -> np.ndarray:
+    """
+    文ごとのTF-IDFスコアを計算（文書内の頻度×対象文書全体の逆文書頻度を文のバイグラムで合計）
+    
+    Args:
+        codes: 全文書を連結したテキストの文字コード
+        sentence_ids: 文字ごとの文番号
+        sentence_docs: 文ごとの文書番号
+        char_docs: 文字ごとの文書番号
+        n_sentences: 文数
+        n_docs: 文書数
+    
+    Returns:
+        np.ndarray: 文ごとのスコア（文書内の最大値で0〜1に正規化）
+    """
+    if codes.size < 2:
+        return np.zeros(n_sentences)
+    
+    # 同じ文の中の、区切り文字・空白を含まない文字バイグラム
+    content = ~(np.isin(codes, _DELIMITER_CODES) | np.isin(codes, _SPACE_CODES))
+    valid = content[:-1] & content[1:] & (sentence_ids[:-1] == sentence_ids[1:])
+    hashes = (codes[:-1].astype(np.uint64) * np.uint64(1000003) + codes[1:]) % np.uint64(HASH_BUCKETS)
+    hashes = hashes[valid].astype(np.int64)
+    if hashes.size == 0:
+        return np.zeros(n_sentences)
+    bigram_sentences = sentence_ids[:-1][valid]
+    bigram_docs = char_docs[:-1][valid]
+    
+    # 文書内の出現回数と文書頻度
+    doc_keys, doc_counts = _unique_counts(bigram_docs * HASH_BUCKETS + hashes)
+    df = np.bincount(doc_keys % HASH_BUCKETS, minlength=HASH_BUCKETS)
+    idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+    
+    # 文ごとに重複を除いたバイグラムの重み（log(1+文書内の出現回数)×idf）を合計
+    sentence_keys, _ = _unique_counts(bigram_sentences * HASH_BUCKETS + hashes)
+    pair_sentences = sentence_keys // HASH_BUCKETS
+    pair_hashes = sentence_keys % HASH_BUCKETS
+    pair_doc_keys = sentence_docs[pair_sentences] * HASH_BUCKETS + pair_hashes
+    tf = doc_counts[np.searchsorted(doc_keys, pair_doc_keys)]
+    weights = np.log1p(tf) * idf[pair_hashes]
+    totals = np.bincount(pair_sentences, weights=weights, minlength=n_sentences)
+    terms = np.bincount(pair_sentences, minlength=n_sentences)
+    scores = totals / np.sqrt(np.maximum(terms, 1))
+    
+    doc_max = np.zeros(n_docs)
+    np.maximum.at(doc_max, sentence_docs, scores)
+    return scores / np.maximum(doc_max[sentence_docs], 1e-9)
+
+
+def compress_texts(
+    texts: List[str],
+    keywords: Optional[List[str]] = None,
+    chars_per_doc: int = DEFAULT_CHARS_PER_DOC
+) -> CompressionResult:
+    """
+    文書ごとに重要度の高い文だけを残して文字数予算内に圧縮
+    
+    文の重要度は 検索語との一致（含まれる検索語の割合）・TF-IDF・文書内の位置 の重み付き和。
+    予算内に収まる文書はそのまま残し、残した文は元の順に並べ、省略箇所には GAP_MARKER を入れる
+    
+    Args:
+        texts: 文書の本文のリスト
+        keywords: 検索語のリスト
+        chars_per_doc: 1文書あたりの文字数予算
+    
+    Returns:
+        CompressionResult: 圧縮結果
+    """
+    started = time.perf_counter()
+    texts = [str(text or "") for text in texts]
+    keywords = [k for k in (keywords or []) if k]
+    n_docs = len(texts)
+    result = CompressionResult(texts=list(texts), chars_before=sum(len(t) for t in texts))
+    if n_docs == 0:
+        return result
+    
+    # 全文書を改行区切りで連結して文字コードの配列に変換（文は文書をまたがない）
+    full = "".join(text + "\n" for text in texts)
+    codes = np.frombuffer(full.encode("utf-32-le"), dtype=np.uint32)
+    doc_lengths = np.array([len(text) + 1 for text in texts])
+    doc_starts = np.concatenate([[0], np.cumsum(doc_lengths)[:-1]])
+    char_docs = np.repeat(np.arange(n_docs), doc_lengths)
+    
+    # 文の範囲（区切り文字までを1文とする）
+    delimiter_positions = np.flatnonzero(np.isin(codes, _DELIMITER_CODES))
+    sentence_ends = delimiter_positions + 1
+    sentence_starts = np.concatenate([[0], sentence_ends[:-1]])
+    n_sentences = len(sentence_starts)
+    sentence_ids = np.repeat(np.arange(n_sentences), sentence_ends - sentence_starts)
+    sentence_docs = char_docs[sentence_starts]
+    sentence_lengths = sentence_ends - sentence_starts
+    
+    # 文書内の位置（先頭の文ほど高い）
+    first_sentence = np.searchsorted(sentence_starts, doc_starts)
+    rank = np.arange(n_sentences) - first_sentence[sentence_docs]
+    doc_sentence_counts = np.bincount(sentence_docs, minlength=n_docs)
+    position_scores = 1.0 - rank / np.maximum(doc_sentence_counts[sentence_docs], 1)
+    
+    # 検索語との一致（文に含まれる検索語の種類数の割合）
+    keyword_scores = np.zeros(n_sentences)
+    for keyword in keywords:
+        positions = np.fromiter((m.start() for m in re.finditer(re.escape(keyword), full)), dtype=np.int64)
+        if positions.size:
+            keyword_scores[np.unique(sentence_ids[positions])] += 1.0
+    if keywords:
+        keyword_scores /= len(keywords)
+    
+    tfidf_scores = _sentence_scores(codes, sentence_ids, sentence_docs, char_docs, n_sentences, n_docs)
+    scores = KEYWORD_WEIGHT * keyword_scores + TFIDF_WEIGHT * tfidf_scores + POSITION_WEIGHT * position_scores
+    
+    # 空白・区切り文字だけの文は採点対象外
+    content_lengths = np.array([len(full[s:e].strip()) for s, e in zip(sentence_starts, sentence_ends)])
+    scores[content_lengths == 0] = -np.inf
+    
+    # 文書ごとにスコアの高い順に、累積文字数が予算に収まる文を採用（各文書の最上位の文は必ず採用）
+    order = np.lexsort((-scores, sentence_docs))
+    ordered_lengths = sentence_lengths[order]
+    cumulative = np.cumsum(ordered_lengths)
+    group_starts = np.searchsorted(sentence_docs[order], np.arange(n_docs))
+    offsets = np.concatenate([[0], cumulative])[group_starts]
+    cumulative_in_doc = cumulative - offsets[sentence_docs[order]]
+    is_first = np.zeros(n_sentences, dtype=bool)
+    is_first[group_starts[doc_sentence_counts > 0]] = True
+    keep_ordered = ((cumulative_in_doc <= chars_per_doc) | is_first) & np.isfinite(scores[order])
+    keep = np.zeros(n_sentences, dtype=bool)
+    keep[order[keep_ordered]] = True
+    
+    result.sentences_before = int(np.count_nonzero(content_lengths))
+    kept_sentences = 0
+    doc_content_sentences = np.bincount(sentence_docs, weights=content_lengths > 0, minlength=n_docs)
+    for doc in range(n_docs):
+        if len(texts[doc]) <= chars_per_doc:
+            kept_sentences += int(doc_content_sentences[doc])
+            continue
+        first = first_sentence[doc]
+        last = first + doc_sentence_counts[doc]
+        parts = []
+        previous = first - 1
+        for sentence in range(first, last):
+            if not keep[sentence]:
+                continue
+            if sentence != previous + 1 and parts:
+                parts.append(GAP_MARKER)
+            parts.append(full[sentence_starts[sentence]:sentence_ends[sentence]].strip())
+            previous = sentence
+            kept_sentences += 1
+        if previous != last - 1 and parts:
+            parts.append(GAP_MARKER)
+        result.texts[doc] = "".join(parts)[:chars_per_doc]
+    
+    result.sentences_after = kept_sentences
+    result.chars_after = sum(len(text) for text in result.texts)
+    result.elapsed = time.perf_counter() - started
+    return result
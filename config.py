@@ -32,6 +32,45 @@ def get_secret(key: str, default: str = "") -> str:
         return default
 
 
+def get_secret_int(key: str, default: int) -> int:
+    """
+    Streamlit Secretsから整数値を取得。存在しない・数値でない場合はデフォルト値を返す
+    
+    Args:
+        key: Secretsのキー名
+        default: キーが存在しない場合のデフォルト値
+    
+    Returns:
+        int: 取得した値またはデフォルト値
+    """
+    try:
+        return int(get_secret(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_secret_bool(key: str, default: bool) -> bool:
+    """
+    Streamlit Secretsから真偽値を取得（true/false、1/0、yes/no）。存在しない・判別できない場合はデフォルト値を返す
+    
+    Args:
+        key: Secretsのキー名
+        default: キーが存在しない場合のデフォルト値
+    
+    Returns:
+        bool: 取得した値またはデフォルト値
+    """
+    value = get_secret(key, default)
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "on"):
+        return True
+    if text in ("false", "0", "no", "off"):
+        return False
+    return default
+
+
 def get_indexes() -> list:
     """
     Elasticsearchインデックスのリストを取得
@@ -9,7 +9,14 @@ from typing import Any
 import pandas as pd
 import streamlit as st
 from elasticsearch import Elasticsearch
-from config import FIELD_FILE_ID, FIELD_COLLECTED_AT, get_indexes
+from config import FIELD_CODE, FIELD_FILE_ID, FIELD_COLLECTED_AT, get_indexes
+from elasticsearch_client import with_timeout
+from search_cancel import cancellable_search
+from tracing import mark_cache_miss, span, traced
+
+
+HIGHLIGHT_FRAGMENT_SIZE = 200  # 要約用の抜粋で使うハイライト断片の文字数
+MAX_TOP_HITS = 100  # top_hitsで返せる件数の上限（ESの index.max_inner_result_window の既定値）
 
 
 def _qkey(obj: Any) -> str:
@@ -17,6 +24,7 @@ def _qkey(obj: Any) -> str:
     return json.dumps(obj, sort_keys=True, ensure_ascii=False)
 
 
+@traced(cached=True)
 @st.cache_data(show_spinner=False, ttl=300)
 def fetch_counts(
     _es: Elasticsearch,
@@ -36,6 +44,7 @@ def fetch_counts(
     Returns:
         pd.DataFrame: 集計結果（g, category, page_docs, file_docs）
     """
+    mark_cache_miss()
     indexes = get_indexes()
     after, recs = None, []
     while True:
@@ -59,7 +68,8 @@ def fetch_counts(
                 }
             },
         }
-        res = _es.search(index=indexes, body=body)
+        with span("es.search"), cancellable_search():
+            res = with_timeout(_es, "aggregation").search(index=indexes, body=body)
         for b in res["aggregations"]["by_pair"]["buckets"]:
             recs.append({
                 "g": str(b["key"]["g"]),
@@ -73,6 +83,7 @@ def fetch_counts(
     return pd.DataFrame.from_records(recs)
 
 
+@traced(cached=True)
 @st.cache_data(show_spinner=False, ttl=300)
 def fetch_latest_month(
     _es: Elasticsearch,
@@ -90,6 +101,7 @@ def fetch_latest_month(
     Returns:
         pd.DataFrame: 最新収集月データ（g, category, latest_epoch）
     """
+    mark_cache_miss()
     indexes = get_indexes()
     after, recs = None, []
     while True:
@@ -110,7 +122,8 @@ def fetch_latest_month(
                 }
             },
         }
-        res = _es.search(index=indexes, body=body)
+        with span("es.search"), cancellable_search():
+            res = with_timeout(_es, "aggregation").search(index=indexes, body=body)
         for b in res["aggregations"]["by_pair"]["buckets"]:
             recs.append({
                 "g": str(b["key"]["g"]),
@@ -123,22 +136,55 @@ def fetch_latest_month(
     return pd.DataFrame.from_records(recs)
 
 
+def build_excerpt(fragments: list[str], max_chars: int, separator: str = " … ") -> str:
+    """
+    ハイライト断片をつなげて文字数上限内の抜粋を作成（断片はスコア順に採用）
+    
+    Args:
+        fragments: ハイライト断片のリスト（スコアの高い順）
+        max_chars: 抜粋の最大文字数
+        separator: 断片の区切り文字
+    
+    Returns:
+        str: 抜粋テキスト
+    """
+    excerpt = ""
+    for fragment in fragments:
+        fragment = " ".join(fragment.split())
+        if not fragment:
+            continue
+        candidate = f"{excerpt}{separator}{fragment}" if excerpt else fragment
+        if len(candidate) > max_chars:
+            if not excerpt:
+                excerpt = fragment[:max_chars]
+            break
+        excerpt = candidate
+    return excerpt
+
+
+@traced()
 def fetch_search_results(
     _es: Elasticsearch,
     query: dict,
     jichitai: pd.DataFrame,
     catmap: pd.DataFrame,
-    result_limit: int
+    result_limit: int,
+    excerpt_chars: int = 0
 ) -> pd.DataFrame:
     """
     検索結果を取得してDataFrame形式で返す
     
+    excerpt_charsを指定した場合は本文全体を取得せず、content_textのハイライト断片
+    （検索語の周辺）から文字数上限内の抜粋を作成して「本文」とする。
+    検索語に一致しない文書は本文の先頭を使用する
+    
     Args:
         _es: Elasticsearchクライアント（アンダースコアでキャッシュ対象外）
         query: 検索クエリ
         jichitai: 自治体マスターデータ
         catmap: カテゴリマスターデータ
         result_limit: 取得件数上限
+        excerpt_chars: 本文の抜粋の最大文字数（0なら本文全体を取得）
     
     Returns:
         pd.DataFrame: 検索結果
@@ -147,14 +193,67 @@ def fetch_search_results(
     body = {
         "size": result_limit,
         "query": query,
+        **_excerpt_options(excerpt_chars),
     }
-    res = _es.search(index=indexes, body=body)
+    with span("es.search"), cancellable_search():
+        res = with_timeout(_es, "search").search(index=indexes, body=body)
     hits = res.get("hits", {}).get("hits", [])
+    return _hits_to_dataframe(hits, jichitai, catmap, excerpt_chars)
+
+
+def _excerpt_options(excerpt_chars: int) -> dict:
+    """
+    本文の抜粋を返すための検索オプション（search / top_hits 共通）
     
+    Args:
+        excerpt_chars: 本文の抜粋の最大文字数（0なら本文全体を取得）
+    
+    Returns:
+        dict: _source・highlightの指定（本文全体を取得する場合は空）
+    """
+    if not excerpt_chars:
+        return {}
+    # 本文全体は返さず、検索語周辺の断片だけを返す（レスポンスサイズの削減）
+    return {
+        "_source": {"excludes": ["content_text"]},
+        "highlight": {
+            "pre_tags": [""],
+            "post_tags": [""],
+            "fields": {
+                "content_text": {
+                    "type": "unified",
+                    "fragment_size": HIGHLIGHT_FRAGMENT_SIZE,
+                    "number_of_fragments": excerpt_chars // HIGHLIGHT_FRAGMENT_SIZE + 1,
+                    "order": "score",
+                    "no_match_size": excerpt_chars,
+                }
+            },
+        },
+    }
+
+
+@traced("hits_to_dataframe")
+def _hits_to_dataframe(hits: list, jichitai: pd.DataFrame, catmap: pd.DataFrame, excerpt_chars: int) -> pd.DataFrame:
+    """
+    検索ヒットを検索結果のDataFrameに変換
+    
+    Args:
+        hits: 検索ヒットのリスト
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+        excerpt_chars: 本文の抜粋の最大文字数（0なら本文全体を使用）
+    
+    Returns:
+        pd.DataFrame: 検索結果
+    """
     # 必要な情報を抽出
     data = []
     for hit in hits:
         source = hit["_source"]
+        if excerpt_chars:
+            content_text = build_excerpt(hit.get("highlight", {}).get("content_text", []), excerpt_chars)
+        else:
+            content_text = source.get("content_text", "")
         
         # jichitai.xlsxのcodeを6桁にゼロ埋めして照合
         code_str = str(source.get("code")).zfill(6)
@@ -189,7 +288,7 @@ def fetch_search_results(
             "URL(GF)": url_gf,
             "URL(原本)": source.get("source_url", "") + "#page=" + str(source.get("file_page", "")),
             "ページ": str(source.get("file_page", "")) + "／" + str(source.get("number_of_pages", "")),
-            "本文": source.get("content_text", ""),
+            "本文": content_text,
             "開始年度": source.get("fiscal_year_start", ""),
             "終了年度": source.get("fiscal_year_end", ""),
     })
@@ -197,6 +296,126 @@ def fetch_search_results(
     return pd.DataFrame(data)
 
 
+def plan_group_sample(group_counts: list[int], sample_size: int) -> int:
+    """
+    グループごとの上位k件を抽出する場合に、合計が抽出件数以内に収まる最大のkを計算
+    
+    件数の少ないグループは全件、多いグループはk件で頭打ちになるため、すべてのグループを
+    できるだけ均等にカバーできる
+    
+    Args:
+        group_counts: グループごとのヒット件数
+        sample_size: 抽出件数の上限
+    
+    Returns:
+        int: 1グループあたりの抽出件数（グループ数が抽出件数を超える場合は0）
+    """
+    counts = [c for c in group_counts if c > 0]
+    if not counts or len(counts) > sample_size:
+        return 0
+    low, high = 1, max(counts)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if sum(min(c, mid) for c in counts) <= sample_size:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+@traced()
+def fetch_sample_results(
+    _es: Elasticsearch,
+    query: dict,
+    jichitai: pd.DataFrame,
+    catmap: pd.DataFrame,
+    per_group: int,
+    group_fields: tuple = (FIELD_CODE, "category"),
+    excerpt_chars: int = 0
+) -> pd.DataFrame:
+    """
+    グループ（自治体×カテゴリなど）ごとにスコア上位の文書だけを取得
+    
+    composite集計でグループを順にたどり、各グループのtop_hitsだけを返すため、
+    抽出しない文書は転送しない。top_hitsの上限（MAX_TOP_HITS）を超えて取得するグループは、
+    そのグループに絞り込んだ通常の検索で取得する
+    
+    Args:
+        _es: Elasticsearchクライアント（アンダースコアでキャッシュ対象外）
+        query: 検索クエリ
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+        per_group: 1グループあたりの取得件数
+        group_fields: グループ化するフィールド名
+        excerpt_chars: 本文の抜粋の最大文字数（0なら本文全体を取得）
+    
+    Returns:
+        pd.DataFrame: 検索結果（グループ順、グループ内はスコア順）
+    """
+    indexes = get_indexes()
+    top_size = min(per_group, MAX_TOP_HITS)
+    top_hits = {"size": top_size, **_excerpt_options(excerpt_chars)}
+    after, hits = None, []
+    while True:
+        body = {
+            "size": 0,
+            "query": query,
+            "aggs": {
+                "by_group": {
+                    "composite": {
+                        # top_hitsの件数に応じてページの大きさを抑える
+                        "size": max(min(500, 10000 // max(top_size, 1)), 1),
+                        "sources": [{field: {"terms": {"field": field}}} for field in group_fields],
+                        **({"after": after} if after else {}),
+                    },
+                    "aggs": {"top": {"top_hits": top_hits}},
+                }
+            },
+        }
+        with span("es.search"), cancellable_search():
+            res = with_timeout(_es, "sample").search(index=indexes, body=body)
+        for b in res["aggregations"]["by_group"]["buckets"]:
+            if per_group > MAX_TOP_HITS and b["doc_count"] > MAX_TOP_HITS:
+                hits.extend(_fetch_group_hits(_es, indexes, query, b["key"], min(per_group, b["doc_count"]), excerpt_chars))
+            else:
+                hits.extend(b["top"]["hits"]["hits"])
+        after = res["aggregations"]["by_group"].get("after_key")
+        if not after:
+            break
+    return _hits_to_dataframe(hits, jichitai, catmap, excerpt_chars)
+
+
+def _fetch_group_hits(_es: Elasticsearch, indexes: list, query: dict, key: dict, size: int, excerpt_chars: int) -> list:
+    """
+    1つのグループのスコア上位の文書を通常の検索で取得（top_hitsの上限を超える件数を取得する場合）
+    
+    Args:
+        _es: Elasticsearchクライアント
+        indexes: 検索対象のインデックス
+        query: 検索クエリ
+        key: グループのキー（composite集計のkey: フィールド名 → 値）
+        size: 取得件数
+        excerpt_chars: 本文の抜粋の最大文字数（0なら本文全体を取得）
+    
+    Returns:
+        list: 検索ヒットのリスト（スコア順）
+    """
+    body = {
+        "size": size,
+        "query": {
+            "bool": {
+                "must": [query],
+                "filter": [{"term": {field: value}} for field, value in key.items()],
+            }
+        },
+        **_excerpt_options(excerpt_chars),
+    }
+    with span("es.search"), cancellable_search():
+        res = with_timeout(_es, "sample").search(index=indexes, body=body)
+    return res.get("hits", {}).get("hits", [])
+
+
+@traced()
 def fetch_kpi(_es: Elasticsearch, query: dict) -> dict:
     """
     KPI（全体統計）を取得
@@ -218,7 +437,8 @@ def fetch_kpi(_es: Elasticsearch, query: dict) -> dict:
             "max_collected": {"max": {"field": FIELD_COLLECTED_AT}},
         },
     }
-    kpi_res = _es.search(index=indexes, body=kpi_body)
+    with span("es.search"), cancellable_search():
+        kpi_res = with_timeout(_es, "kpi").search(index=indexes, body=kpi_body)
     
     return {
         "total_pages": kpi_res.get("hits", {}).get("total", {}).get("value", 0),
@@ -6,6 +6,7 @@
 from pathlib import Path
 import pandas as pd
 import streamlit as st
+from tracing import mark_cache_miss, traced
 
 
 def get_data_path(filename: str) -> Path:
@@ -41,6 +42,7 @@ def get_data_path(filename: str) -> Path:
     )
 
 
+@traced(cached=True)
 @st.cache_data(show_spinner=False)
 def load_jichitai() -> pd.DataFrame:
     """
@@ -49,6 +51,7 @@ def load_jichitai() -> pd.DataFrame:
     Returns:
         pd.DataFrame: 自治体データ（code, affiliation_code, pref_name, city_name, city_type）
     """
+    mark_cache_miss()
     try:
         filepath = get_data_path("jichitai.xlsx")
         df = pd.read_excel(filepath, dtype={"code": str, "affiliation_code": str})
@@ -70,6 +73,7 @@ def load_jichitai() -> pd.DataFrame:
     return df[need]
 
 
+@traced(cached=True)
 @st.cache_data(show_spinner=False)
 def load_category() -> pd.DataFrame:
     """
@@ -78,6 +82,7 @@ def load_category() -> pd.DataFrame:
     Returns:
         pd.DataFrame: カテゴリデータ（category, category_name, short_name, order, group）
     """
+    mark_cache_miss()
     try:
         filepath = get_data_path("category.xlsx")
         df = pd.read_excel(filepath)
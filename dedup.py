@@ -0,0 +1,204 @@
+"""
+類似文書の重複除去モジュール
+本文の文字シングルのMinHash署名（NumPy）で類似ページをクラスタリングし、代表文書だけを残す
+"""
+
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+SHINGLE_SIZE = 5  # 文字シングルの長さ
+NUM_PERMUTATIONS = 64  # MinHash署名の長さ
+NUM_BANDS = 16  # LSHのバンド数（1バンドあたり NUM_PERMUTATIONS // NUM_BANDS 行）
+DEFAULT_THRESHOLD = 0.8  # 類似とみなす推定Jaccard係数
+DUPLICATE_COUNT_KEY = "類似文書数"  # 代表文書に付与する件数の列名
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_HASH_MASK = np.uint64((1 << 32) - 1)
+
+
+def _shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    テキストの文字シングルを32bitハッシュの配列に変換
+    
+    Args:
+        text: 対象テキスト
+        size: シングルの長さ
+    
+    Returns:
+        np.ndarray: 重複を除いたハッシュ値（uint64）
+    """
+    text = "".join(str(text).split())  # 空白・改行の違いは無視
+    if len(text) <= size:
+        shingles = [text] if text else []
+    else:
+        shingles = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+
+
+def minhash_signatures(texts: List[str], num_perm: int = NUM_PERMUTATIONS, seed: int = 1) -> np.ndarray:
+    """
+    テキストごとのMinHash署名を計算
+    
+    Args:
+        texts: テキストのリスト
+        num_perm: 署名の長さ（ハッシュ関数の数）
+        seed: ハッシュ関数の乱数シード
+    
+    Returns:
+        np.ndarray: 署名の配列（len(texts) × num_perm、空テキストは最大値）
+    """
+    rng = np.random.default_rng(seed)
+    # (a * x + b) mod p の形の普遍ハッシュ（x < 2^32, a < 2^29 で uint64 の範囲に収まる）
+    a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 29, size=num_perm, dtype=np.uint64)
+    
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        if hashes.size == 0:
+            continue
+        permuted = (np.outer(hashes, a) + b) % _MERSENNE_PRIME & _HASH_MASK
+        signatures[i] = permuted.min(axis=0)
+    return signatures
+
+
+def cluster_near_duplicates(
+    texts: List[str],
+    group_keys: Optional[List] = None,
+    threshold: float = DEFAULT_THRESHOLD,
+    num_perm: int = NUM_PERMUTATIONS,
+    num_bands: int = NUM_BANDS
+) -> List[int]:
+    """
+    類似テキストをクラスタリング（LSHで候補を絞り、署名の一致率で判定）
+    
+    Args:
+        texts: テキストのリスト
+        group_keys: テキストごとのグループキー（同じキーの中でだけクラスタリング、Noneなら全体）
+        threshold: 類似とみなす推定Jaccard係数
+        num_perm: 署名の長さ
+        num_bands: LSHのバンド数
+    
+    Returns:
+        List[int]: テキストごとの代表テキストのインデックス（クラスタ内で最初に出現したもの）
+    """
+    n = len(texts)
+    if group_keys is None:
+        group_keys = [None] * n
+    signatures = minhash_signatures(texts, num_perm=num_perm)
+    rows = num_perm // num_bands
+    empty = np.all(signatures == np.iinfo(np.uint64).max, axis=1)
+    
+    # Union-Find（代表は常に小さいインデックス）
+    parent = list(range(n))
+    
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    checked = set()
+    for band in range(num_bands):
+        buckets = {}
+        band_values = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(n):
+            if empty[i]:
+                continue
+            buckets.setdefault((group_keys[i], band_values[i].tobytes()), []).append(i)
+        
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                pair = (first, other)
+                if pair in checked:
+                    continue
+                checked.add(pair)
+                similarity = float(np.mean(signatures[first] == signatures[other]))
+                if similarity >= threshold:
+                    root_a, root_b = find(first), find(other)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+    
+    return [find(i) for i in range(n)]
+
+
+@dataclass
+class DedupResult:
+    """重複除去の結果"""
+    documents: List[dict]  # 代表文書のリスト（元の並び順）
+    original_count: int = 0  # 重複除去前の文書数
+    clusters: int = 0  # 2件以上を含むクラスタ数
+    tokens_before: int = 0  # 重複除去前の推定トークン数
+    tokens_after: int = 0  # 重複除去後の推定トークン数
+    cluster_sizes: List[int] = field(default_factory=list)  # 代表文書ごとのクラスタサイズ
+    
+    @property
+    def removed(self) -> int:
+        """除去した文書数"""
+        return self.original_count - len(self.documents)
+    
+    @property
+    def tokens_saved(self) -> int:
+        """削減した推定トークン数"""
+        return self.tokens_before - self.tokens_after
+
+
+def deduplicate_documents(
+    documents: List[dict],
+    count_doc_tokens: Callable[[dict], int],
+    text_key: str = "本文",
+    group_key: Optional[str] = "団体コード",
+    threshold: float = DEFAULT_THRESHOLD,
+    representatives: Optional[List[int]] = None
+) -> DedupResult:
+    """
+    類似文書をまとめ、クラスタごとに代表文書1件だけを残す
+    
+    代表文書には DUPLICATE_COUNT_KEY 列にクラスタ内の文書数を付与する（プロンプトで件数を注記）
+    
+    Args:
+        documents: 文書のリスト
+        count_doc_tokens: 文書1件のトークン数を返す関数
+        text_key: 比較に使う本文の列名
+        group_key: 同じ値の文書の中でだけ重複を判定する列名（Noneなら全体）
+        threshold: 類似とみなす推定Jaccard係数
+        representatives: 計算済みのcluster_near_duplicatesの結果（Noneならここで計算）
+    
+    Returns:
+        DedupResult: 重複除去の結果
+    """
+    if representatives is None:
+        representatives = cluster_near_duplicates(
+            [doc.get(text_key, "") or "" for doc in documents],
+            group_keys=[doc.get(group_key) for doc in documents] if group_key else None,
+            threshold=threshold
+        )
+    
+    sizes = {}
+    for rep in representatives:
+        sizes[rep] = sizes.get(rep, 0) + 1
+    
+    result = DedupResult(documents=[], original_count=len(documents))
+    for i, doc in enumerate(documents):
+        tokens = count_doc_tokens(doc)
+        result.tokens_before += tokens
+        if representatives[i] != i:
+            continue
+        size = sizes[i]
+        if size > 1:
+            doc = {**doc, DUPLICATE_COUNT_KEY: size}
+            result.clusters += 1
+            tokens = count_doc_tokens(doc)
+        result.documents.append(doc)
+        result.cluster_sizes.append(size)
+        result.tokens_after += tokens
+    return result
@@ -1,11 +1,130 @@
 """
 Elasticsearch接続モジュール
-Elasticsearchクライアントの初期化と管理
+Elasticsearchクライアントの初期化と管理（接続プール・圧縮・リトライ・複数ノードの切り替え）
 """
 
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import pandas as pd
 import streamlit as st
 from elasticsearch import Elasticsearch
-from config import get_secret
+from elastic_transport import Urllib3HttpNode
+
+from config import get_secret, get_secret_bool, get_secret_int
+from search_cancel import current_opaque_id, get_cancel_stats
+
+
+DEFAULT_REQUEST_TIMEOUT = 90  # 種類を指定しない呼び出しのタイムアウト（秒）
+DEFAULT_CONNECTIONS_PER_NODE = 20  # ノードごとの接続プールの大きさ（全セッションで共有）
+RETRY_ON_STATUS = (429, 502, 503, 504)  # 再送するステータスコード
+
+# 呼び出しの種類ごとのタイムアウト（秒）。Secretsの ES_TIMEOUT_<種類（大文字）> で変更可能
+DEFAULT_TIMEOUTS = {
+    "search": 60,  # 検索結果（ヒット）の取得
+    "sample": 60,  # 自治体・カテゴリごとの代表の抽出（top_hits）
+    "aggregation": 30,  # composite集計の1ページ
+    "kpi": 15,  # 総件数・ファイル数・最新収集日時
+}
+
+
+@dataclass
+class NodeStats:
+    """ノードごとの接続プールの利用状況"""
+    pool_size: int = 0  # 接続プールの大きさ
+    in_flight: int = 0  # 処理中のリクエスト数
+    peak_in_flight: int = 0  # 処理中のリクエスト数の最大
+    requests: int = 0  # リクエスト数（再送を含む）
+    waited: int = 0  # 接続の空きを待ったリクエスト数（処理中がプールの大きさ以上の時に開始）
+    failures: int = 0  # 失敗（接続エラー・タイムアウト・再送対象のステータス）
+    backoffs: int = 0  # 失敗が続いたため待ってから送ったリクエスト数
+    total_seconds: float = 0.0  # 所要時間の合計（接続の空き待ちを含む）
+    consecutive_failures: int = 0  # 連続した失敗の数（成功で0に戻る）
+    last_failure: float = 0.0  # 最後に失敗した時刻（time.monotonic）
+
+
+# ノード（接続先URL）ごとの利用状況（全セッション共通）
+_node_stats: Dict[str, NodeStats] = {}
+_node_connections: Dict[str, Urllib3HttpNode] = {}
+_stats_lock = threading.Lock()
+
+
+class PooledNode(Urllib3HttpNode):
+    """
+    接続プールの利用状況を記録し、失敗が続いているノードへの送信を指数バックオフで遅らせるノード
+    
+    elastic-transport の再送は待ち時間なしで次のノードに送るため、ノードが1台の場合や全ノードが不調な場合に
+    同じノードへ連続して再送しないよう、直前まで失敗していたノードへの送信の前に待つ
+    """
+    backoff_base: float = 0.5  # 1回目の失敗後の待ち時間（秒）
+    backoff_max: float = 8.0  # 待ち時間の上限（秒）
+    
+    def __init__(self, config):
+        super().__init__(config)
+        with _stats_lock:
+            self._stats = _node_stats.setdefault(self.base_url, NodeStats())
+            self._stats.pool_size = config.connections_per_node
+            _node_connections[self.base_url] = self
+    
+    def _backoff_delay(self) -> float:
+        """連続した失敗の数に応じた待ち時間（最後の失敗から時間が経っていれば待たない）"""
+        stats = self._stats
+        if not stats.consecutive_failures:
+            return 0.0
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (stats.consecutive_failures - 1))
+        elapsed = time.monotonic() - stats.last_failure
+        if elapsed >= delay:
+            return 0.0
+        return (delay - elapsed) * random.uniform(0.5, 1.0)
+    
+    def perform_request(self, method, target, body=None, headers=None, **kwargs):
+        stats = self._stats
+        with _stats_lock:
+            delay = self._backoff_delay()
+            stats.requests += 1
+            if stats.in_flight >= stats.pool_size:
+                stats.waited += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            if delay:
+                stats.backoffs += 1
+        started = time.perf_counter()
+        failed = False
+        try:
+            if delay:
+                time.sleep(delay)
+            response = super().perform_request(method, target, body=body, headers=headers, **kwargs)
+            failed = response.meta.status in RETRY_ON_STATUS
+            return response
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with _stats_lock:
+                stats.in_flight -= 1
+                stats.total_seconds += time.perf_counter() - started
+                if failed:
+                    stats.failures += 1
+                    stats.consecutive_failures += 1
+                    stats.last_failure = time.monotonic()
+                else:
+                    stats.consecutive_failures = 0
+
+
+def parse_hosts(es_host: str) -> List[str]:
+    """
+    ES_HOST（カンマ区切りで複数指定可）を接続先のリストに変換
+    
+    Args:
+        es_host: ES_HOST の値
+    
+    Returns:
+        List[str]: 接続先URLのリスト
+    """
+    return [h.strip() for h in str(es_host).split(",") if h.strip()]
 
 
 @st.cache_resource(show_spinner=False)
@@ -13,6 +132,9 @@ def get_es_client() -> Elasticsearch:
     """
     Elasticsearchクライアントを取得（キャッシュ付き）
     
+    全セッションで1つのクライアント（ノードごとの接続プール）を共有する。
+    接続プールの大きさ・圧縮・再送・ノード情報の自動取得（スニッフィング）はSecretsで変更可能
+    
     Returns:
         Elasticsearch: ESクライアント
     
@@ -27,9 +149,127 @@ def get_es_client() -> Elasticsearch:
         st.error("ES 接続情報が不足（ES_HOST / ES_USERNAME / ES_PASSWORD）")
         st.stop()
     
+    # 再送前の待ち時間はクライアントごとの設定としてノードのクラスに持たせる
+    node_class = type("TunedNode", (PooledNode,), {
+        "backoff_base": get_secret_int("ES_RETRY_BACKOFF_MS", 500) / 1000,
+        "backoff_max": get_secret_int("ES_RETRY_BACKOFF_MAX_MS", 8000) / 1000,
+    })
+    # スニッフィングはクラスタの各ノードに直接接続できる環境でのみ有効にする（ロードバランサー経由では無効のまま）
+    sniff = get_secret_bool("ES_SNIFF", False)
+    
     return Elasticsearch(
-        es_host,
+        parse_hosts(es_host),
         basic_auth=(es_username, es_password),
         verify_certs=False,
-        request_timeout=90
-    )
\ No newline at end of file
+        request_timeout=get_secret_int("ES_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT),
+        connections_per_node=get_secret_int("ES_CONNECTIONS_PER_NODE", DEFAULT_CONNECTIONS_PER_NODE),
+        http_compress=get_secret_bool("ES_HTTP_COMPRESS", True),
+        max_retries=get_secret_int("ES_MAX_RETRIES", 2),
+        retry_on_timeout=get_secret_bool("ES_RETRY_ON_TIMEOUT", True),
+        retry_on_status=RETRY_ON_STATUS,
+        max_dead_node_backoff=get_secret_int("ES_DEAD_NODE_BACKOFF_MAX", 30),
+        sniff_on_start=sniff,
+        sniff_on_node_failure=sniff,
+        min_delay_between_sniffing=get_secret_int("ES_SNIFF_INTERVAL", 60),
+        node_class=node_class,
+    )
+
+
+def get_request_timeout(kind: str) -> int:
+    """
+    呼び出しの種類ごとのタイムアウト（秒）
+    
+    Args:
+        kind: 呼び出しの種類（search / sample / aggregation / kpi）
+    
+    Returns:
+        int: タイムアウト（Secretsの ES_TIMEOUT_<種類> があればその値）
+    """
+    default = DEFAULT_TIMEOUTS.get(kind, DEFAULT_REQUEST_TIMEOUT)
+    return get_secret_int(f"ES_TIMEOUT_{kind.upper()}", default)
+
+
+def with_timeout(es: Elasticsearch, kind: str) -> Elasticsearch:
+    """
+    呼び出しの種類ごとのタイムアウトと再実行の識別子（X-Opaque-Id）を設定したクライアント（接続プールは共有）
+    
+    Args:
+        es: Elasticsearchクライアント
+        kind: 呼び出しの種類（search / sample / aggregation / kpi）
+    
+    Returns:
+        Elasticsearch: タイムアウトを設定したクライアント
+    """
+    return es.options(request_timeout=get_request_timeout(kind), opaque_id=current_opaque_id())
+
+
+def get_pool_stats() -> List[dict]:
+    """
+    ノードごとの接続プールの利用状況
+    
+    Returns:
+        List[dict]: ノードごとの計測値（平均所要時間はミリ秒、開いた接続数を含む）
+    """
+    with _stats_lock:
+        rows = []
+        for url, stats in _node_stats.items():
+            node = _node_connections.get(url)
+            rows.append({
+                "node": url,
+                "pool_size": stats.pool_size,
+                "in_flight": stats.in_flight,
+                "peak_in_flight": stats.peak_in_flight,
+                "connections_opened": node.pool.num_connections if node is not None else 0,
+                "requests": stats.requests,
+                "waited": stats.waited,
+                "failures": stats.failures,
+                "backoffs": stats.backoffs,
+                "avg_ms": round(stats.total_seconds / stats.requests * 1000, 1) if stats.requests else 0.0,
+            })
+    return rows
+
+
+def reset_pool_stats():
+    """接続プールの利用状況の集計値をリセット（処理中の数・プールの大きさ・連続した失敗は残す）"""
+    with _stats_lock:
+        for stats in _node_stats.values():
+            stats.peak_in_flight = stats.in_flight
+            stats.requests = stats.waited = stats.failures = stats.backoffs = 0
+            stats.total_seconds = 0.0
+
+
+def show_pool_panel(stats: Optional[List[dict]] = None):
+    """
+    接続プールの利用状況を表示（運用担当者向け）
+    
+    Args:
+        stats: 表示する計測値（省略時は現在の値）
+    """
+    stats = get_pool_stats() if stats is None else stats
+    with st.expander("🔌 Elasticsearch接続プール（運用担当者向け）"):
+        if not stats:
+            st.caption("まだ接続がありません。")
+            return
+        df = pd.DataFrame(stats).rename(columns={
+            "node": "ノード",
+            "pool_size": "プールの大きさ",
+            "in_flight": "処理中",
+            "peak_in_flight": "処理中（最大）",
+            "connections_opened": "開いた接続",
+            "requests": "リクエスト",
+            "waited": "空き待ち",
+            "failures": "失敗",
+            "backoffs": "再送待ち",
+            "avg_ms": "平均(ms)",
+        })
+        st.dataframe(df, hide_index=True, use_container_width=True)
+        cancel = get_cancel_stats()
+        st.caption(
+            "空き待ち: 処理中のリクエストがプールの大きさに達していたため、接続の空きを待ったリクエスト数"
+            "（多い場合は ES_CONNECTIONS_PER_NODE を増やす）"
+        )
+        st.caption(
+            f"検索中に置き換えられた再実行: {cancel['superseded_runs']}回"
+            f"（取り消したタスク {cancel['cancelled_tasks']}件・送らなかったリクエスト {cancel['stopped_requests']}件"
+            f"・取り消しの失敗 {cancel['cancel_errors']}件）"
+        )
@@ -1,16 +1,31 @@
 """
 GCS（Google Cloud Storage）からファイルを読み込むモジュール
-auth.xlsx、queryファイルをGCSから取得
+auth.xlsx、queryファイルをGCSから取得（保存先は storage_backend でローカル・メモリにも切り替え可能）
 """
 
 import io
 import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import streamlit as st
 from google.cloud import storage
 from google.oauth2 import service_account
-from typing import Optional, Dict
+from typing import Any, Optional, Dict, List
 from pathlib import Path
+from config import get_secret, get_secret_int
+from storage_backend import (
+    BACKEND_KINDS,
+    GCSBackend,
+    LocalBackend,
+    MemoryBackend,
+    StorageBackend,
+    StorageFaults,
+    load_directory,
+)
+from tracing import traced
 
 
 @st.cache_resource(show_spinner=False)
@@ -69,88 +84,413 @@ def get_gcs_bucket_name() -> str:
     return bucket_name
 
 
-@st.cache_data(show_spinner=False, ttl=300)
-def load_auth_from_gcs() -> Optional[pd.DataFrame]:
+DEFAULT_LOCAL_STORAGE_DIR = ".storage"  # ローカル・メモリの保存先で使うディレクトリ
+
+
+@st.cache_resource(show_spinner=False)
+def get_storage_backend() -> StorageBackend:
     """
-    GCSからauth.xlsxを読み込み
+    auth.xlsx・クエリファイルの保存先を取得（全セッション共通）
+    
+    Secretsの STORAGE_BACKEND で gcs（既定）/ local / memory を選択する。
+    local は STORAGE_LOCAL_DIR のディレクトリをバケットの代わりに使い、memory はその内容を起動時にメモリへ読み込む。
+    負荷試験用に STORAGE_LATENCY_MS（1操作あたりの追加の待ち時間）・STORAGE_JITTER_MS・
+    STORAGE_ERROR_RATE（失敗させる割合、0〜1）を注入できる
     
     Returns:
-        Optional[pd.DataFrame]: 認証データ、エラー時はNone
+        StorageBackend: 保存先
     """
+    kind = str(get_secret("STORAGE_BACKEND") or "gcs").lower()
+    if kind not in BACKEND_KINDS:
+        st.error(f"STORAGE_BACKEND は {', '.join(BACKEND_KINDS)} のいずれかを指定してください: {kind}")
+        st.stop()
     try:
-        client = get_gcs_client()
-        bucket_name = get_gcs_bucket_name()
-        bucket = client.bucket(bucket_name)
-        
-        # auth.xlsxのパス
-        blob = bucket.blob("auth.xlsx")
-        
-        if not blob.exists():
-            st.warning("auth.xlsx がGCSに存在しません。簡易認証モードで起動します。")
+        error_rate = float(get_secret("STORAGE_ERROR_RATE") or 0)
+    except ValueError:
+        error_rate = 0.0
+    faults = StorageFaults(
+        latency=get_secret_int("STORAGE_LATENCY_MS", 0) / 1000,
+        jitter=get_secret_int("STORAGE_JITTER_MS", 0) / 1000,
+        error_rate=error_rate,
+    )
+    local_dir = get_secret("STORAGE_LOCAL_DIR") or DEFAULT_LOCAL_STORAGE_DIR
+    if kind == "local":
+        return LocalBackend(local_dir, faults=faults)
+    if kind == "memory":
+        return MemoryBackend(load_directory(local_dir), faults=faults)
+    return GCSBackend(get_gcs_client().bucket(get_gcs_bucket_name()), faults=faults)
+
+
+AUTH_BLOB_NAME = "auth.xlsx"  # 認証データのオブジェクト名
+DEFAULT_AUTH_REFRESH_SECONDS = 300  # auth.xlsxの更新確認の間隔（秒）
+AUTH_REQUIRED_COLUMNS = [
+    "username", "password", "display_name", "query_file",
+    "can_modify_query", "enabled",
+    "can_show_count", "can_show_latest", "can_show_summary",
+    "openai_api_key"
+]
+
+
+def parse_auth_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    auth.xlsxの内容を検証・型変換
+    
+    Args:
+        df: auth.xlsxを読み込んだDataFrame
+    
+    Returns:
+        pd.DataFrame: 型変換後の認証データ
+    
+    Raises:
+        ValueError: 必須列が不足している場合
+    """
+    # 必須列のチェック
+    missing_cols = [col for col in AUTH_REQUIRED_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"auth.xlsx に必須列が不足: {missing_cols}")
+    
+    # データ型の変換（空欄を適切に処理）
+    # can_modify_queryの処理（空欄の場合はNoneのまま保持）
+    def parse_bool(val):
+        """ブール値を安全にパース（空欄はNoneのまま返す）"""
+        if pd.isna(val) or val == '' or str(val).strip() == '':
             return None
-        
-        # ファイルをダウンロード
-        content = blob.download_as_bytes()
-        
-        # BytesIOを使ってpandasで読み込み
-        df = pd.read_excel(io.BytesIO(content))
-        
-        # 必須列のチェック
-        required_cols = [
-            "username", "password", "display_name", "query_file", 
-            "can_modify_query", "enabled",
-            "can_show_count", "can_show_latest", "can_show_summary",
-            "openai_api_key"
-        ]
-        missing_cols = [col for col in required_cols if col not in df.columns]
-        
-        if missing_cols:
-            st.error(f"auth.xlsx に必須列が不足: {missing_cols}")
+        return str(val).upper() in ['TRUE', '1', 'YES']
+    
+    def parse_api_key(val):
+        """APIキーを安全にパース（空欄はNoneに変換）"""
+        if pd.isna(val) or val == '' or str(val).strip() == '' or str(val).lower() == 'nan':
             return None
+        return str(val).strip()
+    
+    df["can_modify_query"] = df["can_modify_query"].apply(parse_bool)
+    
+    # タブ表示権限の処理（空欄の場合はNoneのまま保持）
+    df["can_show_count"] = df["can_show_count"].apply(parse_bool)
+    df["can_show_latest"] = df["can_show_latest"].apply(parse_bool)
+    df["can_show_summary"] = df["can_show_summary"].apply(parse_bool)
+    
+    # enabledの処理（デフォルトはTrue）
+    df["enabled"] = df["enabled"].apply(lambda x: parse_bool(x) if parse_bool(x) is not None else True)
+    
+    # query_fileの処理（空欄はNoneに変換）
+    df["query_file"] = df["query_file"].apply(
+        lambda x: str(x).strip() if pd.notna(x) and str(x).strip() and str(x).lower() != 'nan' else None
+    )
+    
+    # openai_api_keyの処理（空欄はNoneに変換）
+    df["openai_api_key"] = df["openai_api_key"].apply(parse_api_key)
+    
+    return df
+
+
+class BackgroundRefreshStore(ABC):
+    """
+    GCSの読み込み結果を保持し、一定間隔でバックグラウンドの更新確認を行う（全セッション共通）
+    
+    初回の読み込みだけは呼び出し元を待たせ（warm_upで先に始めておくこともできる）、
+    以降は確認間隔を過ぎた呼び出しがバックグラウンドの更新確認を1つだけ起動する
+    """
+    
+    thread_name = "gcs-refresh"
+    
+    def __init__(self, refresh_seconds: int):
+        """
+        Args:
+            refresh_seconds: 更新確認の間隔（秒）
+        """
+        self.refresh_seconds = refresh_seconds
+        self.checked_at = 0.0  # 直近の更新確認の時刻
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loaded = False
+        self._ready = threading.Event()
+    
+    @abstractmethod
+    def refresh(self):
+        """更新確認と再読み込み（サブクラスで実装、例外は内部で処理する）"""
+    
+    def _run_refresh(self):
+        """更新確認を実行して状態を更新"""
+        try:
+            self.refresh()
+        finally:
+            self.checked_at = time.time()
+            self._loaded = True
+            self._ready.set()
+            with self._lock:
+                self._refreshing = False
+    
+    def _start_refresh(self, background: bool) -> bool:
+        """更新確認を開始（実行中ならFalse）"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        if background:
+            threading.Thread(target=self._run_refresh, name=self.thread_name, daemon=True).start()
+        else:
+            self._run_refresh()
+        return True
+    
+    def warm_up(self):
+        """初回の読み込みをバックグラウンドで開始（読み込み済み・実行中なら何もしない）"""
+        if not self._loaded:
+            self._start_refresh(background=True)
+    
+    def ensure_fresh(self):
+        """初回は読み込みの完了を待ち、以降は確認間隔を過ぎていればバックグラウンドで更新確認"""
+        if not self._loaded:
+            if not self._start_refresh(background=False):
+                self._ready.wait()
+            return
+        if time.time() - self.checked_at >= self.refresh_seconds:
+            self._start_refresh(background=True)
+
+
+class AuthStore(BackgroundRefreshStore):
+    """
+    auth.xlsxの読み込み結果とユーザー名の索引を保持（全セッション共通）
+    
+    更新確認はメタデータの取得1回だけで行い、世代（generation）が変わった場合のみ
+    ダウンロード・再解析する。初回以降の更新確認はバックグラウンドで行い、
+    ログイン処理は索引の参照だけで完了する
+    """
+    
+    thread_name = "auth-refresh"
+    
+    def __init__(self, backend: StorageBackend, refresh_seconds: int = DEFAULT_AUTH_REFRESH_SECONDS):
+        """
+        Args:
+            backend: 保存先
+            refresh_seconds: 更新確認の間隔（秒）
+        """
+        super().__init__(refresh_seconds)
+        self.backend = backend
+        self.df: Optional[pd.DataFrame] = None
+        self.generation = None  # 読み込み済みのオブジェクトの世代
+        self.exists = False  # auth.xlsxが存在するか
+        self.error = ""  # 直近の読み込みエラー（エラー時は前回の内容を使い続ける）
+        self.downloads = 0  # ダウンロード・再解析した回数
+        self._index: Dict[Any, List[dict]] = {}
+    
+    def refresh(self):
+        """世代が変わっていればauth.xlsxを読み込み直す（メタデータの取得は1回）"""
+        try:
+            blob = self.backend.stat(AUTH_BLOB_NAME)
+            if blob is None:
+                with self._lock:
+                    self.df, self._index, self.generation, self.exists = None, {}, None, False
+                    self.error = ""
+                return
+            if blob.generation == self.generation:
+                self.error = ""
+                return
+            
+            # 確認した世代を指定してダウンロード（確認後に更新されていた場合は次回の確認で読み込む）
+            content = self.backend.read(AUTH_BLOB_NAME, generation=blob.generation)
+            df = parse_auth_frame(pd.read_excel(io.BytesIO(content)))
+            index: Dict[Any, List[dict]] = {}
+            for record in df.to_dict("records"):
+                index.setdefault(record["username"], []).append(record)
+            with self._lock:
+                self.df, self._index, self.generation, self.exists = df, index, blob.generation, True
+                self.error = ""
+                self.downloads += 1
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+    
+    def has_users(self) -> bool:
+        """認証データが読み込まれていて1件以上あるか"""
+        self.ensure_fresh()
+        return self.df is not None and not self.df.empty
+    
+    def authenticate(self, username: str, password: str) -> Optional[dict]:
+        """
+        ユーザー名の索引からユーザー情報を取得してパスワードを照合
         
-        # データ型の変換（空欄を適切に処理）
-        # can_modify_queryの処理（空欄の場合はNoneのまま保持）
-        def parse_bool(val):
-            """ブール値を安全にパース（空欄はNoneのまま返す）"""
-            if pd.isna(val) or val == '' or str(val).strip() == '':
-                return None
-            return str(val).upper() in ['TRUE', '1', 'YES']
-        
-        def parse_api_key(val):
-            """APIキーを安全にパース（空欄はNoneに変換）"""
-            if pd.isna(val) or val == '' or str(val).strip() == '' or str(val).lower() == 'nan':
-                return None
-            return str(val).strip()
+        Args:
+            username: ユーザー名
+            password: パスワード
         
-        df["can_modify_query"] = df["can_modify_query"].apply(parse_bool)
+        Returns:
+            Optional[dict]: 認証に成功したユーザーの情報、失敗時はNone
+        """
+        self.ensure_fresh()
+        for record in self._index.get(username, []):
+            if record["password"] == password and record["enabled"] == True:
+                return record
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_auth_store() -> AuthStore:
+    """
+    auth.xlsxの読み込み結果を取得（全セッション共通）
+    
+    更新確認の間隔はSecretsの AUTH_REFRESH_SECONDS で変更可能
+    
+    Returns:
+        AuthStore: 認証データ
+    """
+    return AuthStore(get_storage_backend(), refresh_seconds=get_secret_int("AUTH_REFRESH_SECONDS", DEFAULT_AUTH_REFRESH_SECONDS))
+
+
+@traced()
+def load_auth_from_gcs() -> Optional[pd.DataFrame]:
+    """
+    GCSからauth.xlsxを読み込み（世代が変わった場合のみ再読み込み）
+    
+    Returns:
+        Optional[pd.DataFrame]: 認証データ、存在しない・エラー時はNone
+    """
+    store = get_auth_store()
+    store.ensure_fresh()
+    if store.error and store.df is None:
+        st.error(f"GCSからauth.xlsxの読み込みエラー: {store.error}")
+        return None
+    if not store.exists:
+        st.warning("auth.xlsx がGCSに存在しません。簡易認証モードで起動します。")
+        return None
+    return store.df
+
+
+QUERY_PREFIX = "query/"  # クエリファイルの置き場所
+DEFAULT_QUERY_REFRESH_SECONDS = 300  # クエリファイルの更新確認の間隔（秒）
+QUERY_DOWNLOAD_WORKERS = 8  # クエリファイルを並列にダウンロードする数
+
+
+class QueryFileStore(BackgroundRefreshStore):
+    """
+    query/ 以下のクエリファイルを世代（generation）ごとに保持（全セッション共通）
+    
+    更新確認では query/ の一覧を1回だけ取得し、世代が変わったファイルだけを並列にダウンロードする。
+    初回の読み込み以降、クエリの取得はメモリ上の結果を返すだけでGCSを待たない
+    """
+    
+    thread_name = "query-refresh"
+    
+    def __init__(self, backend: StorageBackend, refresh_seconds: int = DEFAULT_QUERY_REFRESH_SECONDS):
+        """
+        Args:
+            backend: 保存先
+            refresh_seconds: 更新確認の間隔（秒）
+        """
+        super().__init__(refresh_seconds)
+        self.backend = backend
+        self.error = ""  # 直近の一覧取得エラー（エラー時は前回の内容を使い続ける）
+        self.downloads = 0  # ダウンロードしたファイル数
+        self._queries: Dict[str, Dict] = {}  # ファイル名 → クエリデータ
+        self._generations: Dict[str, Any] = {}  # ファイル名 → 読み込み済みの世代
+        self._errors: Dict[str, str] = {}  # ファイル名 → 読み込みエラー
+    
+    def _download(self, blob) -> tuple:
+        """クエリファイル1件をダウンロードしてパース（戻り値: クエリデータ, エラー）"""
+        try:
+            content = self.backend.read(blob.name, generation=blob.generation)
+            return json.loads(content), ""
+        except json.JSONDecodeError as e:
+            return None, f"クエリファイルのJSON形式が不正です: {e}"
+        except Exception as e:
+            return None, f"GCSからクエリファイルの読み込みエラー: {e}"
+    
+    def _store(self, filename: str, generation, query_data: Optional[Dict], error: str):
+        """読み込み結果を保存（読み込みに失敗した場合は前回の内容を残す）"""
+        with self._lock:
+            if query_data is not None:
+                self._queries[filename] = query_data
+                self._generations[filename] = generation
+                self._errors.pop(filename, None)
+                self.downloads += 1
+            else:
+                self._errors[filename] = error
+    
+    def refresh(self):
+        """query/ の一覧を取得し、世代が変わったファイルだけを並列にダウンロード"""
+        try:
+            blobs = {
+                Path(blob.name).name: blob
+                for blob in self.backend.list(QUERY_PREFIX)
+                if blob.name != QUERY_PREFIX and blob.name.endswith(".json")
+            }
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            return
+        self.error = ""
         
-        # タブ表示権限の処理（空欄の場合はNoneのまま保持）
-        df["can_show_count"] = df["can_show_count"].apply(parse_bool)
-        df["can_show_latest"] = df["can_show_latest"].apply(parse_bool)
-        df["can_show_summary"] = df["can_show_summary"].apply(parse_bool)
+        changed = [
+            (filename, blob) for filename, blob in blobs.items()
+            if self._generations.get(filename) != blob.generation
+        ]
+        if changed:
+            with ThreadPoolExecutor(max_workers=QUERY_DOWNLOAD_WORKERS) as executor:
+                results = list(executor.map(lambda item: self._download(item[1]), changed))
+            for (filename, blob), (query_data, error) in zip(changed, results):
+                self._store(filename, blob.generation, query_data, error)
         
-        # enabledの処理（デフォルトはTrue）
-        df["enabled"] = df["enabled"].apply(lambda x: parse_bool(x) if parse_bool(x) is not None else True)
+        # 削除されたファイルは存在しないものとして記録（次回以降の取得でGCSを待たない）
+        with self._lock:
+            for filename in set(self._queries) - set(blobs):
+                self._queries.pop(filename, None)
+                self._generations.pop(filename, None)
+                self._errors[filename] = f"クエリファイルがGCSに存在しません: {QUERY_PREFIX}{filename}"
+    
+    def _load_one(self, filename: str):
+        """一覧にないファイルを1件だけ読み込む（前回の確認後に追加された場合）"""
+        try:
+            blob = self.backend.stat(f"{QUERY_PREFIX}{filename}")
+        except Exception as e:
+            self._store(filename, None, None, f"GCSからクエリファイルの読み込みエラー: {e}")
+            return
+        if blob is None:
+            self._store(filename, None, None, f"クエリファイルがGCSに存在しません: {QUERY_PREFIX}{filename}")
+            return
+        query_data, error = self._download(blob)
+        self._store(filename, blob.generation, query_data, error)
+    
+    def get(self, filename: str) -> tuple:
+        """
+        クエリファイルを取得
         
-        # query_fileの処理（空欄はNoneに変換）
-        df["query_file"] = df["query_file"].apply(
-            lambda x: str(x).strip() if pd.notna(x) and str(x).strip() and str(x).lower() != 'nan' else None
-        )
+        読み込み済みのファイルはメモリ上の結果を返す。前回の確認後に追加された
+        ファイルだけは、制限が外れないようその場で1件読み込む
         
-        # openai_api_keyの処理（空欄はNoneに変換）
-        df["openai_api_key"] = df["openai_api_key"].apply(parse_api_key)
+        Args:
+            filename: クエリファイル名（例: user_tokyo.json）
         
-        return df
+        Returns:
+            tuple: (クエリデータ、取得できない場合はNone, エラーメッセージ)
+        """
+        self.ensure_fresh()
+        with self._lock:
+            known = filename in self._queries or filename in self._errors
+        if not known:
+            self._load_one(filename)
+        with self._lock:
+            return self._queries.get(filename), self._errors.get(filename, self.error)
     
-    except Exception as e:
-        st.error(f"GCSからauth.xlsxの読み込みエラー: {e}")
-        return None
+    def put(self, filename: str, query_data: Dict, generation):
+        """アップロードしたクエリファイルを反映"""
+        self._store(filename, generation, query_data, "")
 
 
-@st.cache_data(show_spinner=False, ttl=300)
+@st.cache_resource(show_spinner=False)
+def get_query_store() -> QueryFileStore:
+    """
+    クエリファイルの読み込み結果を取得（全セッション共通）
+    
+    更新確認の間隔はSecretsの QUERY_REFRESH_SECONDS で変更可能
+    
+    Returns:
+        QueryFileStore: クエリファイル
+    """
+    return QueryFileStore(get_storage_backend(), refresh_seconds=get_secret_int("QUERY_REFRESH_SECONDS", DEFAULT_QUERY_REFRESH_SECONDS))
+
+
+@traced()
 def load_query_from_gcs(filename: str) -> Optional[Dict]:
     """
-    GCSからクエリJSONファイルを読み込み
+    GCSからクエリJSONファイルを読み込み（読み込み済みの結果を返し、更新確認はバックグラウンド）
     
     Args:
         filename: クエリファイル名（例: user_tokyo.json）
@@ -161,33 +501,10 @@ def load_query_from_gcs(filename: str) -> Optional[Dict]:
     if not filename:
         return None
     
-    try:
-        client = get_gcs_client()
-        bucket_name = get_gcs_bucket_name()
-        bucket = client.bucket(bucket_name)
-        
-        # queryディレクトリ内のファイルパス
-        blob_path = f"query/{filename}"
-        blob = bucket.blob(blob_path)
-        
-        if not blob.exists():
-            st.error(f"クエリファイルがGCSに存在しません: {blob_path}")
-            return None
-        
-        # ファイルをダウンロード
-        content = blob.download_as_string()
-        
-        # JSONとしてパース
-        query_data = json.loads(content)
-        
-        return query_data
-    
-    except json.JSONDecodeError as e:
-        st.error(f"クエリファイルのJSON形式が不正です: {e}")
-        return None
-    except Exception as e:
-        st.error(f"GCSからクエリファイルの読み込みエラー: {e}")
-        return None
+    query_data, error = get_query_store().get(filename)
+    if query_data is None:
+        st.error(error or f"クエリファイルがGCSに存在しません: {QUERY_PREFIX}{filename}")
+    return query_data
 
 
 def upload_auth_to_gcs(df: pd.DataFrame) -> bool:
@@ -201,18 +518,17 @@ def upload_auth_to_gcs(df: pd.DataFrame) -> bool:
         bool: 成功時True
     """
     try:
-        client = get_gcs_client()
-        bucket_name = get_gcs_bucket_name()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob("auth.xlsx")
-        
         # DataFrameをExcelに変換
         output = io.BytesIO()
         with pd.ExcelWriter(output, engine='openpyxl') as writer:
             df.to_excel(writer, index=False, sheet_name='auth')
         
         # GCSにアップロード
-        blob.upload_from_string(output.getvalue(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        get_storage_backend().write(
+            AUTH_BLOB_NAME,
+            output.getvalue(),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
         
         return True
     
@@ -233,16 +549,12 @@ def upload_query_to_gcs(filename: str, query_data: Dict) -> bool:
         bool: 成功時True
     """
     try:
-        client = get_gcs_client()
-        bucket_name = get_gcs_bucket_name()
-        bucket = client.bucket(bucket_name)
-        
-        blob_path = f"query/{filename}"
-        blob = bucket.blob(blob_path)
-        
         # JSONとしてアップロード
         content = json.dumps(query_data, ensure_ascii=False, indent=2)
-        blob.upload_from_string(content, content_type='application/json')
+        info = get_storage_backend().write(
+            f"{QUERY_PREFIX}{filename}", content.encode("utf-8"), content_type='application/json'
+        )
+        get_query_store().put(filename, query_data, info.generation)
         
         return True
     
@@ -259,17 +571,13 @@ def list_query_files_in_gcs() -> list:
         list: ファイル名のリスト
     """
     try:
-        client = get_gcs_client()
-        bucket_name = get_gcs_bucket_name()
-        bucket = client.bucket(bucket_name)
-        
         # queryディレクトリ内のファイルを取得
-        blobs = bucket.list_blobs(prefix="query/")
+        blobs = get_storage_backend().list(QUERY_PREFIX)
         
         files = []
         for blob in blobs:
             # ディレクトリ自体は除外
-            if blob.name != "query/" and blob.name.endswith('.json'):
+            if blob.name != QUERY_PREFIX and blob.name.endswith('.json'):
                 filename = Path(blob.name).name
                 files.append(filename)
         
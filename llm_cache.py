@@ -0,0 +1,174 @@
+"""
+LLM出力キャッシュモジュール
+バッチ要約結果をローカルディスクに内容アドレス方式で保存し、再実行時に再利用
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import streamlit as st
+from config import get_secret, get_secret_int
+
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / ".cache" / "llm"
+
+
+def make_cache_key(
+    model: str,
+    prompt_version: str,
+    documents: list[dict],
+    user_instruction: str = "",
+    prompt_kind: str = ""
+) -> str:
+    """
+    バッチ要約のキャッシュキーを生成
+    
+    モデル・プロンプトテンプレートのバージョン・文書ID・切り詰め後の本文・ユーザー指示・
+    プロンプトの種類がすべて一致する場合のみ同じキーになる
+    
+    Args:
+        model: 使用するモデル名
+        prompt_version: プロンプトテンプレートのバージョン
+        documents: バッチ内の文書リスト
+        user_instruction: ユーザーからの指示（自動要約は空文字）
+        prompt_kind: プロンプトの種類（通常のバッチプロンプトは空文字、自治体単位は "entity"）
+    
+    Returns:
+        str: SHA-256のハッシュ値（16進数）
+    """
+    doc_hash = hashlib.sha256()
+    for doc in documents:
+        doc_hash.update(json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        doc_hash.update(b"\x00")
+    
+    payload = {
+        "model": model,
+        "prompt_version": prompt_version,
+        "documents": doc_hash.hexdigest(),
+        "instruction": user_instruction or "",
+    }
+    if prompt_kind:
+        # 既存のキャッシュキーを変えないよう、通常のバッチプロンプトでは含めない
+        payload["prompt_kind"] = prompt_kind
+    payload = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    ローカルディスク上のLLM出力キャッシュ（サイズ上限超過時は最終利用が古い順に削除）
+    """
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        """
+        Args:
+            directory: キャッシュの保存先ディレクトリ
+            max_bytes: キャッシュ全体の最大バイト数
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(p.stat().st_size for p in self.directory.glob("*/*.json"))
+    
+    def _path(self, key: str) -> Path:
+        """キーに対応するファイルパス（先頭2文字でディレクトリを分割）"""
+        return self.directory / key[:2] / f"{key}.json"
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        キャッシュから出力を取得
+        
+        Args:
+            key: キャッシュキー
+        
+        Returns:
+            Optional[str]: キャッシュされた出力、存在しない場合はNone
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # 最終利用時刻を更新（削除順の判定に使用）
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return entry.get("text")
+    
+    def put(self, key: str, text: str, model: str = ""):
+        """
+        出力をキャッシュに保存
+        
+        Args:
+            key: キャッシュキー
+            text: 保存する出力
+            model: 使用したモデル名（記録用）
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({
+            "text": text,
+            "model": model,
+            "created_at": time.time(),
+        }, ensure_ascii=False).encode("utf-8")
+        
+        # 一時ファイルに書いてから置き換え（並列書き込みでも壊れないように）
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        """最終利用が古いエントリから削除してサイズ上限内に収める（ロック取得済みで呼ぶ）"""
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                continue
+        self._total_bytes = total
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_cache() -> LLMCache:
+    """
+    LLM出力キャッシュを取得（全セッション共通）
+    
+    保存先はSecretsの LLM_CACHE_DIR、サイズ上限は LLM_CACHE_MAX_MB で変更可能
+    
+    Returns:
+        LLMCache: キャッシュ
+    """
+    directory = get_secret("LLM_CACHE_DIR") or DEFAULT_CACHE_DIR
+    max_mb = get_secret_int("LLM_CACHE_MAX_MB", 200)
+    return LLMCache(Path(directory), max_mb * 1024 * 1024)
@@ -0,0 +1,417 @@
+"""
+LLM利用状況の計測モジュール
+API呼び出しごとのトークン数・所要時間・コストを記録し、実行単位・処理段階単位・ユーザー単位の集計と事前推定に使用
+"""
+
+import json
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import streamlit as st
+from config import get_secret, get_secret_int
+from summary_pipeline import PHASE_INTEGRATION, PHASE_MAP, PHASE_MERGE
+
+
+DEFAULT_TELEMETRY_PATH = Path(__file__).parent / ".cache" / "telemetry" / "llm_calls.jsonl"
+
+# モデルごとの料金（USD / 100万トークン、cached_inputはプロンプトキャッシュから読まれた入力）
+MODEL_PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+}
+
+# 履歴が無い場合の推定値
+DEFAULT_SECONDS_PER_BATCH = 60  # 秒
+DEFAULT_COST_PER_BATCH = 0.10  # ドル
+MIN_HISTORY_SAMPLES = 5  # 履歴から推定するのに必要な呼び出し数
+HISTORY_WINDOW = 200  # 推定に使う直近の呼び出し数
+PHASE_ORDER = [PHASE_MAP, PHASE_MERGE, PHASE_INTEGRATION]  # 内訳の表示順
+
+
+def estimate_cost(
+    model: str,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    cached_tokens: Optional[int] = None
+) -> float:
+    """
+    トークン数から料金を計算
+    
+    Args:
+        model: モデル名
+        prompt_tokens: 入力トークン数（キャッシュ済みの分を含む）
+        completion_tokens: 出力トークン数
+        cached_tokens: 入力のうちプロンプトキャッシュから読まれたトークン数
+    
+    Returns:
+        float: 料金（USD、料金表に無いモデルは0）
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    cached = min(cached_tokens or 0, prompt_tokens or 0)
+    return (
+        ((prompt_tokens or 0) - cached) * prices["input"]
+        + cached * prices.get("cached_input", prices["input"])
+        + (completion_tokens or 0) * prices["output"]
+    ) / 1_000_000
+
+
+@dataclass
+class RunEstimate:
+    """要約実行前の処理時間・コストの推定値"""
+    seconds: int  # 推定処理時間（秒）
+    cost: float  # 推定コスト（USD）
+    seconds_per_batch: float  # 1バッチあたりの推定所要時間（秒）
+    cost_per_batch: float  # 1バッチあたりの推定コスト（USD）
+    samples: int = 0  # 推定に使った呼び出し数（0なら既定値）
+    
+    @property
+    def source(self) -> str:
+        """推定の根拠（表示用）"""
+        if self.samples:
+            return f"直近{self.samples}回の実測から推定"
+        return "実測履歴が無いため既定値で推定"
+
+
+def summarize_records(records: List[dict]) -> dict:
+    """
+    呼び出し記録を集計
+    
+    Args:
+        records: 呼び出し記録のリスト
+    
+    Returns:
+        dict: 集計値（calls, prompt_tokens, cached_tokens, completion_tokens, cost, avg_latency）
+    """
+    latencies = [r["latency"] for r in records if r.get("latency") is not None]
+    return {
+        "calls": len(records),
+        "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in records),
+        "cached_tokens": sum(r.get("cached_tokens") or 0 for r in records),
+        "completion_tokens": sum(r.get("completion_tokens") or 0 for r in records),
+        "cost": sum(r.get("cost") or 0.0 for r in records),
+        "avg_latency": sum(latencies) / len(latencies) if latencies else None,
+    }
+
+
+def format_usage_report(usage: dict) -> str:
+    """
+    集計値を表示用の文字列に整形
+    
+    Args:
+        usage: summarize_recordsの集計結果
+    
+    Returns:
+        str: トークン数（プロンプトキャッシュの利用率を含む）とコスト
+    """
+    prompt_tokens = usage["prompt_tokens"]
+    cached_tokens = usage.get("cached_tokens", 0)
+    cached_rate = cached_tokens / prompt_tokens * 100 if prompt_tokens else 0
+    return (
+        f"入力 {prompt_tokens:,}（うちキャッシュ {cached_tokens:,}・{cached_rate:.0f}%）"
+        f" / 出力 {usage['completion_tokens']:,} トークン、"
+        f"約${usage['cost']:.3f}（{usage['calls']}回）"
+    )
+
+
+def format_routing_savings(rows: List[dict]) -> str:
+    """
+    処理段階ごとの内訳から、モデル振り分けによる削減効果を表示用の文字列に整形
+    
+    Args:
+        rows: TelemetryStore.phase_breakdownの結果
+    
+    Returns:
+        str: 実際と基準モデルのみの場合のコスト・呼び出し時間の比較
+    """
+    cost = sum(r["コスト(USD)"] for r in rows)
+    baseline_cost = sum(r["基準モデルのコスト(USD)"] for r in rows)
+    text = f"コスト ${cost:.3f}（基準モデルのみ ${baseline_cost:.3f}"
+    if baseline_cost > 0:
+        text += f"、{(1 - cost / baseline_cost) * 100:.0f}%削減"
+    text += "）"
+    
+    call_time = sum(r["呼び出し時間(秒)"] for r in rows)
+    baseline_times = [r["基準モデルの推定時間(秒)"] for r in rows]
+    if rows and all(t is not None for t in baseline_times):
+        text += f"、呼び出し時間 {call_time:.0f}秒（基準モデルのみ 推定{sum(baseline_times):.0f}秒）"
+    else:
+        text += f"、呼び出し時間 {call_time:.0f}秒（基準モデルの実測履歴が不足）"
+    return text
+
+
+class TelemetryStore:
+    """
+    API呼び出し記録の保存先（JSON Lines形式で追記し、直近の記録をメモリに保持）
+    """
+    
+    def __init__(self, path: Path, max_records: int):
+        """
+        Args:
+            path: 記録ファイルのパス
+            max_records: メモリ・ファイルに保持する記録数
+        """
+        self.path = Path(path)
+        self.max_records = max(1, max_records)
+        self._records = deque(maxlen=self.max_records)
+        self._lock = threading.Lock()
+        self._lines_written = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+    
+    def _load(self):
+        """保存済みの記録を読み込み"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._records.append(json.loads(line))
+                    except ValueError:
+                        continue
+                    self._lines_written += 1
+        except OSError:
+            pass
+    
+    def _compact(self):
+        """ファイルを直近の記録だけに書き直す（ロック取得済みで呼ぶ）"""
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self._records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        tmp_path.replace(self.path)
+        self._lines_written = len(self._records)
+    
+    def append(self, record: dict):
+        """
+        記録を追加
+        
+        Args:
+            record: 記録（kindで種類を区別し、API呼び出しは"call"）
+        """
+        record = {"recorded_at": time.time(), **record}
+        with self._lock:
+            self._records.append(record)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._lines_written += 1
+            if self._lines_written > self.max_records * 2:
+                self._compact()
+    
+    def record_call(self, stats, user: str, run_id: str = "", phase: str = "", error: str = ""):
+        """
+        1回のAPI呼び出しを記録
+        
+        Args:
+            stats: 呼び出しの計測値（openai_helper.CallStats）
+            user: 呼び出したユーザー
+            run_id: 要約ジョブID（単発呼び出しは空文字）
+            phase: 処理段階（バッチ / 中間統合 / 統合など）
+            error: エラーメッセージ（成功時は空文字）
+        """
+        self.append({
+            "kind": "call",
+            "user": user,
+            "run_id": run_id,
+            "phase": phase,
+            "model": stats.model,
+            "prompt_tokens": stats.prompt_tokens,
+            "cached_tokens": stats.cached_tokens,
+            "completion_tokens": stats.completion_tokens,
+            "latency": stats.latency,
+            "ttft": stats.time_to_first_token,
+            "cost": estimate_cost(stats.model, stats.prompt_tokens, stats.completion_tokens, stats.cached_tokens),
+            "error": error,
+        })
+    
+    def records(self, kind: str = "call", **filters) -> List[dict]:
+        """
+        条件に一致する記録を古い順に取得
+        
+        Args:
+            kind: 記録の種類
+            **filters: 項目名=値 の絞り込み条件
+        
+        Returns:
+            List[dict]: 記録のリスト
+        """
+        with self._lock:
+            records = list(self._records)
+        return [
+            r for r in records
+            if r.get("kind") == kind and all(r.get(k) == v for k, v in filters.items())
+        ]
+    
+    def run_usage(self, run_id: str) -> dict:
+        """
+        1回の要約実行の集計値を取得
+        
+        Args:
+            run_id: 要約ジョブID
+        
+        Returns:
+            dict: summarize_recordsの集計結果
+        """
+        return summarize_records(self.records(run_id=run_id))
+    
+    def _average_latency(self, model: str, phase: str) -> Optional[float]:
+        """直近の成功した呼び出しの平均所要時間（履歴が不足している場合はNone）"""
+        history = [
+            r["latency"] for r in self.records(model=model, phase=phase)
+            if not r.get("error") and r.get("latency") is not None
+        ][-HISTORY_WINDOW:]
+        if len(history) < MIN_HISTORY_SAMPLES:
+            return None
+        return sum(history) / len(history)
+    
+    def phase_breakdown(self, run_id: str, baseline_model: str) -> List[dict]:
+        """
+        1回の要約実行の処理段階・モデルごとの内訳を集計
+        
+        全段階を基準モデルで実行した場合のコスト（同じトークン数で計算）と、
+        呼び出し時間（段階ごとの実測履歴の平均所要時間の比で換算）も併せて計算する
+        
+        Args:
+            run_id: 要約ジョブID
+            baseline_model: 比較の基準とするモデル（画面で選択したモデル）
+        
+        Returns:
+            List[dict]: 処理段階・モデルごとの集計（JSONで保存できる形式）
+        """
+        calls = self.records(run_id=run_id)
+        keys = sorted(
+            {(r.get("phase", ""), r.get("model", "")) for r in calls},
+            key=lambda key: (PHASE_ORDER.index(key[0]) if key[0] in PHASE_ORDER else len(PHASE_ORDER), key[1])
+        )
+        rows = []
+        for phase, model in keys:
+            group = [r for r in calls if r.get("phase", "") == phase and r.get("model", "") == model]
+            usage = summarize_records(group)
+            call_time = sum(r.get("latency") or 0.0 for r in group)
+            baseline_cost = sum(
+                estimate_cost(baseline_model, r.get("prompt_tokens"), r.get("completion_tokens"), r.get("cached_tokens"))
+                for r in group
+            )
+            if model == baseline_model:
+                baseline_time = call_time
+            else:
+                model_latency = self._average_latency(model, phase)
+                baseline_latency = self._average_latency(baseline_model, phase)
+                baseline_time = (
+                    call_time * baseline_latency / model_latency
+                    if model_latency and baseline_latency else None
+                )
+            rows.append({
+                "処理段階": phase,
+                "モデル": model,
+                "呼び出し数": usage["calls"],
+                "エラー数": sum(1 for r in group if r.get("error")),
+                "呼び出し時間(秒)": round(call_time, 1),
+                "入力トークン": usage["prompt_tokens"],
+                "キャッシュ済み入力": usage["cached_tokens"],
+                "出力トークン": usage["completion_tokens"],
+                "コスト(USD)": round(usage["cost"], 4),
+                "基準モデルのコスト(USD)": round(baseline_cost, 4),
+                "基準モデルの推定時間(秒)": round(baseline_time, 1) if baseline_time is not None else None,
+            })
+        return rows
+    
+    def usage_by_user(self, days: int = 30) -> pd.DataFrame:
+        """
+        ユーザーごとの利用状況を集計
+        
+        Args:
+            days: 集計対象の日数
+        
+        Returns:
+            pd.DataFrame: ユーザーごとの集計（ユーザー, 実行数, 呼び出し数, 入力/出力トークン, コスト）
+        """
+        since = time.time() - days * 86400
+        calls = [r for r in self.records() if r.get("recorded_at", 0) >= since]
+        rows = []
+        for user in sorted({r.get("user", "") for r in calls}):
+            user_calls = [r for r in calls if r.get("user", "") == user]
+            usage = summarize_records(user_calls)
+            rows.append({
+                "ユーザー": user,
+                "実行数": len({r.get("run_id") for r in user_calls if r.get("run_id")}),
+                "呼び出し数": usage["calls"],
+                "入力トークン": usage["prompt_tokens"],
+                "キャッシュ済み入力": usage["cached_tokens"],
+                "出力トークン": usage["completion_tokens"],
+                "コスト(USD)": round(usage["cost"], 4),
+            })
+        return pd.DataFrame(rows)
+    
+    def estimate_run(
+        self,
+        model: str,
+        batch_prompt_tokens: List[int],
+        concurrency: int,
+        phase: str = PHASE_MAP,
+        integration_model: Optional[str] = None
+    ) -> RunEstimate:
+        """
+        直近の実測履歴から要約実行の処理時間・コストを推定
+        
+        処理時間は1バッチの平均所要時間×（バッチ数÷同時実行数）＋統合1回分、
+        コストは入力トークン数（事前計測）と平均出力トークン数から計算する。
+        履歴が不足している場合は1回あたりの既定値（DEFAULT_SECONDS_PER_BATCH など）を同じ式に当てはめる
+        
+        Args:
+            model: 使用するモデル名
+            batch_prompt_tokens: バッチごとのプロンプトのトークン数
+            concurrency: 同時実行数
+            phase: 推定に使う処理段階
+            integration_model: 統合に使うモデル（Noneならmodelと同じ）
+        
+        Returns:
+            RunEstimate: 推定値
+        """
+        total_batches = len(batch_prompt_tokens)
+        history = [
+            r for r in self.records(model=model, phase=phase)
+            if not r.get("error") and r.get("latency") is not None
+        ][-HISTORY_WINDOW:]
+        
+        # 統合処理（1回、入力は全バッチの出力）を含めて見積もる
+        calls = total_batches + 1
+        if len(history) < MIN_HISTORY_SAMPLES:
+            # 履歴が不足している場合は1回あたりの既定値で見積もる
+            history = []
+            seconds_per_batch = DEFAULT_SECONDS_PER_BATCH
+            cost = calls * DEFAULT_COST_PER_BATCH
+        else:
+            seconds_per_batch = sum(r["latency"] for r in history) / len(history)
+            completions = [r["completion_tokens"] for r in history if r.get("completion_tokens") is not None]
+            avg_completion = sum(completions) / len(completions) if completions else 0
+            cost = estimate_cost(model, sum(batch_prompt_tokens), int(avg_completion * total_batches))
+            cost += estimate_cost(integration_model or model, int(avg_completion * total_batches), int(avg_completion))
+        seconds = math.ceil(total_batches / max(1, concurrency)) * seconds_per_batch + seconds_per_batch
+        return RunEstimate(
+            seconds=int(seconds),
+            cost=cost,
+            seconds_per_batch=seconds_per_batch,
+            cost_per_batch=cost / calls,
+            samples=len(history),
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry_store() -> TelemetryStore:
+    """
+    LLM利用状況の記録先を取得（全セッション共通）
+    
+    保存先はSecretsの LLM_TELEMETRY_PATH、保持件数は LLM_TELEMETRY_MAX_RECORDS で変更可能
+    
+    Returns:
+        TelemetryStore: 記録先
+    """
+    path = get_secret("LLM_TELEMETRY_PATH") or DEFAULT_TELEMETRY_PATH
+    return TelemetryStore(Path(path), get_secret_int("LLM_TELEMETRY_MAX_RECORDS", 5000))
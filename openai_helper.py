@@ -2,23 +2,192 @@
 OpenAI API連携用のヘルパー関数
 """
 
+import time
+from dataclasses import dataclass, field
 from openai import OpenAI
-from typing import Optional
+from typing import Any, Callable, Iterator, Optional
 import streamlit as st
-from config import get_secret
+from config import get_secret, get_secret_int
+from summary_pipeline import PHASE_INTEGRATION, PHASE_MAP, PHASE_MERGE, ModelRouter, RateLimiter
+from llm_telemetry import get_telemetry_store
+
+
+SYSTEM_PROMPT = "あなたは自治体の公開文書を分析する専門家です。検索結果を分かりやすく要約し、重要なポイントを抽出してください。"
+MAX_COMPLETION_TOKENS = 2048  # 1回の呼び出しの出力トークン上限
+
+# モデルごとの1バッチあたりの入力トークン予算（コンテキスト長から出力分と余裕を差し引いた値）
+MODEL_BATCH_TOKEN_BUDGETS = {
+    "gpt-4o-mini": 60000,
+    "gpt-4o": 60000,
+}
+DEFAULT_BATCH_TOKEN_BUDGET = 30000
+
+# 処理段階ごとのモデル振り分けの既定値
+DEFAULT_MAP_MODEL = "gpt-4o-mini"  # バッチ要約（抽出中心）に使う軽量モデル
+DEFAULT_FALLBACK_MODEL = "gpt-4o-mini"  # 遅延・レート制限の予算超過時に切り替える高速モデル
+DEFAULT_LATENCY_BUDGET = 120  # 1回の呼び出しの所要時間の予算（秒）
+DEFAULT_RATE_LIMIT_BUDGET = 3  # 処理段階ごとに許容するレート制限エラーの回数
+
+
+@dataclass
+class CallStats:
+    """1回のAPI呼び出しの計測値（ストリーミング時は初回トークンまでの時間も記録）"""
+    model: str
+    started_at: float = field(default_factory=time.time)
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None  # 入力のうちAPI側のプロンプトキャッシュから読まれたトークン数
+    chunk_count: int = 0
+    
+    @property
+    def latency(self) -> float:
+        """呼び出し全体の所要時間（秒）"""
+        return (self.finished_at or time.time()) - self.started_at
+    
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """初回トークンまでの時間（秒）"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+    
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """初回トークン以降の生成速度（tokens/秒）"""
+        if self.first_token_at is None or self.finished_at is None:
+            return None
+        generation_time = self.finished_at - self.first_token_at
+        tokens = self.completion_tokens if self.completion_tokens is not None else self.chunk_count
+        if generation_time <= 0:
+            return None
+        return tokens / generation_time
+
+
+def get_batch_token_budget(model: str) -> int:
+    """
+    モデルごとの1バッチあたりの入力トークン予算を取得
+    
+    Secretsの SUMMARY_BATCH_TOKEN_BUDGET が設定されている場合はそちらを優先
+    
+    Args:
+        model: モデル名
+    
+    Returns:
+        int: トークン予算
+    """
+    override = get_secret_int("SUMMARY_BATCH_TOKEN_BUDGET", 0)
+    if override > 0:
+        return override
+    return MODEL_BATCH_TOKEN_BUDGETS.get(model, DEFAULT_BATCH_TOKEN_BUDGET)
+
+
+def get_phase_models(selected_model: str, tiered: bool = True) -> dict:
+    """
+    処理段階ごとの使用モデルを決定
+    
+    振り分けは選択制で、tieredでない場合はすべての段階で選択したモデルを使用する。
+    tieredの場合のみ、バッチ要約はSecretsの SUMMARY_MAP_MODEL（未設定時は DEFAULT_MAP_MODEL）、
+    中間統合・最終統合は選択したモデルを使用する（画面の既定値は SUMMARY_MAP_MODEL を設定した場合のみtiered）
+    
+    Args:
+        selected_model: 画面で選択したモデル（統合に使用）
+        tiered: バッチ要約を軽量モデルで実行するか（画面のチェックボックス）
+    
+    Returns:
+        dict: 処理段階 → モデル名
+    """
+    map_model = (get_secret("SUMMARY_MAP_MODEL") or DEFAULT_MAP_MODEL) if tiered else selected_model
+    return {
+        PHASE_MAP: map_model,
+        PHASE_MERGE: selected_model,
+        PHASE_INTEGRATION: selected_model,
+    }
+
+
+def build_model_router(phase_models: dict) -> ModelRouter:
+    """
+    要約実行ごとのモデル振り分けを作成
+    
+    フォールバック先はSecretsの SUMMARY_FALLBACK_MODEL、遅延予算は SUMMARY_LATENCY_BUDGET（秒）、
+    レート制限の予算は SUMMARY_RATE_LIMIT_BUDGET（回）で変更可能（0で無効）
+    
+    Args:
+        phase_models: 処理段階 → モデル名（get_phase_modelsの結果）
+    
+    Returns:
+        ModelRouter: モデル振り分け
+    """
+    return ModelRouter(
+        phase_models,
+        fallback_model=get_secret("SUMMARY_FALLBACK_MODEL") or DEFAULT_FALLBACK_MODEL,
+        latency_budget=get_secret_int("SUMMARY_LATENCY_BUDGET", DEFAULT_LATENCY_BUDGET),
+        rate_limit_budget=get_secret_int("SUMMARY_RATE_LIMIT_BUDGET", DEFAULT_RATE_LIMIT_BUDGET)
+    )
+
+
+def summarize_call_stats(stats_list: list) -> dict:
+    """
+    複数呼び出しの計測値を集計
+    
+    Args:
+        stats_list: CallStatsのリスト
+    
+    Returns:
+        dict: 集計値（calls, avg_ttft, avg_tokens_per_second, completion_tokens）
+    """
+    ttfts = [s.time_to_first_token for s in stats_list if s.time_to_first_token is not None]
+    speeds = [s.tokens_per_second for s in stats_list if s.tokens_per_second is not None]
+    return {
+        "calls": len(stats_list),
+        "avg_ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+        "avg_tokens_per_second": sum(speeds) / len(speeds) if speeds else None,
+        "completion_tokens": sum(s.completion_tokens or s.chunk_count for s in stats_list),
+    }
+
+
+def _record_usage(stats: CallStats, usage):
+    """APIの応答のusageからトークン数（キャッシュ済み入力トークン数を含む）を記録"""
+    stats.prompt_tokens = usage.prompt_tokens
+    stats.completion_tokens = usage.completion_tokens
+    details = getattr(usage, "prompt_tokens_details", None)
+    stats.cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+
+def _cache_options(cache_key: Optional[str]) -> dict:
+    """プロンプトキャッシュの振り分けキーの指定（未指定なら送信しない）"""
+    return {"prompt_cache_key": cache_key} if cache_key else {}
+
+
+def _build_messages(prompt: str) -> list:
+    """システムメッセージとユーザープロンプトからメッセージ列を構築"""
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
 
 
 def init_openai(api_key: str) -> OpenAI:
     """
     OpenAI APIクライアントを初期化
     
+    Secretsの OPENAI_BASE_URL が設定されている場合はその接続先を使用
+    （OpenAI互換のスタブサーバーでの負荷試験・ベンチマーク用）
+    
     Args:
         api_key: OpenAI APIキー
     
     Returns:
         OpenAI: 初期化されたOpenAIクライアント
     """
-    return OpenAI(api_key=api_key)
+    return OpenAI(api_key=api_key, base_url=get_secret("OPENAI_BASE_URL") or None)
 
 
 def get_user_openai_api_key() -> Optional[str]:
@@ -45,38 +214,131 @@ def get_user_openai_api_key() -> Optional[str]:
     return None
 
 
-def generate_summary(client: OpenAI, prompt: str, model: str = "gpt-4o") -> Optional[str]:
+def request_summary(
+    client: OpenAI,
+    prompt: str,
+    model: str = "gpt-4o",
+    stats: Optional[CallStats] = None,
+    cache_key: Optional[str] = None
+) -> Optional[str]:
     """
-    OpenAI APIを使って要約を生成
+    OpenAI APIを使って要約を生成（エラーは呼び出し元に送出）
+    
+    バッチ並列処理のワーカースレッドから呼び出すため、Streamlitの描画は行わない
     
     Args:
         client: 初期化されたOpenAIクライアント
         prompt: 送信するプロンプト
         model: 使用するモデル（デフォルト: gpt-4o）
+        stats: 計測値の記録先（所要時間・トークン数）
+        cache_key: プロンプトキャッシュの振り分けキー（prompt.get_prompt_cache_key）
     
     Returns:
-        Optional[str]: 生成されたテキスト、エラー時はNone
+        Optional[str]: 生成されたテキスト
     """
+    if stats is None:
+        stats = CallStats(model=model)
+    stats.started_at = time.time()
     try:
         response = client.chat.completions.create(
             model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "あなたは自治体の公開文書を分析する専門家です。検索結果を分かりやすく要約し、重要なポイントを抽出してください。"
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+            messages=_build_messages(prompt),
             temperature=0.7,
-            max_tokens=2048
+            max_tokens=MAX_COMPLETION_TOKENS,
+            **_cache_options(cache_key)
         )
-        return response.choices[0].message.content
+    finally:
+        stats.finished_at = time.time()
+    if response.usage is not None:
+        _record_usage(stats, response.usage)
+    return response.choices[0].message.content
+
+
+def stream_summary(
+    client: OpenAI,
+    prompt: str,
+    model: str = "gpt-4o",
+    stats: Optional[CallStats] = None,
+    on_open: Optional[Callable[[Any], None]] = None,
+    cache_key: Optional[str] = None
+) -> Iterator[str]:
+    """
+    OpenAI APIを使って要約をストリーミング生成（トークンが届くたびにyield）
+    
+    エラーは呼び出し元に送出する。途中でジェネレーターを閉じると接続も閉じる
+    
+    Args:
+        client: 初期化されたOpenAIクライアント
+        prompt: 送信するプロンプト
+        model: 使用するモデル（デフォルト: gpt-4o）
+        stats: 計測値の記録先（初回トークンまでの時間・トークン数など）
+        on_open: 接続直後にストリームを受け取るコールバック（別スレッドからclose()して通信を中断する用）
+        cache_key: プロンプトキャッシュの振り分けキー（prompt.get_prompt_cache_key）
+    
+    Yields:
+        str: 生成されたテキストの断片
+    """
+    if stats is None:
+        stats = CallStats(model=model)
+    stats.started_at = time.time()
+    
+    stream = client.chat.completions.create(
+        model=model,
+        messages=_build_messages(prompt),
+        temperature=0.7,
+        max_tokens=MAX_COMPLETION_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True},
+        **_cache_options(cache_key)
+    )
+    if on_open is not None:
+        on_open(stream)
+    try:
+        for chunk in stream:
+            # include_usage指定時は最後のチャンクにトークン数が入る
+            if chunk.usage is not None:
+                _record_usage(stats, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if stats.first_token_at is None:
+                    stats.first_token_at = time.time()
+                stats.chunk_count += 1
+                yield delta
+    finally:
+        stats.finished_at = time.time()
+        stream.close()
+
+
+def generate_summary(client: OpenAI, prompt: str, model: str = "gpt-4o") -> Optional[str]:
+    """
+    OpenAI APIを使って要約を生成
+    
+    Args:
+        client: 初期化されたOpenAIクライアント
+        prompt: 送信するプロンプト
+        model: 使用するモデル（デフォルト: gpt-4o）
+    
+    Returns:
+        Optional[str]: 生成されたテキスト、エラー時はNone
+    """
+    stats = CallStats(model=model)
+    error = ""
+    try:
+        return request_summary(client, prompt, model=model, stats=stats)
     except Exception as e:
+        error = str(e)
         st.error(f"OpenAI API エラー: {str(e)}")
         return None
+    finally:
+        # トークン数・所要時間・コストを利用状況として記録
+        get_telemetry_store().record_call(
+            stats,
+            user=st.session_state.get("user_name", "guest"),
+            phase="単発",
+            error=error
+        )
 
 
 @st.cache_resource
@@ -90,4 +352,23 @@ def get_openai_client(api_key: str) -> OpenAI:
     Returns:
         OpenAI: 初期化されたOpenAIクライアント
     """
-    return init_openai(api_key)
\ No newline at end of file
+    return init_openai(api_key)
+
+
+@st.cache_resource
+def get_rate_limiter(api_key: str) -> RateLimiter:
+    """
+    APIキーごとに共有するレート制限を取得（全セッション共通）
+    
+    上限値はSecretsの OPENAI_RPM / OPENAI_TPM で変更可能
+    
+    Args:
+        api_key: OpenAI APIキー
+    
+    Returns:
+        RateLimiter: 共有レート制限
+    """
+    return RateLimiter(
+        requests_per_minute=get_secret_int("OPENAI_RPM", 500),
+        tokens_per_minute=get_secret_int("OPENAI_TPM", 200000)
+    )
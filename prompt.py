@@ -1,6 +1,98 @@
 """
 Gemini/OpenAI API用のプロンプト設定（バッチ処理対応版）
+
+プロンプトは指示・出力形式・ユーザー指示を先頭に、文書やバッチ番号などバッチごとに変わる内容を
+DATA_SECTION_HEADER 以降の末尾に置く。同じ実行の全バッチで先頭部分がバイト単位で一致するため、
+API側のプロンプトキャッシュ（先頭一致部分の再利用）が効く
+"""
+
+import hashlib
+
+# プロンプトテンプレートのバージョン（テンプレートを変更したら更新し、要約キャッシュを無効化する）
+PROMPT_VERSION = "2"
+
+# バッチごとに変わる内容の開始位置（これより前は同じ実行の全呼び出しで共通）
+DATA_SECTION_HEADER = "# 分析対象データ"
+
+
+def get_prompt_prefix(prompt: str) -> str:
+    """
+    プロンプトの共通部分（DATA_SECTION_HEADERより前）を取得
+    
+    Args:
+        prompt: プロンプト
+    
+    Returns:
+        str: 共通部分（区切りが無い場合はプロンプト全体）
+    """
+    return prompt.split(DATA_SECTION_HEADER, 1)[0]
+
+
+def get_prompt_cache_key(prompt: str) -> str:
+    """
+    プロンプトの共通部分から、API側のプロンプトキャッシュの振り分けキーを作成
+    
+    同じ共通部分を持つ呼び出しを同じキャッシュに振り分けてもらうためにprompt_cache_keyとして送信する
+    
+    Args:
+        prompt: プロンプト
+    
+    Returns:
+        str: 共通部分のハッシュ値
+    """
+    digest = hashlib.sha256(get_prompt_prefix(prompt).encode("utf-8")).hexdigest()
+    return f"summary-v{PROMPT_VERSION}-{digest[:32]}"
+
+
+def format_document(doc: dict, index: int, max_chars: int = 2000) -> str:
+    """
+    1件の文書をプロンプト用のテキストに整形
+    
+    Args:
+        doc: 文書（get_summary_promptのdocumentsの要素と同じキーを持つ辞書）
+        index: 文書番号（1から開始）
+        max_chars: 本文の最大文字数
+    
+    Returns:
+        str: 整形済みテキスト
+    """
+    text = f"""
+【文書{index}】
+自治体: {doc.get('都道府県', '')} {doc.get('市区町村', '')}
+資料カテゴリ: {doc.get('資料カテゴリ', '')}
+資料名（正式名称）: {doc.get('資料名', '')}
+年度: {doc.get('開始年度', '')}年度"""
+    
+    if doc.get('終了年度'):
+        text += f"～{doc.get('終了年度', '')}年度"
+    
+    if doc.get('類似文書数', 1) > 1:
+        text += f"\n※ 内容がほぼ同じ{doc['類似文書数']}ページ（年度違い・重複ページ等）の代表として1件のみ掲載"
+    
+    text += f"""
+URL（原本）: {doc.get('URL(原本)', '')}
+URL（GF）: {doc.get('URL(GF)', '')}
+本文:
+{doc.get('本文', '')[:max_chars]}
+
+---
 """
+    return text
+
+
+def format_documents(documents: list[dict], max_chars: int = 2000) -> str:
+    """
+    文書リストをプロンプト用のテキストに整形
+    
+    Args:
+        documents: 文書のリスト
+        max_chars: 1文書あたりの本文の最大文字数
+    
+    Returns:
+        str: 整形済みテキスト
+    """
+    return "".join(format_document(doc, i, max_chars) for i, doc in enumerate(documents, 1))
+
 
 def get_summary_prompt(documents: list[dict]) -> str:
     """
@@ -23,33 +115,11 @@ def get_summary_prompt(documents: list[dict]) -> str:
     """
     
     # 検索結果を整形
-    docs_text = ""
-    for i, doc in enumerate(documents, 1):
-        docs_text += f"""
-【文書{i}】
-自治体: {doc.get('都道府県', '')} {doc.get('市区町村', '')}
-資料カテゴリ: {doc.get('資料カテゴリ', '')}
-資料名（正式名称）: {doc.get('資料名', '')}
-年度: {doc.get('開始年度', '')}年度"""
-        
-        if doc.get('終了年度'):
-            docs_text += f"～{doc.get('終了年度', '')}年度"
-        
-        docs_text += f"""
-URL（原本）: {doc.get('URL(原本)', '')}
-URL（GF）: {doc.get('URL(GF)', '')}
-本文:
-{doc.get('本文', '')[:2000]}
-
----
-"""
+    docs_text = format_documents(documents, max_chars=2000)
     
-    # プロンプト本体
+    # プロンプト本体（検索結果はバッチごとに変わるため末尾に置く）
     prompt = f"""
-以下の自治体文書の検索結果を分析し、要約してください。
-
-# 検索結果
-{docs_text}
+末尾の「分析対象データ」にある自治体文書の検索結果を分析し、要約してください。
 
 # 要約の指示
 1. **全体の傾向**：検索結果全体から読み取れる主要なテーマや傾向を説明してください
@@ -58,7 +128,7 @@ URL（GF）: {doc.get('URL(GF)', '')}
 4. **キーワード**：頻出する重要なキーワードを3-5個抽出してください
 
 # 出力形式
-以下の形式で出力してください。根拠となる資料URL（原本）と資料URL（GF）は、上記の検索結果に含まれるURL情報から引用し、Markdown形式（[URL](...)）ではなくURLだけを記載してください：
+以下の形式で出力してください。根拠となる資料URL（原本）と資料URL（GF）は、分析対象データの検索結果に含まれるURL情報から引用し、Markdown形式（[URL](...)）ではなくURLだけを記載してください：
 
 【全体の傾向】
 ...
@@ -85,6 +155,10 @@ URL（GF）: {doc.get('URL(GF)', '')}
 ...
 
 **重要: 根拠となる資料の正式名称は省略せずに完全に記載してください。また、資料のURL（原本）とURL（GF）も必ず記載してください。URL（原本）とURL（GF）はMarkdown形式（[URL](...)）ではなく、URL文字列だけを記載してください。**
+
+{DATA_SECTION_HEADER}
+## 検索結果
+{docs_text}
 """
     
     return prompt
@@ -103,32 +177,10 @@ def get_custom_prompt(documents: list[dict], user_instruction: str) -> str:
     """
     
     # 検索結果を整形
-    docs_text = ""
-    for i, doc in enumerate(documents, 1):
-        docs_text += f"""
-【文書{i}】
-自治体: {doc.get('都道府県', '')} {doc.get('市区町村', '')}
-資料カテゴリ: {doc.get('資料カテゴリ', '')}
-資料名（正式名称）: {doc.get('資料名', '')}
-年度: {doc.get('開始年度', '')}年度"""
-        
-        if doc.get('終了年度'):
-            docs_text += f"～{doc.get('終了年度', '')}年度"
-        
-        docs_text += f"""
-URL（原本）: {doc.get('URL(原本)', '')}
-URL（GF）: {doc.get('URL(GF)', '')}
-本文:
-{doc.get('本文', '')[:2000]}
-
----
-"""
+    docs_text = format_documents(documents, max_chars=2000)
     
     prompt = f"""
-以下の自治体文書の検索結果について、指示に従って分析してください。
-
-# 検索結果
-{docs_text}
+末尾の「分析対象データ」にある自治体文書の検索結果について、指示に従って分析してください。
 
 # 指示
 {user_instruction}
@@ -139,6 +191,10 @@ URL（GF）: {doc.get('URL(GF)', '')}
 - 根拠となる資料名: 「資料の正式名称」（◯◯年度）
 - 根拠となる資料URL（原本）: 検索結果のURLだけを記載（Markdown形式ではなく）
 - 根拠となる資料URL（GF）: 検索結果のURLだけを記載（Markdown形式ではなく）
+
+{DATA_SECTION_HEADER}
+## 検索結果
+{docs_text}
 """
     
     return prompt
@@ -159,48 +215,23 @@ def get_custom_batch_prompt(documents: list[dict], user_instruction: str, batch_
     """
     
     # 検索結果を整形
-    docs_text = ""
-    for i, doc in enumerate(documents, 1):
-        docs_text += f"""
-【文書{i}】
-自治体: {doc.get('都道府県', '')} {doc.get('市区町村', '')}
-資料カテゴリ: {doc.get('資料カテゴリ', '')}
-資料名（正式名称）: {doc.get('資料名', '')}
-年度: {doc.get('開始年度', '')}年度"""
-        
-        if doc.get('終了年度'):
-            docs_text += f"～{doc.get('終了年度', '')}年度"
-        
-        docs_text += f"""
-URL（原本）: {doc.get('URL(原本)', '')}
-URL（GF）: {doc.get('URL(GF)', '')}
-本文:
-{doc.get('本文', '')[:800]}
-
----
-"""
+    docs_text = format_documents(documents, max_chars=800)
     
     prompt = f"""
-# バッチ処理情報
-これは全{total_batches}バッチ中の第{batch_num}バッチです。
-このバッチには{len(documents)}件の文書が含まれています。
-
-# 自治体文書データ
-{docs_text}
-
 # あなたへの指示
-以下のユーザー指示に従って、上記の文書を分析してください：
+全文書を複数のバッチに分けて分析しています。
+以下のユーザー指示に従って、末尾の「分析対象データ」にあるこのバッチの自治体文書を分析してください：
 
 {user_instruction}
 
 # 出力形式
-- このバッチ（{len(documents)}件）の範囲内での分析結果を出力してください
+- このバッチに含まれる文書の範囲内での分析結果を出力してください
 - **必ず自治体ごとに分析結果をまとめてください**
 - 各自治体について、具体的な記載内容（根拠となる文言）を引用してください
-- 根拠となる資料URL（原本）と資料URL（GF）は、上記の自治体文書データに含まれるURL情報から引用してください
-- 後で全バッチの結果を統合するため、以下の構造化された形式で出力してください：
+- 根拠となる資料URL（原本）と資料URL（GF）は、分析対象データの自治体文書データに含まれるURL情報から引用してください
+- 後で全バッチの結果を統合するため、以下の構造化された形式で出力してください（Nはバッチ処理情報に記載のバッチ番号）：
 
-【バッチ{batch_num}の分析結果】
+【バッチNの分析結果】
 
 ■ 都道府県名 市区町村名
 - 分析内容: ...
@@ -219,6 +250,14 @@ URL（GF）: {doc.get('URL(GF)', '')}
 （このバッチ内の全自治体について記載）
 
 **重要: 根拠となる資料の正式名称・年度・URL（原本）・URL（GF）の全ての項目は必ず完全に明記してください。省略は不可です。**
+
+{DATA_SECTION_HEADER}
+## バッチ処理情報
+これは全{total_batches}バッチ中の第{batch_num}バッチです。
+このバッチには{len(documents)}件の文書が含まれています。
+
+## 自治体文書データ
+{docs_text}
 """
     
     return prompt
@@ -250,13 +289,11 @@ def get_custom_integration_prompt(batch_results: list[str], user_instruction: st
     prompt = f"""
 # 統合分析タスク
 
-以下は、全{total_docs}件の自治体文書を{len(batch_results)}バッチに分けて分析した結果です。
+末尾の「分析対象データ」は、自治体文書を複数のバッチに分けて分析した結果です。
 各バッチでは自治体ごとに分析がまとめられています。
 
-{all_batch_results}
-
 # あなたへの指示
-上記の各バッチの分析結果を統合し、全体視点で以下の指示を実行してください：
+各バッチの分析結果を統合し、全体視点で以下の指示を実行してください：
 
 {user_instruction}
 
@@ -278,7 +315,7 @@ def get_custom_integration_prompt(batch_results: list[str], user_instruction: st
    - 各バッチの結果から資料URL（原本）と資料URL（GF）の情報を引用してください
 
 # 出力形式
-以下の構造で出力してください。資料URL（原本）と資料URL（GF）は、上記のバッチ結果に含まれるURL情報から引用してください：
+以下の構造で出力してください。資料URL（原本）と資料URL（GF）は、分析対象データのバッチ結果に含まれるURL情報から引用してください：
 
 【全体サマリー】
 ...
@@ -305,6 +342,259 @@ def get_custom_integration_prompt(batch_results: list[str], user_instruction: st
 
 【重要な発見事項】
 ...
+
+{DATA_SECTION_HEADER}
+全{total_docs}件の自治体文書を{len(batch_results)}バッチに分けて分析した結果です。
+
+{all_batch_results}
 """
     
-    return prompt
\ No newline at end of file
+    return prompt
+
+
+def get_summary_integration_prompt(batch_results: list[str], total_docs: int) -> str:
+    """
+    自動要約用の統合プロンプトを生成
+    
+    Args:
+        batch_results: 各バッチの要約結果リスト
+        total_docs: 総文書数
+    
+    Returns:
+        str: 統合処理用プロンプト
+    """
+    
+    all_batch_results = "\n".join(
+        f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\nバッチ{i}の要約\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n{result}\n"
+        for i, result in enumerate(batch_results, 1)
+    )
+    
+    prompt = f"""
+末尾の「分析対象データ」は、自治体文書を複数のバッチに分けて要約した結果です。
+各バッチでは自治体ごとに分析がまとめられています。
+
+# 統合要約の指示
+各バッチ要約を統合し、全体を俯瞰した総合的な要約を作成してください。
+
+# 統合時の重要ポイント
+1. **自治体ごとの情報を統合**: 同じ自治体が複数バッチに登場する場合は情報を統合してください
+2. **具体性を保持**: 根拠となる記載や具体的な施策名を保持してください
+3. **重複を排除**: 同じ内容が複数回出現する場合は1回にまとめてください
+
+# 出力形式
+以下の構成で出力してください:
+
+【全体サマリー】（200-300文字）
+検索結果全体の傾向を俯瞰
+
+【自治体別の統合分析】
+各自治体の特徴を、根拠となる記載とともに整理
+
+■ 都道府県名 市区町村名
+- 特徴: ...
+- 根拠となる記載: 「〇〇〇」
+- 年度: ...
+
+**重要: このバッチに含まれるすべての自治体について記載してください。省略や「以下省略」は不可。**
+
+【主要テーマ】
+最も頻出するテーマを3-5個
+
+【地域別の傾向】
+地域ごとの特徴があれば記載
+
+【時系列の変化】
+年度による変化や推移があれば記載
+
+【頻出キーワード TOP5-10】
+重要なキーワードを抽出
+
+{DATA_SECTION_HEADER}
+全{total_docs}件の自治体文書を{len(batch_results)}バッチに分けて要約した結果です。
+
+{all_batch_results}
+"""
+
+    
+    return prompt
+
+
+def get_merge_prompt(summaries: list[str], user_instruction: str, level: int) -> str:
+    """
+    多段統合の中間段で使う統合プロンプトを生成
+    
+    出力は次の段・最終統合の入力になるため、バッチ分析結果と同じ自治体別の形式を維持させる
+    
+    Args:
+        summaries: 統合する分析結果のリスト（隣接するバッチの結果）
+        user_instruction: ユーザーからの指示（自動要約は空文字）
+        level: 統合の段数（1から開始）
+    
+    Returns:
+        str: 中間統合用プロンプト
+    """
+    
+    all_results = ""
+    for i, result in enumerate(summaries, 1):
+        all_results += f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+分析結果{i}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{result}
+
+"""
+    
+    instruction_text = f"""
+# ユーザーの指示（最終統合で適用されます。ここでは関連する情報を漏れなく残してください）
+{user_instruction}
+""" if user_instruction else ""
+    
+    prompt = f"""
+# 中間統合タスク
+
+末尾の「分析対象データ」は、自治体文書を複数バッチに分けて分析した結果のうち、隣接するものです。
+これらを1つの分析結果に統合してください。この結果はさらに他の結果と統合されます。
+{instruction_text}
+# 統合の指示
+1. **同じ自治体の情報は1つにまとめてください**（複数の結果に登場する場合）
+2. **要約しすぎないでください**: 各自治体の特徴・根拠となる記載・資料名・年度・URLはすべて保持してください
+3. **重複を排除**: 同じ内容が複数回出現する場合は1回にまとめてください
+4. 全体の傾向のまとめは不要です（最終統合で行います）
+
+# 出力形式
+以下の形式で、対象となるすべての自治体について出力してください：
+
+■ 都道府県名 市区町村名
+- 分析内容: ...
+- 根拠となる記載: 「〇〇〇」
+- 根拠となる資料名: 「資料の正式名称」（◯◯年度）
+- 根拠となる資料URL（原本）: 検索結果のURLだけを記載（Markdown形式ではなく）
+- 根拠となる資料URL（GF）: 検索結果のURLだけを記載（Markdown形式ではなく）
+
+**重要: 省略や「以下省略」「その他の自治体」などは不可。根拠となる資料の正式名称・年度・URL（原本）・URL（GF）は必ず完全に記載してください。**
+
+{DATA_SECTION_HEADER}
+統合の第{level}段、隣接する{len(summaries)}件の分析結果です。
+
+{all_results}
+"""
+    
+    return prompt
+
+
+def get_entity_batch_prompt(documents: list[dict], user_instruction: str = "") -> str:
+    """
+    自治体単位のバッチ用プロンプトを生成
+    
+    各バッチが自治体を丸ごと受け持つため、全体の傾向は書かせず、自治体別の分析だけを出力させる
+    （バッチの結果はそのまま連結して最終結果の自治体別の分析になる）
+    
+    Args:
+        documents: 検索結果のリスト（バッチ分）
+        user_instruction: ユーザーからの指示（自動要約は空文字）
+    
+    Returns:
+        str: 自治体単位のバッチ処理用プロンプト
+    """
+    
+    docs_text = format_documents(documents, max_chars=800)
+    
+    instruction_text = f"""
+# ユーザーの指示
+以下の指示の観点で各自治体を分析してください（全体での順位付けなどは別の工程で行います）：
+
+{user_instruction}
+""" if user_instruction else ""
+    
+    prompt = f"""
+# あなたへの指示
+末尾の「分析対象データ」にある自治体文書を、自治体ごとに分析してください。
+この結果は他の自治体の結果とそのまま連結されるため、全体の傾向のまとめや前置き・見出しは出力しないでください。
+{instruction_text}
+# 分析の指示
+1. **自治体ごとに1つの項目にまとめてください**（同じ自治体の複数の文書は1つにまとめる）
+2. **具体性を保持**: 根拠となる記載や具体的な施策名・年度を残してください
+3. **重複を排除**: 同じ内容が複数回出現する場合は1回にまとめてください
+
+# 出力形式
+以下の形式だけで、データに含まれるすべての自治体について出力してください：
+
+■ 都道府県名 市区町村名
+- 分析内容: ...
+- 根拠となる記載: 「〇〇〇」
+- 根拠となる資料名: 「資料の正式名称」（◯◯年度）
+- 根拠となる資料URL（原本）: 検索結果のURLだけを記載（Markdown形式ではなく）
+- 根拠となる資料URL（GF）: 検索結果のURLだけを記載（Markdown形式ではなく）
+
+**重要: 省略や「以下省略」「その他の自治体」などは不可。根拠となる資料の正式名称・年度・URL（原本）・URL（GF）は必ず完全に記載してください。**
+
+{DATA_SECTION_HEADER}
+{len(documents)}件の自治体文書です。
+
+{docs_text}
+"""
+    
+    return prompt
+
+
+def get_overview_prompt(entity_results: list[str], user_instruction: str, total_docs: int) -> str:
+    """
+    自治体単位のバッチ結果から全体の傾向だけを生成するプロンプトを生成
+    
+    自治体別の分析はバッチ結果を連結して別に表示するため、ここでは自治体ごとの列挙はさせない
+    
+    Args:
+        entity_results: 各バッチの自治体別の分析結果リスト
+        user_instruction: ユーザーからの指示（自動要約は空文字）
+        total_docs: 総文書数
+    
+    Returns:
+        str: 全体の傾向の生成用プロンプト
+    """
+    
+    all_results = "\n".join(
+        f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n分析結果{i}\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n{result}\n"
+        for i, result in enumerate(entity_results, 1)
+    )
+    
+    instruction_text = f"""
+# ユーザーの指示
+全自治体の分析結果を対象に、以下の指示を実行してください（「TOP3」「ランキング」などは全体から選出）：
+
+{user_instruction}
+""" if user_instruction else ""
+    
+    answer_section = """
+【指示への回答】
+ユーザーの指示に対する回答（自治体名と根拠となる資料名を明記）
+""" if user_instruction else ""
+    
+    prompt = f"""
+末尾の「分析対象データ」は、自治体文書を自治体ごとに分析した結果です。
+自治体別の分析はこの出力の後にそのまま掲載するため、ここでは自治体ごとの列挙はせず、全体を俯瞰した傾向だけを出力してください。
+{instruction_text}
+# 出力形式
+以下の構成で出力してください:
+{answer_section}
+【全体サマリー】（200-300文字）
+検索結果全体の傾向を俯瞰
+
+【主要テーマ】
+最も頻出するテーマを3-5個
+
+【地域別の傾向】
+地域ごとの特徴があれば記載
+
+【時系列の変化】
+年度による変化や推移があれば記載
+
+【頻出キーワード TOP5-10】
+重要なキーワードを抽出
+
+{DATA_SECTION_HEADER}
+全{total_docs}件の自治体文書を自治体ごとに分析した結果です。
+
+{all_results}
+"""
+    
+    return prompt
@@ -3,57 +3,38 @@
 Elasticsearchクエリの生成ロジック（ユーザー制限対応・キーワード統合改善版）
 """
 
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
+from tracing import traced
 
-def build_search_query(
-    and_words: List[str],
-    or_words: List[str],
-    not_words: List[str],
-    years: List[int],
-    codes: List[str],
-    categories: List[int],
-    search_fields: List[str] = None,
-    base_query: Optional[dict] = None,
-    can_modify_query: bool = True
-) -> dict:
+
+@dataclass(frozen=True)
+class BaseFilter:
+    """ベースクエリを分類した結果（build_search_queryでUI入力の条件と組み合わせる）"""
+    must: Tuple[dict, ...] = ()  # キーワード条件（can_modify_query=Falseの場合のみ）
+    should: Tuple[dict, ...] = ()
+    must_not: Tuple[dict, ...] = ()
+    filter: Tuple[dict, ...] = ()  # キーワード以外の条件（code, categoryなど）
+    minimum_should_match: Optional[object] = None
+
+
+def classify_base_query(base_query: Optional[dict], can_modify_query: bool = True) -> BaseFilter:
     """
-    キーワード・年度・自治体・カテゴリを組み合わせたクエリを構築
+    ベースクエリの条件を分類（キーワード条件・その他の条件・should・must_not）
     
     Args:
-        and_words: AND検索キーワードリスト
-        or_words: OR検索キーワードリスト
-        not_words: NOT検索キーワードリスト
-        years: 検索対象年度リスト
-        codes: 自治体コードリスト
-        categories: カテゴリIDリスト
-        search_fields: 検索対象フィールドリスト（["本文", "資料名"]）
         base_query: ベースクエリ（ユーザー制限用、user_query.pyから渡される）
         can_modify_query: クエリ修正可能フラグ（Trueならベースクエリのキーワードを無視）
     
     Returns:
-        dict: Elasticsearchクエリ
+        BaseFilter: 分類結果
     """
-    if search_fields is None:
-        search_fields = ["本文"]
-    
-    # フィールド名のマッピング
-    field_mapping = {
-        "本文": "content_text",
-        "資料名": "title"
-    }
-    target_fields = [field_mapping[f] for f in search_fields if f in field_mapping]
-    
-    # 検索対象フィールドがない場合はデフォルトで本文のみ
-    if not target_fields:
-        target_fields = ["content_text"]
-    
     must_clauses = []
     should_clauses = []
     must_not_clauses = []
     filter_clauses = []
     
-    # ===== ベースクエリの条件を分類して引き継ぐ =====
     if base_query and isinstance(base_query, dict):
         bool_base = base_query.get("bool", {})
         
@@ -108,6 +89,78 @@ def build_search_query(
             else:
                 filter_clauses.append(bool_base["filter"])
     
+    minimum_should_match = None
+    if base_query and "bool" in base_query and "minimum_should_match" in base_query["bool"]:
+        minimum_should_match = base_query["bool"]["minimum_should_match"]
+    
+    return BaseFilter(
+        must=tuple(must_clauses),
+        should=tuple(should_clauses),
+        must_not=tuple(must_not_clauses),
+        filter=tuple(filter_clauses),
+        minimum_should_match=minimum_should_match
+    )
+
+
+@traced()
+def build_search_query(
+    and_words: List[str],
+    or_words: List[str],
+    not_words: List[str],
+    years: List[int],
+    codes: List[str],
+    categories: List[int],
+    search_fields: List[str] = None,
+    base_query: Optional[dict] = None,
+    can_modify_query: bool = True,
+    base_filter: Optional[BaseFilter] = None
+) -> dict:
+    """
+    キーワード・年度・自治体・カテゴリを組み合わせたクエリを構築
+    
+    Args:
+        and_words: AND検索キーワードリスト
+        or_words: OR検索キーワードリスト
+        not_words: NOT検索キーワードリスト
+        years: 検索対象年度リスト
+        codes: 自治体コードリスト
+        categories: カテゴリIDリスト
+        search_fields: 検索対象フィールドリスト（["本文", "資料名"]）
+        base_query: ベースクエリ（ユーザー制限用、user_query.pyから渡される）
+        can_modify_query: クエリ修正可能フラグ（Trueならベースクエリのキーワードを無視）
+        base_filter: classify_base_query で分類済みのベースクエリ（指定時はbase_query・can_modify_queryより優先）
+    
+    Returns:
+        dict: Elasticsearchクエリ
+    """
+    if search_fields is None:
+        search_fields = ["本文"]
+    
+    # フィールド名のマッピング
+    field_mapping = {
+        "本文": "content_text",
+        "資料名": "title"
+    }
+    target_fields = [field_mapping[f] for f in search_fields if f in field_mapping]
+    
+    # 検索対象フィールドがない場合はデフォルトで本文のみ
+    if not target_fields:
+        target_fields = ["content_text"]
+    
+    must_clauses = []
+    should_clauses = []
+    must_not_clauses = []
+    filter_clauses = []
+    
+    # ===== ベースクエリの条件を分類して引き継ぐ =====
+    # （ログイン時に分類済みのbase_filterがあれば再分類しない）
+    if base_filter is None:
+        base_filter = classify_base_query(base_query, can_modify_query)
+    must_clauses.extend(base_filter.must)
+    should_clauses.extend(base_filter.should)
+    must_not_clauses.extend(base_filter.must_not)
+    filter_clauses.extend(base_filter.filter)
+    
     # ===== キーワード検索用ヘルパー関数 =====
     def build_field_query(word):
         """複数フィールドに対するクエリを構築"""
@@ -191,8 +244,8 @@ def build_search_query(
     if should_clauses:
         query["bool"]["should"] = should_clauses
         # ベースクエリでminimum_should_matchが設定されていた場合は保持
-        if base_query and "bool" in base_query and "minimum_should_match" in base_query["bool"]:
-            query["bool"]["minimum_should_match"] = base_query["bool"]["minimum_should_match"]
+        if base_filter.minimum_should_match is not None:
+            query["bool"]["minimum_should_match"] = base_filter.minimum_should_match
         else:
             query["bool"]["minimum_should_match"] = 1
     
@@ -206,4 +259,39 @@ def build_search_query(
     if not query["bool"]:
         return {"match_all": {}}
     
-    return query
\ No newline at end of file
+    return query
+
+
+def extract_query_keywords(query: dict) -> List[str]:
+    """
+    クエリからキーワード（match_phraseの検索語）を抽出（NOT条件の語は除く）
+    
+    Args:
+        query: Elasticsearchクエリ（build_search_queryの結果）
+    
+    Returns:
+        List[str]: 重複を除いたキーワードのリスト（出現順）
+    """
+    keywords = []
+    
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+            return
+        if not isinstance(node, dict):
+            return
+        for key, value in node.items():
+            if key == "must_not":
+                continue
+            if key == "match_phrase" and isinstance(value, dict):
+                for phrase in value.values():
+                    if isinstance(phrase, dict):
+                        phrase = phrase.get("query", "")
+                    if phrase and phrase not in keywords:
+                        keywords.append(str(phrase))
+            else:
+                walk(value)
+    
+    walk(query)
+    return keywords
@@ -0,0 +1,298 @@
+"""
+検索の取り消しモジュール
+再実行（rerun）ごとのElasticsearchへのリクエストに識別子（X-Opaque-Id）を付けてセッションごとに管理し、
+同じセッションの新しい再実行に置き換えられた検索をタスクAPIで取り消す
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from elasticsearch import NotFoundError
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import StopException, get_script_run_ctx
+
+
+OPAQUE_ID_PREFIX = "gfinder"  # X-Opaque-Id の接頭辞（ESのスローログ・タスク一覧での識別用）
+WATCH_INTERVAL = 0.2  # 再実行の要求を確認する間隔（秒）
+CANCEL_TIMEOUT = 5  # タスクAPIの呼び出しのタイムアウト（秒）
+SEARCH_ACTIONS = "indices:data/read/search*"  # 取り消す対象のタスクの種類
+
+
+class SearchSuperseded(StopException):
+    """
+    新しい再実行に置き換えられた検索
+    
+    st.stop() と同じ例外の扱いになるため、古い再実行はエラーを表示せずに終了し、保留中の再実行に進む
+    """
+
+
+@dataclass
+class SearchRun:
+    """1回の再実行でのElasticsearchへのリクエスト"""
+    session_id: str  # セッションの識別子
+    run_id: str  # 再実行の識別子
+    es: Any  # 取り消しに使うElasticsearchクライアント
+    ctx: Any = None  # Streamlitのスクリプト実行コンテキスト（再実行の要求の確認用）
+    in_flight: int = 0  # 処理中のリクエスト数
+    superseded: threading.Event = field(default_factory=threading.Event)  # 置き換えられたか
+    
+    @property
+    def opaque_id(self) -> str:
+        """リクエストに付ける識別子"""
+        return f"{OPAQUE_ID_PREFIX}/{self.session_id}/{self.run_id}"
+
+
+@dataclass
+class CancelStats:
+    """検索の取り消しの集計値（全セッション共通）"""
+    superseded_runs: int = 0  # 検索中に置き換えられた再実行
+    stopped_requests: int = 0  # 置き換えられたため送らなかった・結果を捨てたリクエスト（compositeの続きのページなど）
+    cancelled_tasks: int = 0  # タスクAPIで取り消したESのタスク
+    cancel_errors: int = 0  # タスクAPIの呼び出しの失敗
+
+
+logger = logging.getLogger(__name__)
+
+# セッションごとの実行中の再実行（全セッション共通）
+_runs: Dict[str, SearchRun] = {}
+_stats = CancelStats()
+_lock = threading.Lock()
+_watcher: Optional[threading.Thread] = None
+_internals_warned = False  # Streamlitの内部の値が見つからない警告を出したか
+
+# 実行中の再実行（Streamlitのスクリプト実行スレッドごと。要約ジョブなど別スレッドのリクエストは対象外）
+_current_run: contextvars.ContextVar = contextvars.ContextVar("current_search_run", default=None)
+
+
+def start_search_run(es: Any, session_id: str, run_id: str) -> SearchRun:
+    """
+    再実行の検索の管理を開始（app.pyでESクライアントの取得後に呼ぶ）
+    
+    同じセッションの前の再実行が終わっていなければ置き換えたものとし、処理中の検索を取り消す
+    
+    Args:
+        es: Elasticsearchクライアント
+        session_id: セッションの識別子
+        run_id: 再実行の識別子
+    
+    Returns:
+        SearchRun: 再実行の検索
+    """
+    global _watcher
+    run = SearchRun(session_id, run_id, es, ctx=get_script_run_ctx(suppress_warning=True))
+    with _lock:
+        previous = _runs.get(session_id)
+        _runs[session_id] = run
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name="search-cancel-watcher", daemon=True)
+            _watcher.start()
+    if previous is not None:
+        _supersede(previous)
+    _current_run.set(run)
+    return run
+
+
+def finish_search_run():
+    """再実行の検索の管理を終了（app.pyで start_search_run 以降を囲む try の finally で呼ぶ）"""
+    run = _current_run.get()
+    if run is None:
+        return
+    _current_run.set(None)
+    with _lock:
+        if _runs.get(run.session_id) is run:
+            del _runs[run.session_id]
+
+
+def current_opaque_id() -> Optional[str]:
+    """
+    実行中の再実行のリクエストに付ける識別子
+    
+    Returns:
+        Optional[str]: X-Opaque-Id の値（再実行の管理中でなければNone）
+    """
+    run = _current_run.get()
+    return run.opaque_id if run is not None else None
+
+
+@contextmanager
+def cancellable_search():
+    """
+    Elasticsearchへの1回のリクエストを囲み、置き換えられた再実行のリクエストを止める
+    
+    置き換えられた後は送らずに SearchSuperseded を送出する（compositeのページ送りはここで止まる）。
+    送信中に置き換えられて取り消された場合も、ESのエラーの代わりに SearchSuperseded を送出する
+    
+    Raises:
+        SearchSuperseded: 再実行が置き換えられた場合
+    """
+    run = _current_run.get()
+    if run is None:
+        yield
+        return
+    with _lock:
+        if run.superseded.is_set():
+            _stats.stopped_requests += 1
+            raise SearchSuperseded(run.opaque_id)
+        run.in_flight += 1
+    try:
+        yield
+    except Exception as e:
+        if run.superseded.is_set():
+            with _lock:
+                _stats.stopped_requests += 1
+            raise SearchSuperseded(run.opaque_id) from e
+        raise
+    finally:
+        with _lock:
+            run.in_flight -= 1
+
+
+def get_cancel_stats() -> dict:
+    """
+    検索の取り消しの集計値
+    
+    Returns:
+        dict: 集計値（superseded_runs, stopped_requests, cancelled_tasks, cancel_errors, active_runs）
+    """
+    with _lock:
+        return {**asdict(_stats), "active_runs": len(_runs)}
+
+
+def reset_cancel_stats():
+    """検索の取り消しの集計値をリセット"""
+    global _stats
+    with _lock:
+        _stats = CancelStats()
+
+
+def _supersede(run: SearchRun):
+    """再実行を置き換えられたものとし、処理中の検索があればタスクAPIで取り消す"""
+    with _lock:
+        if run.superseded.is_set():
+            return
+        run.superseded.set()
+        busy = run.in_flight > 0
+        if busy:
+            _stats.superseded_runs += 1
+    if busy:
+        _cancel_tasks(run)
+
+
+def _cancel_tasks(run: SearchRun):
+    """再実行の識別子が付いた検索のタスクを取り消す（子タスクは親と一緒に取り消される）"""
+    try:
+        es = run.es.options(request_timeout=CANCEL_TIMEOUT)
+        res = es.tasks.list(actions=SEARCH_ACTIONS, detailed=True)
+        task_ids = [
+            task_id
+            for node in res.get("nodes", {}).values()
+            for task_id, task in node.get("tasks", {}).items()
+            if task.get("headers", {}).get("X-Opaque-Id") == run.opaque_id and not task.get("parent_task_id")
+        ]
+        cancelled = 0
+        for task_id in task_ids:
+            try:
+                es.tasks.cancel(task_id=task_id)
+                cancelled += 1
+            except NotFoundError:
+                pass  # 一覧の取得後に終わった
+        with _lock:
+            _stats.cancelled_tasks += cancelled
+    except Exception:
+        # 取り消せなくても検索はタイムアウトまでに終わり、古い再実行は次のページを送らない
+        with _lock:
+            _stats.cancel_errors += 1
+
+
+def _rerun_requested(ctx: Any) -> bool:
+    """
+    スクリプトの実行中に再実行・停止が要求されているか（フラグメントだけの再実行は除く）
+    
+    Streamlitは要求された再実行を実行中のスクリプトが次にst.*を呼ぶまで始めないため、
+    ESの応答を待っている間に要求を知るには要求の状態を直接確認する（公開の参照方法がないため内部の値を読む）
+    
+    Args:
+        ctx: Streamlitのスクリプト実行コンテキスト
+    
+    Returns:
+        bool: 要求されていればTrue（Streamlitの内部の値が見つからない場合は警告を1回だけ出してFalse）
+    """
+    requests = getattr(ctx, "script_requests", None)
+    state = getattr(requests, "_state", None)
+    rerun_data = getattr(requests, "_rerun_data", None)
+    if not hasattr(state, "name") or not hasattr(rerun_data, "fragment_id_queue"):
+        _warn_internals_missing()
+        return False
+    if state.name == "STOP":
+        return True
+    if state.name != "RERUN":
+        return False
+    return not rerun_data.fragment_id_queue
+
+
+def _warn_internals_missing():
+    """Streamlitの更新で内部の値が変わり、再実行の要求を確認できないことを1回だけ警告"""
+    global _internals_warned
+    if _internals_warned:
+        return
+    _internals_warned = True
+    logger.warning(
+        "search_cancel: ScriptRequests._state / _rerun_data.fragment_id_queue が見つからないため、"
+        "ESの応答待ちの間に再実行の要求を確認できません（新しい再実行の開始時の取り消しとページ送りの停止のみ有効）。"
+        "Streamlitのバージョンを確認してください"
+    )
+
+
+def _session_closed(ctx: Any) -> bool:
+    """
+    スクリプト実行コンテキストのセッションが終了しているか
+    
+    Args:
+        ctx: Streamlitのスクリプト実行コンテキスト
+    
+    Returns:
+        bool: 終了していればTrue（Streamlitのサーバー外で判定できない場合はFalse）
+    """
+    session_id = getattr(ctx, "session_id", None)
+    if not session_id or not Runtime.exists():
+        return False
+    return not Runtime.instance().is_active_session(session_id)
+
+
+def _prune_closed_sessions():
+    """終了したセッションの再実行を外す（ブラウザを閉じるなどで finish_search_run が呼ばれなかったもの）"""
+    with _lock:
+        runs = [r for r in _runs.values() if r.ctx is not None]
+    closed = []
+    for run in runs:
+        try:
+            if _session_closed(run.ctx):
+                closed.append(run)
+        except Exception:
+            pass
+    for run in closed:
+        _supersede(run)
+        with _lock:
+            if _runs.get(run.session_id) is run:
+                del _runs[run.session_id]
+
+
+def _watch():
+    """実行中の再実行を定期的に確認し、再実行・停止が要求されたものを置き換える（バックグラウンドスレッド）"""
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        _prune_closed_sessions()
+        with _lock:
+            runs: List[SearchRun] = [r for r in _runs.values() if r.ctx is not None and not r.superseded.is_set()]
+        for run in runs:
+            try:
+                requested = _rerun_requested(run.ctx)
+            except Exception:
+                requested = False
+            if requested:
+                _supersede(run)
@@ -7,9 +7,11 @@ import streamlit as st
 import pandas as pd
 from st_ant_tree import st_ant_tree
 from typing import List
-from user_query import get_user_restrictions
+from user_query import get_restriction_context
+from tracing import traced
 
 
+@traced()
 def build_jichitai_tree(jichitai: pd.DataFrame, sel_city_types: List[str]) -> tuple[List[dict], dict]:
     """
     自治体データをツリー構造に変換(都道府県の下に市区町村をネスト)
@@ -81,6 +83,7 @@ def build_jichitai_tree(jichitai: pd.DataFrame, sel_city_types: List[str]) -> tu
     return tree_data, value_to_code
 
 
+@traced()
 def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
     """
     サイドバーUIを構築し、選択された条件を返す（ユーザー制限対応）
@@ -92,8 +95,9 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
     Returns:
         dict: 選択された条件
     """
-    # ユーザー制限情報を取得
-    restrictions = get_user_restrictions()
+    # ユーザー制限情報を取得（ログイン後に一度だけ組み立てた制限コンテキストを再利用）
+    context = get_restriction_context(jichitai, catmap)
+    restrictions = context.as_dict()
     
     # ユーザー情報表示
     user_name = st.session_state.get("user_display_name", "ゲスト")
@@ -148,18 +152,14 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
     # ========== 自治体絞り込み(ツリー形式) ==========
     st.sidebar.subheader("🔍 自治体・カテゴリ絞り込み")
     
-    # 自治体制限の適用
-    allowed_codes = restrictions["allowed_codes"]
-    
-    # 制限がある場合、jichitaiをフィルタリング
+    # 自治体制限の適用（制限コンテキストで絞り込み済み）
+    allowed_codes = context.allowed_codes
+    jichitai_filtered = context.jichitai
     if allowed_codes:
-        jichitai_filtered = jichitai[jichitai["code"].isin(allowed_codes)].copy()
         st.sidebar.caption(f"🔒 選択可能: {len(allowed_codes)}自治体")
-    else:
-        jichitai_filtered = jichitai.copy()
     
     # 自治体区分での事前フィルタリング
-    ctype_opts = sorted(jichitai_filtered["city_type"].dropna().unique().tolist())
+    ctype_opts = list(context.city_type_options)
     
     # 自治体区分の選択UI（常に表示）
     sel_city_types = st.sidebar.multiselect(
@@ -168,8 +168,8 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
         help="自治体区分で絞り込み後、ツリーから選択してください"
     )
     
-    # ツリーデータの構築（フィルタ済みjichitaiを使用）
-    tree_data, value_to_code = build_jichitai_tree(jichitai_filtered, sel_city_types)
+    # ツリーデータの取得（自治体区分の組み合わせごとに構築済みのものを再利用）
+    tree_data, value_to_code = context.tree_for(sel_city_types)
     
     # ツリー選択UI
     st.sidebar.markdown("**自治体選択(都道府県→市区町村)**")
@@ -193,7 +193,7 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
     sel_codes = []
     
     # キーワード処理用にcode_poolを先に定義
-    code_pool = jichitai_filtered.copy()
+    code_pool = jichitai_filtered
     if sel_city_types:
         code_pool = code_pool[code_pool["city_type"].isin(sel_city_types)]
     
@@ -239,30 +239,19 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
     # カテゴリ選択
     st.sidebar.markdown("---")
     cat_opts = catmap.sort_values("order")
-    short_unique = cat_opts.drop_duplicates(subset=["short_name"], keep="first")
-    
-    # カテゴリ制限の適用
-    allowed_categories = restrictions["allowed_categories"]
     
+    # カテゴリ制限の適用（制限コンテキストで絞り込み済み、制限なしなら全カテゴリ）
+    allowed_categories = context.allowed_categories
     if allowed_categories:
-        # 制限がある場合、許可されたカテゴリのみ表示
-        short_unique_filtered = short_unique[short_unique["category"].isin(allowed_categories)]
-        default_categories = short_unique_filtered["short_name"].tolist()
         st.sidebar.caption(f"🔒 選択可能: {len(allowed_categories)}カテゴリ")
-        
-        # カテゴリ選択UI（常に表示）
-        sel_cat_short = st.sidebar.multiselect(
-            "資料カテゴリ",
-            options=default_categories,
-            default=default_categories
-        )
-    else:
-        # 制限なし
-        sel_cat_short = st.sidebar.multiselect(
-            "資料カテゴリ",
-            options=short_unique["short_name"].tolist(),
-            default=short_unique["short_name"].tolist()
-        )
+    
+    # カテゴリ選択UI（常に表示）
+    default_categories = list(context.category_names)
+    sel_cat_short = st.sidebar.multiselect(
+        "資料カテゴリ",
+        options=default_categories,
+        default=default_categories
+    )
     
     sel_categories = cat_opts[cat_opts["short_name"].isin(sel_cat_short)]["category"].astype(int).tolist()
     
@@ -299,8 +288,9 @@ def build_sidebar(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> dict:
         "sel_categories": sel_categories,
         "codes_for_query": codes_for_query,
         "result_limit": result_limit,
-        "short_unique": short_unique,
+        "short_unique": context.short_unique,  # ログイン時に作成済み
         "restrictions": restrictions,  # ユーザー制限情報を追加
+        "restriction_context": context,  # 制限コンテキスト（分類済みのベースクエリなど）
         "filtered_codes": sel_codes,  # UIで選択された自治体コード（空=未選択）
         "selected_city_types": sel_city_types,  # UIで選択された自治体区分
     }
\ No newline at end of file
@@ -0,0 +1,334 @@
+"""
+ストレージの抽象化モジュール
+auth.xlsx・クエリファイルの保存先を GCS / ローカルディレクトリ / メモリ から選択し、
+負荷試験用の遅延・エラーの注入と、操作ごとの呼び出し回数・所要時間の計測を行う
+"""
+
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+BACKEND_KINDS = ("gcs", "local", "memory")  # 選択できる保存先
+
+
+class StorageError(Exception):
+    """ストレージ操作のエラー（注入したエラー・世代の不一致を含む）"""
+
+
+@dataclass
+class ObjectInfo:
+    """保存されたオブジェクトのメタデータ"""
+    name: str  # バケット（ルートディレクトリ）からのパス
+    generation: object  # 内容が変わるたびに変わる値（GCSのgeneration、ローカルは更新時刻）
+    size: int = 0  # バイト数
+
+
+@dataclass
+class StorageFaults:
+    """負荷試験用に注入する遅延・エラー"""
+    latency: float = 0.0  # 1操作あたりの追加の待ち時間（秒）
+    jitter: float = 0.0  # 待ち時間のばらつき（0〜jitter秒を加算）
+    error_rate: float = 0.0  # 操作が失敗する確率（0〜1）
+    seed: Optional[int] = None  # 乱数シード
+
+
+@dataclass
+class OperationStats:
+    """操作ごとの計測値"""
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    bytes: int = 0  # 読み書きしたバイト数
+
+
+@dataclass
+class BackendStats:
+    """保存先ごとの計測値"""
+    operations: Dict[str, OperationStats] = field(default_factory=dict)
+    
+    def snapshot(self) -> Dict[str, dict]:
+        """操作ごとの呼び出し回数・エラー数・平均/最大所要時間（ミリ秒）"""
+        return {
+            op: {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "avg_ms": round(stats.total_seconds / stats.calls * 1000, 2) if stats.calls else 0.0,
+                "max_ms": round(stats.max_seconds * 1000, 2),
+                "bytes": stats.bytes,
+            }
+            for op, stats in sorted(self.operations.items())
+        }
+
+
+class StorageBackend(ABC):
+    """
+    保存先の基底クラス
+    
+    サブクラスは _stat / _list / _read / _write を実装する。公開メソッドは遅延・エラーの注入と計測を行ってから呼び出す
+    """
+    
+    kind = ""
+    
+    def __init__(self, faults: Optional[StorageFaults] = None):
+        """
+        Args:
+            faults: 注入する遅延・エラー（Noneなら注入しない）
+        """
+        self.faults = faults or StorageFaults()
+        self.stats = BackendStats()
+        self._rng = random.Random(self.faults.seed)
+        self._lock = threading.Lock()
+    
+    def _call(self, op: str, func, *args):
+        """遅延・エラーを注入して操作を実行し、計測値を記録"""
+        started = time.perf_counter()
+        error = False
+        result = None
+        try:
+            with self._lock:
+                delay = self.faults.latency + (self._rng.uniform(0, self.faults.jitter) if self.faults.jitter else 0.0)
+                fail = self.faults.error_rate > 0 and self._rng.random() < self.faults.error_rate
+            if delay > 0:
+                time.sleep(delay)
+            if fail:
+                raise StorageError(f"注入したエラー（{self.kind} {op}）")
+            result = func(*args)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self.stats.operations.setdefault(op, OperationStats())
+                stats.calls += 1
+                stats.errors += int(error)
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+                if isinstance(result, bytes):
+                    stats.bytes += len(result)
+    
+    def stat(self, name: str) -> Optional[ObjectInfo]:
+        """
+        オブジェクトのメタデータを取得
+        
+        Args:
+            name: オブジェクトのパス
+        
+        Returns:
+            Optional[ObjectInfo]: メタデータ、存在しない場合はNone
+        """
+        return self._call("stat", self._stat, name)
+    
+    def list(self, prefix: str) -> List[ObjectInfo]:
+        """
+        パスが prefix で始まるオブジェクトの一覧を取得
+        
+        Args:
+            prefix: パスの接頭辞（例: query/）
+        
+        Returns:
+            List[ObjectInfo]: メタデータのリスト
+        """
+        return self._call("list", self._list, prefix)
+    
+    def read(self, name: str, generation: object = None) -> bytes:
+        """
+        オブジェクトの内容を読み込み
+        
+        Args:
+            name: オブジェクトのパス
+            generation: 指定した場合は世代が一致するときだけ読み込む（不一致はStorageError）
+        
+        Returns:
+            bytes: 内容
+        """
+        return self._call("read", self._read, name, generation)
+    
+    def write(self, name: str, data: bytes, content_type: str = "application/octet-stream") -> ObjectInfo:
+        """
+        オブジェクトを書き込み
+        
+        Args:
+            name: オブジェクトのパス
+            data: 内容
+            content_type: コンテンツタイプ（GCSのみ使用）
+        
+        Returns:
+            ObjectInfo: 書き込み後のメタデータ
+        """
+        return self._call("write", self._write, name, data, content_type)
+    
+    def describe(self) -> str:
+        """計測値を表示用の文字列に整形"""
+        parts = [
+            f"{op} {s['calls']}回（平均{s['avg_ms']:.1f}ms・最大{s['max_ms']:.1f}ms、エラー{s['errors']}回）"
+            for op, s in self.stats.snapshot().items()
+        ]
+        return f"{self.kind}: " + (" / ".join(parts) if parts else "操作なし")
+    
+    @abstractmethod
+    def _stat(self, name: str) -> Optional[ObjectInfo]:
+        """メタデータを取得（存在しなければNone）"""
+    
+    @abstractmethod
+    def _list(self, prefix: str) -> List[ObjectInfo]:
+        """接頭辞に一致するオブジェクトの一覧"""
+    
+    @abstractmethod
+    def _read(self, name: str, generation: object) -> bytes:
+        """内容を読み込む（generationを指定した場合は世代が一致するときだけ。不一致はStorageError）"""
+    
+    @abstractmethod
+    def _write(self, name: str, data: bytes, content_type: str) -> ObjectInfo:
+        """内容を書き込む"""
+
+
+class GCSBackend(StorageBackend):
+    """GCSバケット（google.cloud.storage のバケットを受け取る）"""
+    
+    kind = "gcs"
+    
+    def __init__(self, bucket, faults: Optional[StorageFaults] = None):
+        """
+        Args:
+            bucket: google.cloud.storage のバケット
+            faults: 注入する遅延・エラー
+        """
+        super().__init__(faults)
+        self.bucket = bucket
+    
+    def _stat(self, name: str) -> Optional[ObjectInfo]:
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        return ObjectInfo(name=blob.name, generation=blob.generation, size=blob.size or 0)
+    
+    def _list(self, prefix: str) -> List[ObjectInfo]:
+        return [
+            ObjectInfo(name=blob.name, generation=blob.generation, size=blob.size or 0)
+            for blob in self.bucket.list_blobs(prefix=prefix)
+        ]
+    
+    def _read(self, name: str, generation: object) -> bytes:
+        blob = self.bucket.blob(name)
+        if generation is None:
+            return blob.download_as_bytes()
+        return blob.download_as_bytes(if_generation_match=generation)
+    
+    def _write(self, name: str, data: bytes, content_type: str) -> ObjectInfo:
+        blob = self.bucket.blob(name)
+        blob.upload_from_string(data, content_type=content_type)
+        return ObjectInfo(name=name, generation=blob.generation, size=len(data))
+
+
+class LocalBackend(StorageBackend):
+    """ローカルディレクトリ（世代はファイルの更新時刻）"""
+    
+    kind = "local"
+    
+    def __init__(self, root: str, faults: Optional[StorageFaults] = None):
+        """
+        Args:
+            root: バケットの代わりにするディレクトリ
+            faults: 注入する遅延・エラー
+        """
+        super().__init__(faults)
+        self.root = Path(root)
+    
+    def _info(self, path: Path) -> ObjectInfo:
+        stat = path.stat()
+        return ObjectInfo(name=path.relative_to(self.root).as_posix(), generation=stat.st_mtime_ns, size=stat.st_size)
+    
+    def _stat(self, name: str) -> Optional[ObjectInfo]:
+        path = self.root / name
+        return self._info(path) if path.is_file() else None
+    
+    def _list(self, prefix: str) -> List[ObjectInfo]:
+        if not self.root.is_dir():
+            return []
+        return [
+            self._info(path) for path in sorted(self.root.rglob("*"))
+            if path.is_file() and path.relative_to(self.root).as_posix().startswith(prefix)
+        ]
+    
+    def _read(self, name: str, generation: object) -> bytes:
+        path = self.root / name
+        if generation is not None and path.stat().st_mtime_ns != generation:
+            raise StorageError(f"世代が一致しません: {name}")
+        return path.read_bytes()
+    
+    def _write(self, name: str, data: bytes, content_type: str) -> ObjectInfo:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f"{path.suffix}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        return self._info(path)
+
+
+class MemoryBackend(StorageBackend):
+    """メモリ上の辞書（世代は書き込みごとに増える連番）"""
+    
+    kind = "memory"
+    
+    def __init__(self, objects: Optional[Dict[str, bytes]] = None, faults: Optional[StorageFaults] = None):
+        """
+        Args:
+            objects: 初期内容（パス → 内容）
+            faults: 注入する遅延・エラー
+        """
+        super().__init__(faults)
+        self._objects: Dict[str, tuple] = {}
+        self._generation = 0
+        for name, data in (objects or {}).items():
+            self._write(name, data, "")
+    
+    def _stat(self, name: str) -> Optional[ObjectInfo]:
+        entry = self._objects.get(name)
+        return ObjectInfo(name=name, generation=entry[0], size=len(entry[1])) if entry else None
+    
+    def _list(self, prefix: str) -> List[ObjectInfo]:
+        return [
+            ObjectInfo(name=name, generation=generation, size=len(data))
+            for name, (generation, data) in sorted(self._objects.items())
+            if name.startswith(prefix)
+        ]
+    
+    def _read(self, name: str, generation: object) -> bytes:
+        entry = self._objects.get(name)
+        if entry is None:
+            raise StorageError(f"オブジェクトが存在しません: {name}")
+        if generation is not None and entry[0] != generation:
+            raise StorageError(f"世代が一致しません: {name}")
+        return entry[1]
+    
+    def _write(self, name: str, data: bytes, content_type: str) -> ObjectInfo:
+        self._generation += 1
+        self._objects[name] = (self._generation, bytes(data))
+        return ObjectInfo(name=name, generation=self._generation, size=len(data))
+
+
+def load_directory(root: str) -> Dict[str, bytes]:
+    """
+    ディレクトリ内のファイルをメモリ保存先の初期内容として読み込む
+    
+    Args:
+        root: ディレクトリ
+    
+    Returns:
+        Dict[str, bytes]: パス → 内容
+    """
+    root_path = Path(root)
+    if not root_path.is_dir():
+        return {}
+    return {
+        path.relative_to(root_path).as_posix(): path.read_bytes()
+        for path in root_path.rglob("*") if path.is_file()
+    }
@@ -0,0 +1,365 @@
+"""
+AI要約ジョブ管理モジュール
+要約処理をプロセス内のワーカープールでバックグラウンド実行し、進捗・途中結果をジョブ記録に保存
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+from config import get_secret, get_secret_int
+from summary_pipeline import PipelineCancelled
+
+
+DEFAULT_JOB_DIR = Path(__file__).parent / ".cache" / "jobs"
+
+# ジョブの状態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "待機中",
+    STATUS_RUNNING: "実行中",
+    STATUS_COMPLETED: "完了",
+    STATUS_FAILED: "失敗",
+    STATUS_CANCELLED: "中断",
+}
+
+
+@dataclass
+class SummaryJob:
+    """要約ジョブの記録（進捗・途中結果・最終結果）"""
+    job_id: str
+    owner: str  # ジョブを実行したユーザー
+    title: str  # 一覧表示用のタイトル
+    total_batches: int
+    status: str = STATUS_QUEUED
+    phase: str = ""  # 現在の処理段階（表示用）
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    batch_results: Dict[int, str] = field(default_factory=dict)  # バッチ番号 → 要約結果
+    batch_errors: Dict[int, str] = field(default_factory=dict)  # バッチ番号 → エラーメッセージ
+    final_summary: str = ""
+    error: str = ""
+    report: Dict[str, Any] = field(default_factory=dict)  # 処理時間・計測値などの表示用情報
+    download_content: str = ""
+    streaming: Dict[str, str] = field(default_factory=dict)  # 生成中のテキスト（保存しない）
+    
+    @property
+    def completed_batches(self) -> int:
+        """完了（成功・失敗）したバッチ数"""
+        return len(self.batch_results) + len(self.batch_errors)
+    
+    @property
+    def is_finished(self) -> bool:
+        """終了済み（完了・失敗・中断）か"""
+        return self.status in FINISHED_STATUSES
+    
+    def to_dict(self) -> dict:
+        """保存用の辞書に変換（生成中テキストは除く）"""
+        data = asdict(self)
+        data.pop("streaming", None)
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "SummaryJob":
+        """保存した辞書から復元（JSONで文字列化されたバッチ番号を戻す）"""
+        data = dict(data)
+        data["batch_results"] = {int(k): v for k, v in data.get("batch_results", {}).items()}
+        data["batch_errors"] = {int(k): v for k, v in data.get("batch_errors", {}).items()}
+        return cls(**data)
+
+
+class JobControl:
+    """
+    実行中ジョブの操作用（ジョブ関数に渡す）
+    
+    ジョブ記録の更新と、キャンセル時に通信中のストリームを閉じるための登録を行う
+    """
+    
+    def __init__(self, job: SummaryJob, write: Callable[[dict], None]):
+        """
+        Args:
+            job: 対象のジョブ記録
+            write: ジョブ記録（辞書）をディスクに書き込む関数
+        """
+        self.job = job
+        self._write = write
+        self._cancel_event = threading.Event()
+        self._streams = set()
+        self._lock = threading.Lock()
+    
+    @property
+    def cancelled(self) -> bool:
+        """キャンセルが要求されたか"""
+        return self._cancel_event.is_set()
+    
+    def cancel(self):
+        """キャンセルを要求し、通信中のストリームをすべて閉じる"""
+        self._cancel_event.set()
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            try:
+                stream.close()
+            except Exception:
+                pass
+    
+    def track_stream(self, stream):
+        """
+        通信中のストリームを登録（キャンセル済みなら即座に閉じる）
+        
+        Args:
+            stream: close()を持つストリーム
+        """
+        with self._lock:
+            self._streams.add(stream)
+        if self.cancelled:
+            stream.close()
+    
+    def untrack_stream(self, stream):
+        """通信が終わったストリームの登録を解除"""
+        with self._lock:
+            self._streams.discard(stream)
+    
+    def record_batch(self, batch_idx: int, result: Optional[str] = None, error: Optional[str] = None):
+        """
+        バッチの結果（またはエラー）を記録して保存
+        
+        Args:
+            batch_idx: バッチ番号（0から開始）
+            result: 要約結果
+            error: エラーメッセージ
+        """
+        with self._lock:
+            if result:
+                self.job.batch_results[batch_idx] = result
+                self.job.batch_errors.pop(batch_idx, None)
+            else:
+                self.job.batch_errors[batch_idx] = error or "不明なエラー"
+        self.save()
+    
+    def set_streaming(self, label: str, text: Optional[str]):
+        """
+        生成中のテキストを更新（Noneなら削除）
+        
+        Args:
+            label: 呼び出しの表示名（バッチ番号など）
+            text: 生成途中のテキスト
+        """
+        with self._lock:
+            if text is None:
+                self.job.streaming.pop(label, None)
+            else:
+                self.job.streaming[label] = text
+    
+    def update(self, save: bool = False, **fields):
+        """
+        ジョブ記録の項目を更新
+        
+        Args:
+            save: Trueならディスクにも保存
+            **fields: 更新する項目
+        """
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self.job, name, value)
+        if save:
+            self.save()
+    
+    def save(self):
+        """ジョブ記録をディスクに保存"""
+        with self._lock:
+            data = self.job.to_dict()
+        self._write(data)
+
+
+class JobManager:
+    """
+    要約ジョブのワーカープールと記録の保存先（全セッション共通）
+    
+    終了したジョブはディスクに保存し、再実行せずに後から結果を取得できる
+    """
+    
+    def __init__(self, directory: Path, max_workers: int, history: int):
+        """
+        Args:
+            directory: ジョブ記録の保存先ディレクトリ
+            max_workers: 同時に実行するジョブ数の上限
+            history: 保存しておくジョブ記録の件数
+        """
+        self.directory = Path(directory)
+        self.history = history
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="summary-job")
+        self._jobs: Dict[str, SummaryJob] = {}
+        self._controls: Dict[str, JobControl] = {}
+        self._lock = threading.Lock()
+    
+    def _path(self, job_id: str) -> Path:
+        """ジョブIDに対応するファイルパス"""
+        return self.directory / f"{job_id}.json"
+    
+    def _write(self, data: dict):
+        """ジョブ記録を一時ファイル経由で保存"""
+        path = self._path(data["job_id"])
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    
+    def _prune(self):
+        """保存件数を超えた古いジョブ記録を削除（実行中のジョブは残す）"""
+        paths = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in paths[self.history:]:
+            with self._lock:
+                if path.stem in self._controls:
+                    continue
+                self._jobs.pop(path.stem, None)
+            try:
+                path.unlink()
+            except OSError:
+                continue
+    
+    def submit(
+        self,
+        owner: str,
+        title: str,
+        total_batches: int,
+        run: Callable[[JobControl], None]
+    ) -> str:
+        """
+        ジョブを登録してバックグラウンドで実行
+        
+        Args:
+            owner: ジョブを実行するユーザー
+            title: 一覧表示用のタイトル
+            total_batches: 総バッチ数
+            run: ジョブ本体（JobControl経由で進捗・結果を記録する）
+        
+        Returns:
+            str: ジョブID
+        """
+        job = SummaryJob(job_id=uuid.uuid4().hex, owner=owner, title=title, total_batches=total_batches)
+        control = JobControl(job, self._write)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._controls[job.job_id] = control
+        control.save()
+        self._executor.submit(self._run, control, run)
+        return job.job_id
+    
+    def _run(self, control: JobControl, run: Callable[[JobControl], None]):
+        """ジョブ本体を実行し、終了状態を記録（ワーカースレッドで実行）"""
+        job = control.job
+        try:
+            if control.cancelled:
+                raise PipelineCancelled()
+            control.update(status=STATUS_RUNNING, started_at=time.time(), save=True)
+            run(control)
+            status = STATUS_CANCELLED if control.cancelled else STATUS_COMPLETED
+            control.update(status=status)
+        except PipelineCancelled:
+            control.update(status=STATUS_CANCELLED)
+        except Exception as e:
+            control.update(status=STATUS_CANCELLED if control.cancelled else STATUS_FAILED, error=str(e))
+        finally:
+            control.update(finished_at=time.time(), phase="", streaming={}, save=True)
+            with self._lock:
+                self._controls.pop(job.job_id, None)
+            self._prune()
+    
+    def get(self, job_id: str) -> Optional[SummaryJob]:
+        """
+        ジョブ記録を取得（実行中はメモリ上の記録、それ以外は保存済みの記録）
+        
+        Args:
+            job_id: ジョブID
+        
+        Returns:
+            Optional[SummaryJob]: ジョブ記録、存在しない場合はNone
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                job = SummaryJob.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        
+        # 実行中のままプロセスが終了した記録は失敗として扱う
+        if not job.is_finished:
+            job.status = STATUS_FAILED
+            job.error = job.error or "アプリの再起動により処理が中断されました"
+        with self._lock:
+            self._jobs.setdefault(job_id, job)
+        return job
+    
+    def list_jobs(self, owner: str) -> List[SummaryJob]:
+        """
+        ユーザーのジョブ記録を新しい順に取得
+        
+        Args:
+            owner: ユーザー
+        
+        Returns:
+            List[SummaryJob]: ジョブ記録のリスト
+        """
+        jobs = []
+        for path in self.directory.glob("*.json"):
+            job = self.get(path.stem)
+            if job is not None and job.owner == owner:
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+    
+    def cancel(self, job_id: str) -> bool:
+        """
+        実行中のジョブをキャンセル（通信中のAPI呼び出しも中断）
+        
+        Args:
+            job_id: ジョブID
+        
+        Returns:
+            bool: キャンセルを受け付けたらTrue
+        """
+        with self._lock:
+            control = self._controls.get(job_id)
+        if control is None:
+            return False
+        control.update(phase="中断しています...")
+        control.cancel()
+        return True
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager() -> JobManager:
+    """
+    要約ジョブ管理を取得（全セッション共通）
+    
+    保存先はSecretsの SUMMARY_JOB_DIR、同時実行数は SUMMARY_JOB_WORKERS、
+    保存件数は SUMMARY_JOB_HISTORY で変更可能
+    
+    Returns:
+        JobManager: ジョブ管理
+    """
+    directory = get_secret("SUMMARY_JOB_DIR") or DEFAULT_JOB_DIR
+    return JobManager(
+        Path(directory),
+        max_workers=get_secret_int("SUMMARY_JOB_WORKERS", 4),
+        history=get_secret_int("SUMMARY_JOB_HISTORY", 50)
+    )
@@ -0,0 +1,675 @@
+"""
+AI要約パイプラインモジュール
+バッチ要約（mapフェーズ）の並列実行・レート制限・リトライ処理と、処理段階ごとのモデル振り分け
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+
+import openai
+
+
+# ===== 定数定義 =====
+DEFAULT_MAX_RETRIES = 3  # 1バッチあたりの最大リトライ回数
+BACKOFF_BASE_SECONDS = 2.0  # 指数バックオフの初期待機秒数
+BACKOFF_MAX_SECONDS = 60.0  # 指数バックオフの最大待機秒数
+POLL_INTERVAL_SECONDS = 0.5  # 完了待ちのポーリング間隔
+
+
+class PipelineCancelled(Exception):
+    """処理の中断（ジョブのキャンセル）を表す例外"""
+
+
+class RateLimiter:
+    """
+    リクエスト数・トークン数の2つのバケットを持つトークンバケット型レート制限
+    
+    同一APIキーを使う全スレッド・全セッションで共有し、
+    429応答のretry-afterを受けた場合は全体の送信を一時停止する
+    """
+    
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        Args:
+            requests_per_minute: 1分あたりの最大リクエスト数
+            tokens_per_minute: 1分あたりの最大トークン数
+        """
+        self.requests_per_minute = max(1, requests_per_minute)
+        self.tokens_per_minute = max(1, tokens_per_minute)
+        self._request_bucket = float(self.requests_per_minute)
+        self._token_bucket = float(self.tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        """経過時間に応じてバケットを補充"""
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._request_bucket = min(
+            self.requests_per_minute,
+            self._request_bucket + elapsed * self.requests_per_minute / 60.0
+        )
+        self._token_bucket = min(
+            self.tokens_per_minute,
+            self._token_bucket + elapsed * self.tokens_per_minute / 60.0
+        )
+    
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        1リクエスト分とトークン分の枠を確保（枠が空くまでブロック）
+        
+        Args:
+            tokens: リクエストで消費する推定トークン数
+        
+        Returns:
+            float: 待機した秒数
+        """
+        # バケット容量を超える要求は永久に待たないよう容量で頭打ち
+        tokens = min(max(tokens, 0), self.tokens_per_minute)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait_seconds = self._blocked_until - now
+                if wait_seconds <= 0:
+                    if self._request_bucket >= 1 and self._token_bucket >= tokens:
+                        self._request_bucket -= 1
+                        self._token_bucket -= tokens
+                        return now - started
+                    wait_seconds = max(
+                        (1 - self._request_bucket) * 60.0 / self.requests_per_minute,
+                        (tokens - self._token_bucket) * 60.0 / self.tokens_per_minute,
+                    )
+            time.sleep(min(max(wait_seconds, 0.05), 1.0))
+    
+    def defer(self, seconds: float):
+        """
+        retry-after等を受けて、全体の送信を指定秒数停止
+        
+        Args:
+            seconds: 停止する秒数
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    APIエラーのレスポンスヘッダーからretry-after秒数を取得
+    
+    Args:
+        error: OpenAI APIの例外
+    
+    Returns:
+        Optional[float]: 待機秒数、ヘッダーが無い場合はNone
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            return float(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """レート制限エラー（429）かどうか判定"""
+    if isinstance(error, openai.RateLimitError):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    リトライで回復が見込めるエラーかどうか判定
+    （レート制限・タイムアウト・接続エラー・5xx）
+    """
+    if is_rate_limit_error(error):
+        return True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and status_code >= 500
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_MAX_SECONDS) -> float:
+    """
+    指数バックオフ+フルジッターの待機秒数を計算
+    
+    Args:
+        attempt: 何回目のリトライか（1から開始）
+        base: 初期待機秒数
+        cap: 最大待機秒数
+    
+    Returns:
+        float: 待機秒数
+    """
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def call_with_retry(
+    func: Callable[[], Any],
+    limiter: Optional[RateLimiter] = None,
+    estimated_tokens: int = 0,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    on_retry: Optional[Callable[[int, Exception, float], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None
+) -> Any:
+    """
+    レート制限の枠を確保してから関数を実行し、失敗時は指数バックオフでリトライ
+    
+    Args:
+        func: 実行する関数（API呼び出し）
+        limiter: 共有レート制限（Noneなら制限なし）
+        estimated_tokens: 1回の呼び出しで消費する推定トークン数
+        max_retries: 最大リトライ回数
+        on_retry: リトライ時のコールバック（リトライ回数, 例外, 待機秒数）
+        should_stop: Trueを返すと呼び出し前・リトライ待機中に中断
+    
+    Returns:
+        Any: funcの戻り値
+    
+    Raises:
+        PipelineCancelled: should_stopで中断された場合（通信中に接続を閉じられた場合も含む）
+        Exception: リトライ不能なエラー、またはリトライ上限に達した場合
+    """
+    def stopped() -> bool:
+        return should_stop is not None and should_stop()
+    
+    attempt = 0
+    while True:
+        if stopped():
+            raise PipelineCancelled()
+        if limiter is not None:
+            limiter.acquire(estimated_tokens)
+        try:
+            return func()
+        except Exception as e:
+            if stopped():
+                raise PipelineCancelled() from e
+            attempt += 1
+            if attempt > max_retries or not is_retryable_error(e):
+                raise
+            
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                # サーバー指定の待機時間は全スレッドで共有
+                if limiter is not None and is_rate_limit_error(e):
+                    limiter.defer(retry_after)
+                delay = retry_after + random.uniform(0, 1.0)
+            else:
+                delay = backoff_delay(attempt)
+            
+            if on_retry is not None:
+                on_retry(attempt, e, delay)
+            # 待機中も中断を受け付ける
+            wait_until = time.monotonic() + delay
+            while not stopped() and time.monotonic() < wait_until:
+                time.sleep(max(0.0, min(POLL_INTERVAL_SECONDS, wait_until - time.monotonic())))
+
+
+@dataclass
+class MapPhaseResult:
+    """mapフェーズ（バッチ要約）の実行結果"""
+    results: List[Optional[str]]  # バッチ順の結果（失敗時はNone）
+    batch_times: List[float]  # バッチごとの処理時間（秒）
+    errors: dict = field(default_factory=dict)  # バッチ番号 → エラーメッセージ
+    retries: int = 0  # 全バッチ合計のリトライ回数
+    wall_time: float = 0.0  # mapフェーズ全体の経過時間（秒）
+    stopped: bool = False  # 中断されたか
+    cached: int = 0  # キャッシュから再利用したバッチ数
+
+
+def run_map_phase(
+    func: Callable[[int], Optional[str]],
+    total_batches: int,
+    limiter: Optional[RateLimiter] = None,
+    estimate_tokens: Optional[Callable[[int], int]] = None,
+    max_workers: int = 4,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    on_progress: Optional[Callable[[int, int, int, bool], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    on_tick: Optional[Callable[[], None]] = None,
+    precomputed: Optional[dict] = None
+) -> MapPhaseResult:
+    """
+    バッチ要約をスレッドプールで並列実行
+    
+    進捗コールバックは呼び出し元スレッドから呼ばれるため、
+    Streamlitの描画処理をそのまま記述できる
+    
+    Args:
+        func: バッチ番号（0から開始）を受け取り要約結果を返す関数
+        total_batches: 総バッチ数
+        limiter: 共有レート制限
+        estimate_tokens: バッチ番号から推定トークン数を返す関数
+        max_workers: 同時実行数の上限
+        max_retries: 1バッチあたりの最大リトライ回数
+        on_progress: 進捗コールバック（完了数, 総数, 完了したバッチ番号, 成功したか）
+        should_stop: Trueを返すと未着手のバッチを取り消して終了
+        on_tick: ポーリング間隔ごとのコールバック（ストリーミング中の途中経過表示用）
+        precomputed: 実行済みとして扱うバッチ番号 → 結果（キャッシュ済みのバッチ）
+    
+    Returns:
+        MapPhaseResult: 実行結果
+    """
+    result = MapPhaseResult(
+        results=[None] * total_batches,
+        batch_times=[0.0] * total_batches,
+    )
+    precomputed = precomputed or {}
+    result.cached = len(precomputed)
+    for batch_idx, cached in precomputed.items():
+        result.results[batch_idx] = cached
+    retry_lock = threading.Lock()
+    
+    def count_retry(attempt, error, delay):
+        with retry_lock:
+            result.retries += 1
+    
+    def run_batch(batch_idx: int):
+        batch_start = time.time()
+        try:
+            return call_with_retry(
+                lambda: func(batch_idx),
+                limiter=limiter,
+                estimated_tokens=estimate_tokens(batch_idx) if estimate_tokens else 0,
+                max_retries=max_retries,
+                on_retry=count_retry,
+                should_stop=should_stop,
+            )
+        finally:
+            result.batch_times[batch_idx] = time.time() - batch_start
+    
+    started = time.time()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="summary-map")
+    try:
+        pending = {
+            executor.submit(run_batch, i): i for i in range(total_batches) if i not in precomputed
+        }
+        completed = len(precomputed)
+        while pending:
+            if should_stop is not None and should_stop():
+                result.stopped = True
+                break
+            
+            done, _ = wait(pending, timeout=POLL_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+            if on_tick is not None:
+                on_tick()
+            for future in done:
+                batch_idx = pending.pop(future)
+                completed += 1
+                try:
+                    result.results[batch_idx] = future.result()
+                except Exception as e:
+                    result.errors[batch_idx] = str(e)
+                if on_progress is not None:
+                    on_progress(completed, total_batches, batch_idx, result.results[batch_idx] is not None)
+    finally:
+        # 中断・スクリプト停止時は未着手のバッチを取り消す
+        executor.shutdown(wait=False, cancel_futures=True)
+        result.wall_time = time.time() - started
+    
+    return result
+
+
+def estimate_request_tokens(prompt: str, max_completion_tokens: int = 2048) -> int:
+    """
+    レート制限用にリクエストの消費トークン数を概算
+    （日本語主体のため1文字≒1トークンとして安全側に見積もる）
+    
+    Args:
+        prompt: 送信するプロンプト
+        max_completion_tokens: 出力トークン数の上限
+    
+    Returns:
+        int: 推定トークン数
+    """
+    return len(prompt) + max_completion_tokens
+
+
+def group_by_token_budget(texts: List[str], token_counts: List[int], token_budget: int) -> List[List[int]]:
+    """
+    隣接するテキストをトークン予算内に収まるようにグループ化（並び順は維持）
+    
+    Args:
+        texts: テキストのリスト
+        token_counts: 各テキストのトークン数
+        token_budget: 1グループあたりのトークン予算
+    
+    Returns:
+        List[List[int]]: グループごとのインデックスのリスト
+    """
+    groups = []
+    current, current_tokens = [], 0
+    for idx in range(len(texts)):
+        tokens = token_counts[idx]
+        if current and current_tokens + tokens > token_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+@dataclass
+class ReduceResult:
+    """多段統合（reduceフェーズ）の実行結果"""
+    summaries: List[str]  # 最終統合に渡す中間要約
+    levels: int = 0  # 実行した中間統合の段数
+    calls: int = 0  # 中間統合のAPI呼び出し回数
+    retries: int = 0  # 中間統合のリトライ回数
+    wall_time: float = 0.0  # 中間統合全体の経過時間（秒）
+    stopped: bool = False  # 中断されたか
+
+
+def run_tree_reduce(
+    summaries: List[str],
+    merge: Callable[[List[str], int], Optional[str]],
+    count_tokens: Callable[[str], int],
+    token_budget: int,
+    limiter: Optional[RateLimiter] = None,
+    estimate_tokens: Optional[Callable[[List[str]], int]] = None,
+    max_workers: int = 4,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    should_stop: Optional[Callable[[], bool]] = None,
+    on_level: Optional[Callable[[int, int, int], None]] = None,
+    on_tick: Optional[Callable[[], None]] = None
+) -> ReduceResult:
+    """
+    バッチ要約をトークン予算内に収まるまで段階的に統合（同じ段のグループは並列実行）
+    
+    各段では隣接する要約をトークン予算内でまとめて1つに統合する。
+    全要約の合計が予算内に収まった時点で終了し、最終統合は呼び出し元で行う
+    
+    Args:
+        summaries: バッチ要約のリスト（バッチ順）
+        merge: 統合する要約リストと段数（1から開始）を受け取り統合結果を返す関数
+        count_tokens: テキストのトークン数を返す関数
+        token_budget: 1回の統合呼び出しに含める要約のトークン予算
+        limiter: 共有レート制限
+        estimate_tokens: 統合する要約リストからレート制限用の推定トークン数を返す関数
+        max_workers: 同時実行数の上限
+        max_retries: 1グループあたりの最大リトライ回数
+        should_stop: Trueを返すと中断
+        on_level: 段の開始時コールバック（段数, グループ数, 要約数）
+        on_tick: ポーリング間隔ごとのコールバック
+    
+    Returns:
+        ReduceResult: 実行結果
+    """
+    result = ReduceResult(summaries=list(summaries))
+    started = time.time()
+    
+    while len(result.summaries) > 1:
+        token_counts = [count_tokens(s) for s in result.summaries]
+        if sum(token_counts) <= token_budget:
+            break
+        
+        groups = group_by_token_budget(result.summaries, token_counts, token_budget)
+        # 1要約だけで予算を超えるなどで統合が進まない場合は打ち切り
+        if len(groups) >= len(result.summaries):
+            break
+        
+        level = result.levels + 1
+        if on_level is not None:
+            on_level(level, len(groups), len(result.summaries))
+        
+        group_texts = [[result.summaries[i] for i in group] for group in groups]
+        # 1要約だけのグループは統合せずにそのまま次の段へ
+        precomputed = {g: texts[0] for g, texts in enumerate(group_texts) if len(texts) == 1}
+        
+        level_result = run_map_phase(
+            lambda g: merge(group_texts[g], level),
+            len(group_texts),
+            limiter=limiter,
+            estimate_tokens=(lambda g: estimate_tokens(group_texts[g])) if estimate_tokens else None,
+            max_workers=max_workers,
+            max_retries=max_retries,
+            should_stop=should_stop,
+            on_tick=on_tick,
+            precomputed=precomputed
+        )
+        result.calls += len(group_texts) - len(precomputed)
+        result.retries += level_result.retries
+        result.levels = level
+        
+        if level_result.stopped:
+            result.stopped = True
+            break
+        
+        # 統合に失敗したグループは元の要約をそのまま残す
+        merged = []
+        for g, texts in enumerate(group_texts):
+            if level_result.results[g]:
+                merged.append(level_result.results[g])
+            else:
+                merged.extend(texts)
+        if len(merged) >= len(result.summaries):
+            break
+        result.summaries = merged
+    
+    result.wall_time = time.time() - started
+    return result
+
+
+def run_split_merge(
+    summaries: List[str],
+    groups: List[List[int]],
+    merge: Callable[[List[str], int], Optional[str]],
+    limiter: Optional[RateLimiter] = None,
+    estimate_tokens: Optional[Callable[[List[str]], int]] = None,
+    max_workers: int = 4,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    should_stop: Optional[Callable[[], bool]] = None,
+    on_tick: Optional[Callable[[], None]] = None
+) -> ReduceResult:
+    """
+    自治体単位のバッチ要約で、同じ自治体を分け合うバッチだけを1回ずつ統合（グループ同士は並列実行）
+    
+    自治体を丸ごと受け持つバッチの要約は統合せずにそのまま残すため、多段統合は行わない
+    
+    Args:
+        summaries: バッチ要約のリスト（バッチ順）
+        groups: バッチ番号のグループ（batch_packer.find_split_groups の結果）
+        merge: 統合する要約リストと段数（常に1）を受け取り統合結果を返す関数
+        limiter: 共有レート制限
+        estimate_tokens: 統合する要約リストからレート制限用の推定トークン数を返す関数
+        max_workers: 同時実行数の上限
+        max_retries: 1グループあたりの最大リトライ回数
+        should_stop: Trueを返すと中断
+        on_tick: ポーリング間隔ごとのコールバック
+    
+    Returns:
+        ReduceResult: 実行結果（summariesはグループ順、統合に失敗したグループは元の要約を残す）
+    """
+    result = ReduceResult(summaries=list(summaries))
+    started = time.time()
+    group_texts = [[summaries[i] for i in group if summaries[i]] for group in groups]
+    group_texts = [texts for texts in group_texts if texts]
+    precomputed = {g: texts[0] for g, texts in enumerate(group_texts) if len(texts) == 1}
+    if len(precomputed) == len(group_texts):
+        result.summaries = [texts[0] for texts in group_texts]
+        return result
+    
+    merge_result = run_map_phase(
+        lambda g: merge(group_texts[g], 1),
+        len(group_texts),
+        limiter=limiter,
+        estimate_tokens=(lambda g: estimate_tokens(group_texts[g])) if estimate_tokens else None,
+        max_workers=max_workers,
+        max_retries=max_retries,
+        should_stop=should_stop,
+        on_tick=on_tick,
+        precomputed=precomputed
+    )
+    result.calls = len(group_texts) - len(precomputed)
+    result.retries = merge_result.retries
+    result.levels = 1
+    result.stopped = merge_result.stopped
+    
+    merged = []
+    for g, texts in enumerate(group_texts):
+        if merge_result.results[g]:
+            merged.append(merge_result.results[g])
+        else:
+            merged.extend(texts)
+    result.summaries = merged
+    result.wall_time = time.time() - started
+    return result
+
+
+def fit_to_token_budget(texts: List[str], count_tokens: Callable[[str], int], token_budget: int) -> List[str]:
+    """
+    テキストの合計がトークン予算に収まるよう、各テキストをトークン数に比例して末尾から切り詰める
+    
+    Args:
+        texts: テキストのリスト
+        count_tokens: テキストのトークン数を返す関数
+        token_budget: 合計のトークン予算
+    
+    Returns:
+        List[str]: 切り詰めたテキストのリスト（予算内なら元のまま）
+    """
+    token_counts = [count_tokens(text) for text in texts]
+    total = sum(token_counts)
+    if total <= token_budget:
+        return list(texts)
+    ratio = token_budget / total
+    return [text[:int(len(text) * ratio)] for text in texts]
+
+
+# ===== 処理段階ごとのモデル振り分け =====
+PHASE_MAP = "バッチ"  # バッチ要約（map）
+PHASE_MERGE = "中間統合"  # 多段統合（reduce）
+PHASE_INTEGRATION = "統合"  # 最終統合（reduce）
+DEFAULT_LATENCY_WINDOW = 4  # 遅延の判定に使う直近の呼び出し数
+MIN_LATENCY_SAMPLES = 2  # 遅延で切り替えるのに必要な呼び出し数
+
+
+class ModelRouter:
+    """
+    処理段階ごとの使用モデルの振り分け
+    
+    抽出が中心のバッチ要約は軽量モデル、統合は高性能モデルのように段階ごとにモデルを割り当てる。
+    段階ごとに直近の所要時間の平均が遅延予算を超えた場合、またはレート制限エラーの回数が
+    予算に達した場合は、その段階の以降の呼び出しを高速なフォールバックモデルに切り替える（実行中は戻さない）
+    """
+    
+    def __init__(
+        self,
+        routes: dict,
+        fallback_model: str = "",
+        latency_budget: float = 0.0,
+        rate_limit_budget: int = 0,
+        window: int = DEFAULT_LATENCY_WINDOW
+    ):
+        """
+        Args:
+            routes: 処理段階 → モデル名
+            fallback_model: 予算超過時に切り替えるモデル（空文字なら切り替えない）
+            latency_budget: 1回の呼び出しの所要時間の予算（秒、0なら判定しない）
+            rate_limit_budget: 段階ごとに許容するレート制限エラーの回数（0なら判定しない）
+            window: 遅延の判定に使う直近の呼び出し数
+        """
+        self.routes = dict(routes)
+        self.fallback_model = fallback_model
+        self.latency_budget = latency_budget
+        self.rate_limit_budget = rate_limit_budget
+        self.window = max(1, window)
+        self._active = dict(routes)
+        self._latencies = {}
+        self._rate_limits = {}
+        self._fallbacks = []
+        self._lock = threading.Lock()
+    
+    def model_for(self, phase: str) -> str:
+        """
+        処理段階で現在使用するモデルを取得
+        
+        Args:
+            phase: 処理段階
+        
+        Returns:
+            str: モデル名
+        """
+        with self._lock:
+            return self._active[phase]
+    
+    def record(self, phase: str, model: str, latency: Optional[float] = None, error: Optional[Exception] = None):
+        """
+        呼び出し結果を記録し、予算を超えていればフォールバックモデルに切り替え
+        
+        Args:
+            phase: 処理段階
+            model: 呼び出しに使ったモデル
+            latency: 所要時間（秒、成功時のみ）
+            error: 発生したエラー（成功時はNone）
+        """
+        with self._lock:
+            # 切り替え後の呼び出しや、切り替え前に開始した呼び出しの結果は判定に使わない
+            if model != self._active.get(phase) or model == self.fallback_model:
+                return
+            
+            reason = ""
+            if error is not None:
+                if is_rate_limit_error(error):
+                    count = self._rate_limits.get(phase, 0) + 1
+                    self._rate_limits[phase] = count
+                    if self.rate_limit_budget and count >= self.rate_limit_budget:
+                        reason = f"レート制限エラー {count}回"
+            elif latency is not None:
+                latencies = self._latencies.setdefault(phase, [])
+                latencies.append(latency)
+                del latencies[:-self.window]
+                average = sum(latencies) / len(latencies)
+                if (
+                    self.latency_budget
+                    and len(latencies) >= min(MIN_LATENCY_SAMPLES, self.window)
+                    and average > self.latency_budget
+                ):
+                    reason = f"平均所要時間 {average:.0f}秒 > 予算{self.latency_budget:.0f}秒"
+            
+            if reason and self.fallback_model:
+                self._active[phase] = self.fallback_model
+                self._fallbacks.append({
+                    "phase": phase,
+                    "from": model,
+                    "to": self.fallback_model,
+                    "reason": reason,
+                    "at": time.time(),
+                })
+    
+    @property
+    def fallbacks(self) -> List[dict]:
+        """発生した切り替えの記録（処理段階, 切り替え前後のモデル, 理由）"""
+        with self._lock:
+            return list(self._fallbacks)
+    
+    def describe(self) -> str:
+        """
+        段階ごとの使用モデルを表示用の文字列に整形
+        
+        Returns:
+            str: 段階ごとのモデルと切り替えの記録
+        """
+        text = " / ".join(f"{phase}: {model}" for phase, model in self.routes.items())
+        for fallback in self.fallbacks:
+            text += f"（{fallback['phase']}を{fallback['to']}に切り替え: {fallback['reason']}）"
+        return text
@@ -5,6 +5,7 @@ DataFrameの整形とピボットテーブルの生成
 
 import datetime
 import pandas as pd
+from tracing import traced
 
 
 def fmt_month_from_epoch(v) -> str:
@@ -39,6 +40,7 @@ def cat_short_map(catmap: pd.DataFrame) -> dict:
     return catmap.set_index("category")["short_name"].to_dict()
 
 
+@traced()
 def build_counts_table(
     df: pd.DataFrame,
     jichitai: pd.DataFrame,
@@ -242,6 +244,7 @@ def build_counts_table(
         return pvt
 
 
+@traced()
 def build_latest_table(
     df: pd.DataFrame,
     jichitai: pd.DataFrame,
@@ -7,16 +7,280 @@ import time
 import streamlit as st
 import pandas as pd
 from elasticsearch import Elasticsearch
-from config import get_secret
-from data_fetcher import fetch_search_results
-from openai_helper import get_openai_client, generate_summary
-from prompt import get_summary_prompt, get_custom_prompt, get_custom_batch_prompt, get_custom_integration_prompt
+from config import FIELD_CODE, get_secret
+from data_fetcher import _qkey, fetch_counts, fetch_kpi, fetch_sample_results, fetch_search_results, plan_group_sample
+from openai_helper import (
+    CallStats,
+    build_model_router,
+    get_batch_token_budget,
+    get_openai_client,
+    get_phase_models,
+    get_rate_limiter,
+    stream_summary,
+    summarize_call_stats,
+)
+from summary_pipeline import (
+    PHASE_INTEGRATION,
+    PHASE_MAP,
+    PHASE_MERGE,
+    PipelineCancelled,
+    run_map_phase,
+    run_tree_reduce,
+    run_split_merge,
+    fit_to_token_budget,
+    call_with_retry,
+    estimate_request_tokens,
+)
+from llm_telemetry import format_routing_savings, format_usage_report, get_telemetry_store
+from auth import is_operator
+from summary_jobs import (
+    STATUS_CANCELLED,
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+    STATUS_LABELS,
+    JobControl,
+    JobManager,
+    SummaryJob,
+    get_job_manager,
+)
+from batch_packer import find_split_groups, pack_batches, pack_batches_by_entity
+from llm_cache import get_llm_cache, make_cache_key
+from token_counter import count_tokens
+from dedup import cluster_near_duplicates, deduplicate_documents
+from compressor import CompressionResult, compress_texts
+from query_builder import extract_query_keywords
+from prompt import (
+    PROMPT_VERSION,
+    format_document,
+    get_prompt_cache_key,
+    get_summary_prompt,
+    get_custom_prompt,
+    get_custom_batch_prompt,
+    get_custom_integration_prompt,
+    get_summary_integration_prompt,
+    get_merge_prompt,
+    get_entity_batch_prompt,
+    get_overview_prompt,
+)
 
 
 # ===== 定数定義 =====
-MAX_DOCS_FOR_SUMMARY = 1000  # 最大文書数
-BATCH_SIZE = 100  # 1バッチあたりの文書数
+MAX_DOCS_FOR_SUMMARY = 10000  # 最大文書数
 MAX_CHARS_PER_DOC = 800  # 本文の最大文字数
+SELECTION_MODES = ["スコア上位", "自治体・カテゴリごとに代表を抽出"]  # 要約対象の選び方
+SAMPLE_SIZE_OPTIONS = [500, 1000, 2000, 5000, 10000]  # 代表を抽出する場合の件数の選択肢
+DEFAULT_SAMPLE_SIZE = 2000  # 代表を抽出する場合の既定の件数
+COMPRESSED_CHARS_PER_DOC = 400  # 抽出型圧縮を行う場合の本文の文字数予算
+BATCHING_MODES = ["トークン予算で詰める", "自治体単位（統合は連結）"]  # バッチの分け方
+MAX_CONCURRENT_BATCHES = 4  # 同時に処理するバッチ数の上限
+MAX_RETRIES = 3  # 1バッチあたりの最大リトライ回数
+STREAM_PREVIEW_CHARS = 200  # 生成途中テキストの表示文字数
+JOB_POLL_INTERVAL = 1.0  # 実行中ジョブの進捗表示の更新間隔（秒）
+
+
+def _format_stream_report(label: str, stream_stats: dict) -> str:
+    """
+    ストリーミング計測値を表示用の文字列に整形
+    
+    Args:
+        label: 呼び出しの種別（バッチ / 統合）
+        stream_stats: summarize_call_statsの集計結果
+    
+    Returns:
+        str: 初回トークンまでの時間と生成速度
+    """
+    ttft = stream_stats.get("avg_ttft")
+    speed = stream_stats.get("avg_tokens_per_second")
+    ttft_text = f"{ttft:.1f}秒" if ttft is not None else "―"
+    speed_text = f"{speed:.0f} tokens/秒" if speed is not None else "―"
+    return f"{label}: 初回トークンまで平均{ttft_text}・生成速度 平均{speed_text}（{stream_stats.get('calls', 0)}回）"
+
+
+def _format_batch_details(completed_batches: list, batch_ranges: list) -> str:
+    """
+    バッチごとの要約結果をダウンロード用のテキストに整形
+    
+    Args:
+        completed_batches: （バッチ番号, 要約結果）のリスト
+        batch_ranges: バッチごとの文書番号の範囲
+    
+    Returns:
+        str: 整形済みテキスト
+    """
+    content = ""
+    for batch_idx, result in completed_batches:
+        start_idx, end_idx = batch_ranges[batch_idx]
+        content += f"""### バッチ{batch_idx + 1}（文書{start_idx}-{end_idx}件）
+
+{result}
+
+---
+
+"""
+    return content
+
+
+def _render_job_progress(job_manager: JobManager, job_id: str):
+    """
+    実行中の要約ジョブの進捗を表示（st.fragmentで定期的に再描画）
+    
+    Args:
+        job_manager: ジョブ管理
+        job_id: ジョブID
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return
+    if job.is_finished:
+        # 終了したら画面全体を再描画して結果を表示（定期的な再描画も止まる）
+        st.rerun()
+    
+    st.markdown(f"### 🔄 {job.report.get('mode', '要約')}を実行中...")
+    if job.report.get("instruction"):
+        st.info(f"**あなたの指示:** {job.report['instruction']}")
+    
+    progress = job.completed_batches / job.total_batches if job.total_batches else 0.0
+    st.progress(min(progress, 1.0))
+    st.markdown(
+        f"**進捗: {int(progress * 100)}% ({job.completed_batches}/{job.total_batches}バッチ) - "
+        f"{job.phase or STATUS_LABELS.get(job.status, job.status)}**"
+    )
+    
+    # 処理中の呼び出しの生成途中テキストを末尾だけ表示
+    active = list(dict(job.streaming).items())
+    if active:
+        st.markdown("\n\n".join(
+            f"**{label} 生成中:** …{text[-STREAM_PREVIEW_CHARS:]}▌"
+            for label, text in active
+        ))
+    
+    st.caption("処理はバックグラウンドで続行されます。画面を操作しても中断されません。")
+    if st.button("⏹️ 中断", key="cancel_summary_job"):
+        job_manager.cancel(job_id)
+        st.info("中断を要求しました。処理中のAPI呼び出しを停止しています...")
+
+
+def _render_finished_job(job: SummaryJob):
+    """
+    終了した要約ジョブの結果を表示（ジョブ記録から表示するため再計算はしない）
+    
+    Args:
+        job: ジョブ記録
+    """
+    report = job.report
+    if job.status == STATUS_COMPLETED and job.final_summary:
+        st.markdown("# 🎯 最終統合結果")
+        st.markdown(job.final_summary)
+        
+        # 完了情報
+        processing_time = report.get('processing_time', 0)
+        st.success(f"""
+        ✅ {report.get('mode', '要約')}が完了しました
+        
+        - 処理済み: {report.get('total_docs', 0)}件（{report.get('batch_count', 0)}バッチ + 統合1回）
+        - 要約対象の選び方: {report.get('sampling_report', '―')}
+        - 重複除去: {report.get('dedup_report', '―')}
+        - 本文の圧縮: {report.get('compression_report', '―')}
+        - バッチの分け方: {report.get('batching_report', '―')}
+        - 処理時間: {processing_time // 60:.0f}分{processing_time % 60:.0f}秒
+        - 実測と推定: {report.get('time_report', '―')}
+        - ストリーミング計測: {report.get('stream_report', '―')}
+        - トークン・コスト: {report.get('usage_report', '―')}
+        - 使用モデル: {report.get('model_report', '―')}
+        - モデル振り分けの効果: {report.get('routing_report', '―')}
+        """)
+        
+        if report.get("phase_usage"):
+            with st.expander("📊 処理段階・モデルごとの内訳"):
+                st.dataframe(pd.DataFrame(report["phase_usage"]), hide_index=True, use_container_width=True)
+                st.caption("基準モデル: 統合に使用したモデルで全段階を実行した場合（時間は段階ごとの実測履歴の平均から換算）")
+        
+        # ダウンロードボタン
+        col1, col2, col3 = st.columns([2, 2, 4])
+        with col1:
+            st.download_button(
+                label="📥 完全版をダウンロード",
+                data=job.download_content,
+                file_name=f"summary_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                mime="text/plain",
+                key="download_full_persistent"
+            )
+        with col2:
+            st.download_button(
+                label="📊 統合結果のみダウンロード",
+                data=job.final_summary,
+                file_name=f"summary_final_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                mime="text/plain",
+                key="download_final_persistent"
+            )
+        return
+    
+    if job.status == STATUS_CANCELLED:
+        st.warning("⚠️ ユーザーによって処理が中断されました。")
+    else:
+        st.error(f"⚠️ 要約処理でエラーが発生しました: {job.error}")
+    
+    for batch_idx, error_str in sorted(job.batch_errors.items()):
+        st.error(f"❌ バッチ{batch_idx + 1}の処理に失敗しました: {error_str}")
+    
+    if not job.batch_results:
+        return
+    
+    if job.status == STATUS_FAILED:
+        st.warning("""
+        各バッチの分析結果は正常に取得できています。
+        以下の対処法をお試しください:
+        
+        1. 各バッチ結果を確認する（統合なしでも有用な情報が含まれています）
+        2. カスタムプロンプトをより簡潔にして再実行
+        3. 対象文書数を減らして再実行
+        """)
+    else:
+        st.info(f"中断までに完了した{len(job.batch_results)}/{job.total_batches}バッチの結果をダウンロードできます。")
+    
+    # 統合前に終了した場合はジョブ記録のバッチ結果からダウンロード内容を作成
+    download_content = job.download_content or "# バッチ処理結果（途中結果）\n\n" + _format_batch_details(
+        sorted(job.batch_results.items()),
+        report.get("batch_ranges", [])
+    )
+    st.download_button(
+        label="📥 バッチ結果をダウンロード",
+        data=download_content,
+        file_name=f"summary_batches_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain",
+        key="download_partial_summary"
+    )
+
+
+@st.cache_data(show_spinner=False)
+def _cluster_documents(texts: tuple, group_keys: tuple) -> list:
+    """
+    類似文書のクラスタリング結果をキャッシュ（再描画のたびに署名を計算しないように）
+    
+    Args:
+        texts: 本文のタプル
+        group_keys: 文書ごとの団体コードのタプル
+    
+    Returns:
+        list: 文書ごとの代表文書のインデックス
+    """
+    return cluster_near_duplicates(list(texts), group_keys=list(group_keys))
+
+
+@st.cache_data(show_spinner=False)
+def _compress_documents(texts: tuple, keywords: tuple, chars_per_doc: int) -> CompressionResult:
+    """
+    本文の抽出型圧縮の結果をキャッシュ（再描画のたびに採点しないように）
+    
+    Args:
+        texts: 本文のタプル
+        keywords: 検索語のタプル
+        chars_per_doc: 1文書あたりの文字数予算
+    
+    Returns:
+        CompressionResult: 圧縮結果（処理時間は初回計算時の値）
+    """
+    return compress_texts(list(texts), list(keywords), chars_per_doc)
 
 
 def render_summary_tab(
@@ -24,7 +288,8 @@ def render_summary_tab(
     query: dict,
     jichitai: pd.DataFrame,
     catmap: pd.DataFrame,
-    result_limit: int
+    result_limit: int,
+    total_hits: int = None
 ):
     """
     AI要約タブの表示（バッチ処理+ストリーミング対応）
@@ -35,6 +300,7 @@ def render_summary_tab(
         jichitai: 自治体マスターデータ
         catmap: カテゴリマスターデータ
         result_limit: 表示件数上限
+        total_hits: 検索結果の総件数（省略時は取得する）
     """
     st.subheader("🤖 GPT による要約")
     
@@ -49,7 +315,65 @@ def render_summary_tab(
         st.warning("まず検索条件を設定してください。")
         return
     
-    df_results = fetch_search_results(es, query, jichitai, catmap, result_limit)
+    # ===== 要約対象の選び方 =====
+    # 総件数が取得上限を超える場合は、スコア上位だけでなく自治体・カテゴリごとの代表を抽出できる
+    if total_hits is None:
+        total_hits = fetch_kpi(es, query)["total_pages"]
+    fetch_limit = min(result_limit, MAX_DOCS_FOR_SUMMARY)
+    sampling = False
+    if total_hits > fetch_limit:
+        selection_mode = st.radio(
+            "要約対象の選び方",
+            SELECTION_MODES,
+            index=1,
+            horizontal=True,
+            help=f"検索結果が{total_hits:,}件あり、上限{fetch_limit:,}件を超えています。"
+                 "スコア上位: 一致度の高い順に上限まで取得します（特定の自治体に偏ることがあります）。"
+                 "代表を抽出: 自治体×カテゴリごとにスコア上位の文書を均等に取得し、すべての自治体をカバーします。"
+        )
+        sampling = selection_mode == SELECTION_MODES[1]
+    
+    # 本文は検索語周辺のハイライト断片から作成した抜粋を取得（本文全体は取得しない）
+    sampling_report = "なし"
+    if sampling:
+        sample_size = st.select_slider(
+            "抽出する件数",
+            options=[size for size in SAMPLE_SIZE_OPTIONS if size <= MAX_DOCS_FOR_SUMMARY],
+            value=DEFAULT_SAMPLE_SIZE
+        )
+        # グループごとの件数（件数タブと共通のキャッシュ）から1グループあたりの件数を決め、その分だけ取得
+        df_counts = fetch_counts(es, _qkey(query), FIELD_CODE, False)
+        group_fields = (FIELD_CODE, "category")
+        sample_query = query
+        selection_note = ""
+        per_group = plan_group_sample(df_counts["page_docs"].tolist(), sample_size)
+        if per_group == 0:
+            # 自治体×カテゴリの数が抽出件数を超える場合は自治体ごとに抽出
+            group_fields = (FIELD_CODE,)
+            group_totals = df_counts.groupby("g")["page_docs"].sum()
+            per_group = plan_group_sample(group_totals.tolist(), sample_size)
+            if per_group == 0:
+                # 自治体の数も抽出件数を超える場合は、団体コード順（都道府県順）に等間隔で選んだ抽出件数分の自治体から1件ずつ
+                codes = sorted(group_totals[group_totals > 0].index)
+                step = len(codes) / sample_size
+                sample_codes = [codes[int(i * step)] for i in range(sample_size)]
+                sample_query = {"bool": {"must": [query], "filter": [{"terms": {FIELD_CODE: sample_codes}}]}}
+                per_group = 1
+                selection_note = f"自治体が抽出件数より多いため{len(codes):,}自治体から{sample_size:,}自治体を均等に選択、"
+        df_results = fetch_sample_results(
+            es, sample_query, jichitai, catmap, per_group, group_fields, excerpt_chars=MAX_CHARS_PER_DOC
+        )
+        covered_pairs = len(df_results[["団体コード", "資料カテゴリ"]].drop_duplicates()) if not df_results.empty else 0
+        sampling_report = (
+            f"全{total_hits:,}件から{len(df_results):,}件を抽出"
+            f"（自治体 {df_results['団体コード'].nunique() if not df_results.empty else 0:,}/{df_counts['g'].nunique():,}、"
+            f"自治体×カテゴリ {covered_pairs:,}/{len(df_counts):,}、{selection_note}"
+            f"{'自治体×カテゴリ' if len(group_fields) == 2 else '自治体'}ごとにスコア上位{per_group}件まで）"
+        )
+    else:
+        df_results = fetch_search_results(es, query, jichitai, catmap, fetch_limit, excerpt_chars=MAX_CHARS_PER_DOC)
+        if total_hits > fetch_limit:
+            sampling_report = f"全{total_hits:,}件のうちスコア上位{len(df_results):,}件"
     
     if df_results.empty:
         st.warning("要約する検索結果がありません。検索条件を設定してください。")
@@ -61,20 +385,38 @@ def render_summary_tab(
         return
     
     st.info(f"📊 要約対象: {total_docs}件のドキュメント")
+    if sampling_report != "なし":
+        st.caption(f"🎯 要約対象の選び方: {sampling_report}")
     
     # モデル選択
     model_options = {
         "GPT-4o mini": "gpt-4o-mini",
+        "GPT-4o": "gpt-4o",
     }
     
     selected_model_name = st.selectbox(
         "使用するモデル",
         options=list(model_options.keys()),
         index=0,
-        help="GPT-4o miniで検証中です。"
+        help="GPT-4o mini: 高速・低コスト。GPT-4o: 統合・分析の品質を重視する場合に選択（処理時間・コストが増えます）。"
+             "バッチ要約を軽量モデルで実行する場合、選択したモデルは統合にのみ使用します。"
     )
     selected_model = model_options[selected_model_name]
     
+    # 処理段階ごとのモデル振り分け（抽出中心のバッチ要約は軽量モデル、統合は選択したモデル）
+    # 既定ではすべての段階で選択したモデルを使い、Secretsで SUMMARY_MAP_MODEL を設定した場合のみ既定で有効にする
+    tiered_routing = st.checkbox(
+        "バッチ要約は軽量モデルで実行する",
+        value=bool(get_secret("SUMMARY_MAP_MODEL")),
+        help="各バッチの抽出は軽量・高速なモデルで行い、統合のみ選択したモデルで行います。"
+             "応答が遅い場合やレート制限が続く場合は、自動的に高速なモデルに切り替えます。"
+    )
+    phase_models = get_phase_models(selected_model, tiered_routing)
+    map_model = phase_models[PHASE_MAP]
+    reduce_model = phase_models[PHASE_MERGE]
+    if map_model != reduce_model:
+        st.caption(f"🔀 バッチ要約: {map_model} / 統合: {reduce_model}")
+    
     # 要約モード選択
     summary_mode = st.radio(
         "要約モード",
@@ -91,14 +433,190 @@ def render_summary_tab(
             height=100
         )
     
+    dedup_enabled = st.checkbox(
+        "類似ページをまとめて送信する",
+        value=True,
+        help="同じ自治体の年度違いの計画や繰り返しページなど、本文がほぼ同じページは代表1件だけを送信し、件数を注記します。"
+    )
+    
+    compress_enabled = st.checkbox(
+        "本文を重要な文に絞って送信する",
+        value=False,
+        help=f"検索語を含む文・他の文書と比べて特徴的な文・冒頭の文を優先し、1件あたり{COMPRESSED_CHARS_PER_DOC}文字以内に圧縮してから送信します。"
+             "トークン数とバッチ数が減り、処理時間・コストを削減できます。"
+    )
+    
+    batching_mode = st.radio(
+        "バッチの分け方",
+        BATCHING_MODES,
+        horizontal=True,
+        help="自治体単位: 各バッチが自治体（小さな自治体は都道府県）を丸ごと受け持ち、自治体別の分析はバッチ結果を連結して作成します。"
+             "統合は全体の傾向の生成と、1自治体が複数バッチにまたがる場合の軽い統合だけになるため、文書数が多いときに速くなります。"
+    )
+    entity_batching = batching_mode == BATCHING_MODES[1]
+    
+    # ===== 必要な列だけを抽出 =====
+    essential_columns = [
+        '都道府県', 
+        '市区町村', 
+        '資料カテゴリ', 
+        '資料名', 
+        '本文', 
+        '開始年度', 
+        '終了年度',
+        'URL(原本)',
+        'URL(GF)'
+    ]
+    
+    available_columns = [col for col in essential_columns if col in df_results.columns]
+    df_essential = df_results[available_columns].copy()
+    
+    # ===== データをソート（まとまりのある分析のため） =====
+    sort_columns = []
+    if '団体コード' in df_results.columns:
+        df_essential['団体コード'] = df_results['団体コード']
+        sort_columns.append('団体コード')
+    if '開始年度' in df_essential.columns:
+        sort_columns.append('開始年度')
+    if 'ファイルID' in df_results.columns:
+        df_essential['ファイルID'] = df_results['ファイルID']
+        sort_columns.append('ファイルID')
+    if 'ページ' in df_results.columns:
+        # キャッシュキー用の文書ID（プロンプトには含まれない）
+        df_essential['ページ'] = df_results['ページ']
+    
+    if sort_columns:
+        df_essential = df_essential.sort_values(by=sort_columns).reset_index(drop=True)
+    
+    # 本文を指定文字数に制限
+    if '本文' in df_essential.columns:
+        df_essential['本文'] = df_essential['本文'].apply(
+            lambda x: str(x)[:MAX_CHARS_PER_DOC] if pd.notna(x) else ""
+        )
+    
+    # DataFrameを辞書のリストに変換
+    all_documents = df_essential.to_dict('records')
+    
+    doc_token_counts = {}
+    
+    def count_doc_tokens(doc: dict) -> int:
+        """文書1件のプロンプト上のトークン数（同じ内容は再計測しない）"""
+        # 重複除去・圧縮で文書の辞書が作り直されるため、辞書のidではなくプロンプト上の文字列をキーにする
+        text = format_document(doc, 1, MAX_CHARS_PER_DOC)
+        if text not in doc_token_counts:
+            doc_token_counts[text] = count_tokens(text, map_model)
+        return doc_token_counts[text]
+    
+    # ===== 類似ページの重複除去 =====
+    # 同じ自治体の中で本文がほぼ同じページをまとめ、代表1件に件数を注記して送信する
+    dedup_report = "なし"
+    if dedup_enabled and all_documents:
+        representatives = _cluster_documents(
+            tuple(doc.get('本文', '') for doc in all_documents),
+            tuple(doc.get('団体コード') for doc in all_documents)
+        )
+        dedup_result = deduplicate_documents(all_documents, count_doc_tokens, representatives=representatives)
+        all_documents = dedup_result.documents
+        saved_ratio = dedup_result.tokens_saved / dedup_result.tokens_before * 100 if dedup_result.tokens_before else 0
+        dedup_report = (
+            f"{dedup_result.original_count}件 → {len(all_documents)}件"
+            f"（類似クラスタ {dedup_result.clusters}件、推定{dedup_result.tokens_saved:,}トークン削減・{saved_ratio:.0f}%）"
+        )
+        if dedup_result.removed:
+            st.info(f"🧹 類似ページの重複除去: {dedup_report}")
+    
+    # ===== 本文の抽出型圧縮 =====
+    # 検索語との一致・TF-IDF・位置で文を採点し、文書ごとの文字数予算内で上位の文だけを残す
+    uncompressed_documents = None
+    compression = None
+    if compress_enabled and all_documents:
+        compression = _compress_documents(
+            tuple(doc.get('本文', '') for doc in all_documents),
+            tuple(extract_query_keywords(query)),
+            COMPRESSED_CHARS_PER_DOC
+        )
+        uncompressed_documents = all_documents
+        all_documents = [{**doc, '本文': text} for doc, text in zip(all_documents, compression.texts)]
+    
+    # ===== トークン予算に合わせたバッチ分割 =====
+    # 同じ自治体の文書はなるべく同じバッチにまとめ、モデルごとのトークン予算まで詰める
+    token_budget = get_batch_token_budget(map_model)
+    # 自治体単位の場合は都道府県（収まらなければ自治体）ごと丸ごと1バッチに入れ、予算を超える自治体のみ分割する
+    if entity_batching:
+        prompt_overhead = count_tokens(get_entity_batch_prompt([], custom_instruction), map_model)
+        pack = pack_batches_by_entity
+    else:
+        prompt_overhead = count_tokens(
+            get_summary_prompt([]) if summary_mode == "自動要約"
+            else get_custom_batch_prompt([], custom_instruction, 1, 1),
+            map_model
+        )
+        pack = pack_batches
+    batches = pack(
+        all_documents,
+        token_budget=max(token_budget - prompt_overhead, 1),
+        count_doc_tokens=count_doc_tokens
+    )
+    total_batches = len(batches)
+    # 同じ自治体を分け合う連続したバッチ（自治体単位の場合のみ軽く統合する）
+    split_groups = find_split_groups(batches) if entity_batching else []
+    split_group_count = sum(1 for group in split_groups if len(group) > 1)
+    
+    # 圧縮しなかった場合のバッチ数（圧縮の効果の表示用）
+    uncompressed_batches = None
+    if uncompressed_documents is not None:
+        uncompressed_batches = pack(
+            uncompressed_documents,
+            token_budget=max(token_budget - prompt_overhead, 1),
+            count_doc_tokens=count_doc_tokens
+        )
+    
+    # バッチごとの文書番号の範囲（ダウンロード表示用、1から開始）
+    batch_ranges = []
+    doc_offset = 0
+    for batch_documents in batches:
+        batch_ranges.append((doc_offset + 1, doc_offset + len(batch_documents)))
+        doc_offset += len(batch_documents)
+    
     # ===== バッチ処理の推定値計算 =====
-    total_batches = (total_docs + BATCH_SIZE - 1) // BATCH_SIZE  # 切り上げ
+    # 直近の実測履歴（所要時間・出力トークン数）と事前計測した入力トークン数から推定
+    telemetry = get_telemetry_store()
+    run_estimate = telemetry.estimate_run(
+        map_model,
+        [prompt_overhead + sum(count_doc_tokens(doc) for doc in batch_documents) for batch_documents in batches],
+        MAX_CONCURRENT_BATCHES,
+        integration_model=phase_models[PHASE_INTEGRATION]
+    )
+    estimated_total_time = run_estimate.seconds
+    estimated_total_cost = run_estimate.cost
     
-    # 推定値の計算
-    estimated_time_per_batch = 60  # 秒
-    estimated_total_time = total_batches * estimated_time_per_batch
-    estimated_cost_per_batch = 0.10  # ドル
-    estimated_total_cost = total_batches * estimated_cost_per_batch
+    compression_report = "なし"
+    if compression is not None:
+        uncompressed_estimate = telemetry.estimate_run(
+            map_model,
+            [prompt_overhead + sum(count_doc_tokens(doc) for doc in batch_documents) for batch_documents in uncompressed_batches],
+            MAX_CONCURRENT_BATCHES,
+            integration_model=phase_models[PHASE_INTEGRATION]
+        )
+        compression_report = (
+            f"{compression.chars_before:,}文字 → {compression.chars_after:,}文字（{compression.ratio:.0%}、"
+            f"文 {compression.sentences_before:,} → {compression.sentences_after:,}、圧縮処理 {compression.elapsed * 1000:.0f}ミリ秒）、"
+            f"バッチ数 {len(uncompressed_batches)} → {total_batches}、"
+            f"推定処理時間 {uncompressed_estimate.seconds}秒 → {estimated_total_time}秒、"
+            f"推定コスト ${uncompressed_estimate.cost:.2f} → ${estimated_total_cost:.2f}"
+        )
+        st.info(f"✂️ 本文の圧縮: {compression_report}")
+    
+    batching_report = "トークン予算で詰める"
+    if entity_batching:
+        batching_report = (
+            f"自治体単位（{total_batches}バッチ、複数バッチにまたがる自治体 {split_group_count}件）"
+        )
+        st.caption(f"🏛️ バッチの分け方: {batching_report}")
+    st.caption(
+        f"⏱️ 推定処理時間: 約{max(estimated_total_time // 60, 1)}分 / 推定コスト: 約${estimated_total_cost:.2f}"
+        f"（{run_estimate.source}）"
+    )
     
     # 実行前の確認画面
     if summary_mode == "カスタムプロンプト" and custom_instruction:
@@ -109,8 +627,8 @@ def render_summary_tab(
             
             **📊 処理内容:**
             - 対象文書数: {total_docs}件
-            - バッチ数: {total_batches}バッチ（{BATCH_SIZE}件ずつ）
-            - 推定処理時間: 約{estimated_total_time // 60}-{estimated_total_time // 60 + 3}分
+            - バッチ数: {total_batches}バッチ（1バッチあたり約{token_budget:,}トークンまで）
+            - 推定処理時間: 約{estimated_total_time // 60}-{estimated_total_time // 60 + 3}分（{run_estimate.source}）
             - 推定コスト: 約${estimated_total_cost:.2f}-${estimated_total_cost * 1.5:.2f}
             
             **📝 処理の流れ:**
@@ -122,407 +640,446 @@ def render_summary_tab(
             バッチごとの分析のため、「最も〜」「TOP3」などの指示は最終統合時に適用されます
             """)
     
-    # 要約実行ボタン
-    if st.button("🚀 要約を実行", type="primary", key="execute_summary_button"):
+    # ===== 要約ジョブ =====
+    # 要約はバックグラウンドのジョブとして実行し、画面はジョブ記録を定期的に読み込んで表示する
+    job_manager = get_job_manager()
+    job_owner = st.session_state.get("user_name", "guest")
+    current_job = None
+    if st.session_state.get("summary_job_id"):
+        current_job = job_manager.get(st.session_state["summary_job_id"])
+    job_running = current_job is not None and not current_job.is_finished
+    
+    # 要約実行ボタン（実行中のジョブがある間は押せない）
+    if st.button("🚀 要約を実行", type="primary", key="execute_summary_button", disabled=job_running):
         # カスタムプロンプトモードで指示が未入力の場合
         if summary_mode == "カスタムプロンプト" and not custom_instruction:
             st.error("カスタムプロンプトを入力してください。")
             st.stop()
         
-        # 中断フラグの初期化
-        if "stop_processing" not in st.session_state:
-            st.session_state.stop_processing = False
+        # OpenAIクライアントを取得
+        client = get_openai_client(openai_api_key)
         
-        try:
-            # OpenAIクライアントを取得
-            client = get_openai_client(openai_api_key)
+        # バッチごとのプロンプトを事前に生成
+        batch_prompts = []
+        for batch_idx in range(total_batches):
+            batch_documents = batches[batch_idx]
             
-            # ===== 必要な列だけを抽出 =====
-            essential_columns = [
-                '都道府県', 
-                '市区町村', 
-                '資料カテゴリ', 
-                '資料名', 
-                '本文', 
-                '開始年度', 
-                '終了年度',
-                'URL(原本)',
-                'URL(GF)'
-            ]
+            if entity_batching:
+                batch_prompts.append(get_entity_batch_prompt(batch_documents, custom_instruction))
+            elif summary_mode == "自動要約":
+                batch_prompts.append(get_summary_prompt(batch_documents))
+            else:
+                batch_prompts.append(get_custom_batch_prompt(
+                    batch_documents, 
+                    custom_instruction, 
+                    batch_idx + 1, 
+                    total_batches
+                ))
+        
+        llm_cache = get_llm_cache()
+        batch_cache_keys = []
+        for batch_documents in batches:
+            batch_cache_keys.append(make_cache_key(
+                map_model,
+                PROMPT_VERSION,
+                batch_documents,
+                custom_instruction if summary_mode == "カスタムプロンプト" else "",
+                prompt_kind="entity" if entity_batching else ""
+            ))
+        
+        # レート制限は同一APIキーの全セッションで共有し、リトライはパイプライン側で制御
+        limiter = get_rate_limiter(openai_api_key)
+        pipeline_client = client.with_options(max_retries=0)
+        mode_label = 'カスタムプロンプト' if summary_mode == 'カスタムプロンプト' else '自動要約'
+        
+        def run_job(control: JobControl):
+            """要約処理の本体（ジョブのワーカースレッドで実行、Streamlitの描画は行わない）"""
+            job = control.job
+            should_stop = lambda: control.cancelled
+            # 遅延・レート制限の状況による切り替えは実行ごとに判定する
+            router = build_model_router(phase_models)
+            control.update(report={
+                "mode": mode_label,
+                "instruction": custom_instruction,
+                "total_docs": total_docs,
+                "sampling_report": sampling_report,
+                "dedup_report": dedup_report,
+                "compression_report": compression_report,
+                "batching_report": batching_report,
+                "batch_ranges": batch_ranges,
+            }, save=True)
             
-            available_columns = [col for col in essential_columns if col in df_results.columns]
-            df_essential = df_results[available_columns].copy()
+            def stream_to_buffer(label: str, prompt_text: str, stats_list: list, phase: str, model: str) -> str:
+                """プロンプトをストリーミング実行し、生成途中テキストをジョブ記録に、計測値を利用状況とモデル振り分けに書き込む"""
+                stats = CallStats(model=model)
+                error = ""
+                opened = []
+                
+                def on_open(stream):
+                    opened.append(stream)
+                    control.track_stream(stream)
+                
+                control.set_streaming(label, "")
+                chunks = []
+                try:
+                    for delta in stream_summary(
+                        pipeline_client, prompt_text, model=model, stats=stats, on_open=on_open,
+                        cache_key=get_prompt_cache_key(prompt_text)
+                    ):
+                        chunks.append(delta)
+                        control.set_streaming(label, "".join(chunks))
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    if not control.cancelled:
+                        router.record(phase, model, error=e)
+                    raise
+                finally:
+                    control.set_streaming(label, None)
+                    for stream in opened:
+                        control.untrack_stream(stream)
+                    telemetry.record_call(stats, user=job_owner, run_id=job.job_id, phase=phase, error=error)
+                router.record(phase, model, latency=stats.latency)
+                stats_list.append(stats)
+                return "".join(chunks)
             
-            # ===== データをソート（まとまりのある分析のため） =====
-            sort_columns = []
-            if '団体コード' in df_results.columns:
-                df_essential['団体コード'] = df_results['団体コード']
-                sort_columns.append('団体コード')
-            if '開始年度' in df_essential.columns:
-                sort_columns.append('開始年度')
-            if 'ファイルID' in df_results.columns:
-                df_essential['ファイルID'] = df_results['ファイルID']
-                sort_columns.append('ファイルID')
+            # ===== バッチ処理の実行 =====
+            # キャッシュ済みのバッチ要約を取得（変更のあったバッチのみAPIを呼び出す）
+            cached_results = {}
+            for batch_idx, cache_key in enumerate(batch_cache_keys):
+                cached = llm_cache.get(cache_key)
+                if cached:
+                    cached_results[batch_idx] = cached
+            control.update(phase="バッチ要約", batch_results=dict(cached_results), save=True)
             
-            if sort_columns:
-                df_essential = df_essential.sort_values(by=sort_columns).reset_index(drop=True)
+            batch_call_stats = []
             
-            # 本文を指定文字数に制限
-            if '本文' in df_essential.columns:
-                df_essential['本文'] = df_essential['本文'].apply(
-                    lambda x: str(x)[:MAX_CHARS_PER_DOC] if pd.notna(x) else ""
-                )
+            def run_batch(batch_idx: int) -> str:
+                """1バッチをストリーミングで要約（リトライのたびに現在の振り分け先モデルを使用）"""
+                model = router.model_for(PHASE_MAP)
+                summary = stream_to_buffer(f"バッチ{batch_idx + 1}", batch_prompts[batch_idx], batch_call_stats, PHASE_MAP, model)
+                if summary:
+                    # フォールバックモデルの結果は通常モデルのキャッシュキーで保存しない
+                    if model == map_model:
+                        llm_cache.put(batch_cache_keys[batch_idx], summary, model=model)
+                    control.record_batch(batch_idx, result=summary)
+                return summary
             
-            # DataFrameを辞書のリストに変換
-            all_documents = df_essential.to_dict('records')
+            def on_batch_progress(completed: int, total: int, batch_idx: int, ok: bool):
+                """失敗したバッチを記録（成功したバッチはrun_batchで記録済み）"""
+                if not ok and not control.cancelled:
+                    control.record_batch(batch_idx, error="処理に失敗しました")
             
-            # ===== バッチ処理の実行 =====
-            batch_results = []
-            processing_times = []
+            # 各バッチを並列処理
+            map_result = run_map_phase(
+                run_batch,
+                total_batches,
+                limiter=limiter,
+                estimate_tokens=lambda batch_idx: estimate_request_tokens(batch_prompts[batch_idx]),
+                max_workers=MAX_CONCURRENT_BATCHES,
+                max_retries=MAX_RETRIES,
+                on_progress=on_batch_progress,
+                should_stop=should_stop,
+                precomputed=cached_results
+            )
+            if map_result.stopped or control.cancelled:
+                raise PipelineCancelled()
+            for batch_idx, error_str in map_result.errors.items():
+                control.record_batch(batch_idx, error=error_str)
             
-            # 進捗表示用のプレースホルダー
-            progress_placeholder = st.empty()
-            result_placeholder = st.empty()
+            # 成功したバッチのみを（バッチ番号, 結果）で保持
+            completed_batches = [
+                (batch_idx, result) for batch_idx, result in enumerate(map_result.results) if result
+            ]
+            batch_results = [result for _, result in completed_batches]
+            map_wall_time = map_result.wall_time
+            if not batch_results:
+                raise RuntimeError("すべてのバッチ処理に失敗しました。")
             
-            # バッチ処理の進捗表示
-            with progress_placeholder.container():
-                st.markdown(f"### 🔄 {'カスタムプロンプト' if summary_mode == 'カスタムプロンプト' else '自動要約'}を実行中...")
-                
-                if summary_mode == "カスタムプロンプト":
-                    st.info(f"**あなたの指示:** {custom_instruction}")
-                
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                # 中断ボタン（一意のキーを使用）
-                stop_col1, stop_col2 = st.columns([1, 5])
-                with stop_col1:
-                    stop_button = st.button("⏹️ 中断", key=f"stop_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
-                if stop_button:
-                    st.session_state.stop_processing = True
+            # 実測時間と事前推定の比較
+            executed_times = [t for t in map_result.batch_times if t > 0]
+            avg_batch_time = sum(executed_times) / len(executed_times) if executed_times else 0.0
+            time_report = (
+                f"mapフェーズ実測 {map_wall_time:.0f}秒 / 事前推定 {estimated_total_time}秒"
+                f"（1バッチ平均 {avg_batch_time:.0f}秒 vs 推定{run_estimate.seconds_per_batch:.0f}秒、"
+                f"同時実行 最大{MAX_CONCURRENT_BATCHES}、リトライ {map_result.retries}回、"
+                f"キャッシュ再利用 {map_result.cached}/{total_batches}バッチ）"
+            )
+            stream_report = _format_stream_report("バッチ", summarize_call_stats(batch_call_stats))
             
-            # 各バッチを処理
-            for batch_idx in range(total_batches):
-                # 中断チェック
-                if st.session_state.get("stop_processing", False):
-                    progress_placeholder.empty()
-                    with result_placeholder.container():
-                        st.warning("⚠️ ユーザーによって処理が中断されました。")
-                    st.session_state.stop_processing = False
-                    break
-                
-                # バッチの範囲を計算
-                start_idx = batch_idx * BATCH_SIZE
-                end_idx = min((batch_idx + 1) * BATCH_SIZE, total_docs)
-                batch_documents = all_documents[start_idx:end_idx]
-                
-                # 進捗更新
-                progress = (batch_idx + 1) / total_batches
-                progress_bar.progress(progress)
-                status_text.markdown(f"**進捗: {int(progress * 100)}% ({batch_idx + 1}/{total_batches}バッチ) - バッチ{batch_idx + 1}処理中...**")
-                
-                # プロンプト生成
-                batch_start_time = time.time()
+            def run_entity_integration(time_report: str, stream_report: str) -> tuple:
+                """自治体単位のバッチ結果を連結し、全体の傾向だけを生成して先頭に付ける"""
+                reduce_instruction = custom_instruction if summary_mode == "カスタムプロンプト" else ""
+                merge_call_stats = []
                 
-                if summary_mode == "自動要約":
-                    prompt = get_summary_prompt(batch_documents)
-                else:
-                    prompt = get_custom_batch_prompt(
-                        batch_documents, 
-                        custom_instruction, 
-                        batch_idx + 1, 
-                        total_batches
+                # 複数バッチにまたがる自治体だけを1回ずつ統合（それ以外のバッチ結果はそのまま使う）
+                def run_merge(texts: list, level: int) -> str:
+                    """同じ自治体を分け合うバッチ結果を1つに統合"""
+                    return stream_to_buffer(
+                        "自治体の統合", get_merge_prompt(texts, reduce_instruction, level), merge_call_stats,
+                        PHASE_MERGE, router.model_for(PHASE_MERGE)
                     )
                 
-                # 要約生成（リトライ機能付き）
-                max_retries = 3
-                retry_count = 0
-                batch_summary = None
-                
-                while retry_count < max_retries and batch_summary is None:
-                    try:
-                        batch_summary = generate_summary(client, prompt, model=selected_model)
-                    except Exception as e:
-                        error_str = str(e)
-                        retry_count += 1
-                        
-                        # レート制限エラーの場合は60秒待機
-                        if "rate_limit" in error_str.lower() or "429" in error_str:
-                            if retry_count < max_retries:
-                                st.warning(f"⚠️ レート制限エラー。60秒待機後にリトライします... ({retry_count}/{max_retries})")
-                                time.sleep(60)
-                            else:
-                                st.error(f"❌ バッチ{batch_idx + 1}でレート制限エラーが継続しています。スキップします。")
-                        # その他のエラー
-                        else:
-                            if retry_count < max_retries:
-                                st.warning(f"⚠️ エラー発生。30秒待機後にリトライします... ({retry_count}/{max_retries})")
-                                time.sleep(30)
-                            else:
-                                st.error(f"❌ バッチ{batch_idx + 1}でエラーが継続しています: {error_str}")
-                
-                batch_end_time = time.time()
-                processing_time = batch_end_time - batch_start_time
-                processing_times.append(processing_time)
+                if split_group_count:
+                    control.update(phase=f"複数バッチにまたがる自治体の統合（{split_group_count}件）")
+                merge_result = run_split_merge(
+                    map_result.results,
+                    split_groups,
+                    run_merge,
+                    limiter=limiter,
+                    estimate_tokens=lambda texts: estimate_request_tokens("".join(texts)),
+                    max_workers=MAX_CONCURRENT_BATCHES,
+                    max_retries=MAX_RETRIES,
+                    should_stop=should_stop
+                )
+                if merge_result.stopped:
+                    raise PipelineCancelled()
+                entity_sections = merge_result.summaries
+                if merge_result.calls:
+                    time_report += f"、自治体の統合 {merge_result.calls}回（{merge_result.wall_time:.0f}秒）"
+                    stream_report += " / " + _format_stream_report("自治体の統合", summarize_call_stats(merge_call_stats))
                 
-                if batch_summary:
-                    batch_results.append(batch_summary)
-                else:
-                    st.error(f"❌ バッチ{batch_idx + 1}の処理に失敗しました。")
-            
-            # 全バッチ完了 - 進捗表示を消去
-            progress_placeholder.empty()
-            
-            # 処理完了の通知（一時的に表示）
-            temp_status = st.empty()
-            temp_status.success(f"✅ 全{len(batch_results)}バッチ完了")
-            time.sleep(1)
-            temp_status.empty()
+                # 全体の傾向は自治体別の結果から生成（入力が予算を超える場合は各結果を比例して切り詰める）
+                overview_overhead = count_tokens(get_overview_prompt([], reduce_instruction, total_docs), reduce_model)
+                overview_inputs = fit_to_token_budget(
+                    entity_sections,
+                    lambda text: count_tokens(text, reduce_model),
+                    max(get_batch_token_budget(reduce_model) - overview_overhead, 1)
+                )
+                overview_prompt = get_overview_prompt(overview_inputs, reduce_instruction, total_docs)
+                control.update(phase=f"全体の傾向を生成（{len(entity_sections)}件の結果から）")
+                integration_call_stats = []
+                overview = call_with_retry(
+                    lambda: stream_to_buffer(
+                        "全体の傾向", overview_prompt, integration_call_stats,
+                        PHASE_INTEGRATION, router.model_for(PHASE_INTEGRATION)
+                    ),
+                    limiter=limiter,
+                    estimated_tokens=estimate_request_tokens(overview_prompt),
+                    max_retries=MAX_RETRIES,
+                    should_stop=should_stop
+                )
+                stream_report += " / " + _format_stream_report("統合", summarize_call_stats(integration_call_stats))
+                final_summary = overview.strip() + "\n\n【自治体別の分析】\n\n" + "\n\n".join(
+                    section.strip() for section in entity_sections
+                )
+                return final_summary, time_report, stream_report
             
             # ===== 最終統合処理 =====
-            if batch_results and not st.session_state.get("stop_processing", False):
-                # 統合処理の進捗表示用プレースホルダー
-                integration_placeholder = st.empty()
+            integration_start_time = time.time()
+            try:
+                if entity_batching:
+                    final_summary, time_report, stream_report = run_entity_integration(time_report, stream_report)
+                else:
+                    # ===== 多段統合（最終統合の入力がトークン予算に収まるまで隣接バッチを並列に統合） =====
+                    merge_call_stats = []
+                    reduce_instruction = custom_instruction if summary_mode == "カスタムプロンプト" else ""
+                    merge_overhead = count_tokens(get_merge_prompt([], reduce_instruction, 1), reduce_model)
                 
-                with integration_placeholder.container():
-                    st.markdown("### 🔄 最終統合分析を実行中...")
-                    st.info(f"""
-                    {len(batch_results)}個のバッチ結果を統合して、
-                    全体視点での分析を生成しています...
-                    
-                    ⏳ 推定残り時間: 約30-60秒
-                    """)
+                    def run_merge(texts: list, level: int) -> str:
+                        """隣接するバッチ結果を1つに統合"""
+                        merge_prompt = get_merge_prompt(texts, reduce_instruction, level)
+                        return stream_to_buffer(
+                            f"中間統合（第{level}段）", merge_prompt, merge_call_stats, PHASE_MERGE, router.model_for(PHASE_MERGE)
+                        )
+                
+                    def on_reduce_level(level: int, groups: int, inputs: int):
+                        """中間統合の段の開始を記録"""
+                        control.update(phase=f"中間統合 第{level}段（{inputs}件の結果を{groups}グループに並列統合）")
+                
+                    reduce_result = run_tree_reduce(
+                        batch_results,
+                        run_merge,
+                        count_tokens=lambda text: count_tokens(text, reduce_model),
+                        token_budget=max(get_batch_token_budget(reduce_model) - merge_overhead, 1),
+                        limiter=limiter,
+                        estimate_tokens=lambda texts: estimate_request_tokens("".join(texts)),
+                        max_workers=MAX_CONCURRENT_BATCHES,
+                        max_retries=MAX_RETRIES,
+                        should_stop=should_stop,
+                        on_level=on_reduce_level
+                    )
+                    if reduce_result.stopped:
+                        raise PipelineCancelled()
+                    reduced_results = reduce_result.summaries
+                    if reduce_result.levels:
+                        time_report += f"、中間統合 {reduce_result.levels}段・{reduce_result.calls}回（{reduce_result.wall_time:.0f}秒）"
+                        stream_report += " / " + _format_stream_report("中間統合", summarize_call_stats(merge_call_stats))
                 
-                try:
-                    integration_start_time = time.time()
-                    
                     # 統合プロンプト生成
                     if summary_mode == "自動要約":
-                        integration_prompt = f"""
-以下は、全{total_docs}件の自治体文書を{len(batch_results)}バッチに分けて要約した結果です。
-各バッチでは自治体ごとに分析がまとめられています。
-
-{chr(10).join([f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{chr(10)}バッチ{i+1}の要約{chr(10)}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{chr(10)}{result}{chr(10)}" for i, result in enumerate(batch_results)])}
-
-# 統合要約の指示
-上記の各バッチ要約を統合し、全体を俯瞰した総合的な要約を作成してください。
-
-# 統合時の重要ポイント
-1. **自治体ごとの情報を統合**: 同じ自治体が複数バッチに登場する場合は情報を統合してください
-2. **具体性を保持**: 根拠となる記載や具体的な施策名を保持してください
-3. **重複を排除**: 同じ内容が複数回出現する場合は1回にまとめてください
-
-# 出力形式
-以下の構成で出力してください:
-
-【全体サマリー】（200-300文字）
-検索結果全体の傾向を俯瞰
-
-【自治体別の統合分析】
-各自治体の特徴を、根拠となる記載とともに整理
-
-■ 都道府県名 市区町村名
-- 特徴: ...
-- 根拠となる記載: 「〇〇〇」
-- 年度: ...
-
-**重要: このバッチに含まれるすべての自治体について記載してください。省略や「以下省略」は不可。**
-
-【主要テーマ】
-最も頻出するテーマを3-5個
-
-【地域別の傾向】
-地域ごとの特徴があれば記載
-
-【時系列の変化】
-年度による変化や推移があれば記載
-
-【頻出キーワード TOP5-10】
-重要なキーワードを抽出
-"""
+                        integration_prompt = get_summary_integration_prompt(reduced_results, total_docs)
                     else:
                         integration_prompt = get_custom_integration_prompt(
-                            batch_results, 
+                            reduced_results, 
                             custom_instruction, 
                             total_docs
                         )
-                    
-                    final_summary = generate_summary(client, integration_prompt, model=selected_model)
-                    
-                    integration_end_time = time.time()
-                    integration_time = integration_end_time - integration_start_time
-                    
-                    if final_summary:
-                        # 統合処理の進捗表示を消去
-                        integration_placeholder.empty()
-                        
-                        # ダウンロード用コンテンツを生成（セッションステート保存前に作成）
-                        download_content = f"""# {'カスタムプロンプト' if summary_mode == 'カスタムプロンプト' else '自動要約'}結果（完全版）
+                
+                    control.update(phase=f"最終統合（{len(reduced_results)}件の結果を統合）")
+                    integration_call_stats = []
+                    final_summary = call_with_retry(
+                        lambda: stream_to_buffer(
+                            "最終統合", integration_prompt, integration_call_stats,
+                            PHASE_INTEGRATION, router.model_for(PHASE_INTEGRATION)
+                        ),
+                        limiter=limiter,
+                        estimated_tokens=estimate_request_tokens(integration_prompt),
+                        max_retries=MAX_RETRIES,
+                        should_stop=should_stop
+                    )
+                    stream_report += " / " + _format_stream_report("統合", summarize_call_stats(integration_call_stats))
+            except PipelineCancelled:
+                raise
+            except Exception as e:
+                # 統合に失敗してもバッチ結果はダウンロードできるようにする
+                control.update(download_content=f"""# バッチ処理結果（統合失敗）
 
 ## 基本情報
 - 実行日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 - 対象文書数: {total_docs}件
+- 要約対象の選び方: {sampling_report}
+- 重複除去: {dedup_report}
+- 本文の圧縮: {compression_report}
+- バッチの分け方: {batching_report}
 - バッチ数: {len(batch_results)}
-- 処理時間: {(sum(processing_times) + integration_time) // 60:.0f}分{(sum(processing_times) + integration_time) % 60:.0f}秒
-
-## 最終統合結果
+- 処理時間: {map_wall_time // 60:.0f}分{map_wall_time % 60:.0f}秒
 
-{final_summary}
-
----
-
-## 各バッチの詳細結果
-
-"""
-                        for i, result in enumerate(batch_results, 1):
-                            start_idx = (i - 1) * BATCH_SIZE + 1
-                            end_idx = min(i * BATCH_SIZE, total_docs)
-                            download_content += f"""### バッチ{i}（文書{start_idx}-{end_idx}件）
-
-{result}
+## エラー情報
+{str(e)}
 
----
+## 各バッチの結果
 
-"""
-                        
-                        # セッションステートに結果を保存
-                        st.session_state['summary_result'] = final_summary
-                        st.session_state['summary_download_content'] = download_content
-                        st.session_state['summary_total_docs'] = total_docs
-                        st.session_state['summary_batch_count'] = len(batch_results)
-                        st.session_state['summary_processing_time'] = sum(processing_times) + integration_time
-                        st.session_state['summary_mode'] = summary_mode
-                        
-                        # 最終結果の表示
-                        with result_placeholder.container():
-                            st.markdown("# 🎯 最終統合結果")
-                            st.markdown(final_summary)
-                            
-                            # 完了情報と処理時間
-                            total_processing_time = sum(processing_times) + integration_time
-                            st.success(f"""
-                            ✅ {'カスタムプロンプト' if summary_mode == 'カスタムプロンプト' else '自動要約'}が完了しました
-                            
-                            - 処理済み: {total_docs}件（{len(batch_results)}バッチ + 統合1回）
-                            - 処理時間: {total_processing_time // 60:.0f}分{total_processing_time % 60:.0f}秒
-                            """)
-                        
-                        # ページをリロードして、セッションステートから結果を再表示
-                        st.rerun()
-                    
-                except Exception as e:
-                    integration_placeholder.empty()
-                    
-                    # エラー時のダウンロード用コンテンツを生成
-                    error_download_content = f"""# バッチ処理結果（統合失敗）
+""" + _format_batch_details(completed_batches, batch_ranges))
+                raise
+            
+            integration_time = time.time() - integration_start_time
+            processing_time = map_wall_time + integration_time
+            usage_report = (
+                f"{format_usage_report(telemetry.run_usage(job.job_id))}"
+                f" / 事前推定 約${estimated_total_cost:.2f}"
+            )
+            model_report = router.describe()
+            phase_usage = telemetry.phase_breakdown(job.job_id, selected_model)
+            routing_report = format_routing_savings(phase_usage)
+            
+            # ダウンロード用コンテンツを生成
+            download_content = f"""# {mode_label}結果（完全版）
 
 ## 基本情報
 - 実行日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 - 対象文書数: {total_docs}件
+- 要約対象の選び方: {sampling_report}
+- 重複除去: {dedup_report}
+- 本文の圧縮: {compression_report}
+- バッチの分け方: {batching_report}
 - バッチ数: {len(batch_results)}
-- 処理時間: {sum(processing_times) // 60:.0f}分{sum(processing_times) % 60:.0f}秒
-
-## エラー情報
-{str(e)}
-
-## 各バッチの結果
+- 処理時間: {processing_time // 60:.0f}分{processing_time % 60:.0f}秒
+- 実測と推定: {time_report}
+- ストリーミング計測: {stream_report}
+- トークン・コスト: {usage_report}
+- 使用モデル: {model_report}
+- モデル振り分けの効果: {routing_report}
 
-"""
-                    for i, result in enumerate(batch_results, 1):
-                        start_idx = (i - 1) * BATCH_SIZE + 1
-                        end_idx = min(i * BATCH_SIZE, total_docs)
-                        error_download_content += f"""### バッチ{i}（文書{start_idx}-{end_idx}件）
+## 最終統合結果
 
-{result}
+{final_summary}
 
 ---
 
-"""
-                    
-                    with result_placeholder.container():
-                        st.error(f"⚠️ 最終統合処理でエラーが発生しました: {str(e)}")
-                        
-                        st.warning("""
-                        各バッチの分析結果は正常に取得できています。
-                        以下の対処法をお試しください:
-                        
-                        1. 各バッチ結果を確認する（統合なしでも有用な情報が含まれています）
-                        2. カスタムプロンプトをより簡潔にして再実行
-                        3. 対象文書数を減らして再実行
-                        """)
-                        
-                        # エラー時もダウンロード機能を提供
-                        st.download_button(
-                            label="📥 バッチ結果をダウンロード",
-                            data=error_download_content,
-                            file_name=f"summary_batches_error_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                            mime="text/plain",
-                            key=f"download_error_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
-                        )
-            
-            elif not batch_results:
-                progress_placeholder.empty()
-                with result_placeholder.container():
-                    st.error("❌ すべてのバッチ処理に失敗しました。")
+## 各バッチの詳細結果
+
+""" + _format_batch_details(completed_batches, batch_ranges)
             
-        except Exception as e:
-            if 'progress_placeholder' in locals():
-                progress_placeholder.empty()
-            if 'result_placeholder' in locals():
-                with result_placeholder.container():
-                    st.error(f"❌ 予期しないエラーが発生しました: {str(e)}")
-            else:
-                st.error(f"❌ 予期しないエラーが発生しました: {str(e)}")
+            control.update(
+                final_summary=final_summary,
+                download_content=download_content,
+                report={
+                    **job.report,
+                    "batch_count": len(batch_results),
+                    "processing_time": processing_time,
+                    "time_report": time_report,
+                    "stream_report": stream_report,
+                    "usage_report": usage_report,
+                    "model_report": model_report,
+                    "routing_report": routing_report,
+                    "phase_usage": phase_usage,
+                }
+            )
         
-        finally:
-            # 中断フラグをリセット
-            st.session_state.stop_processing = False
+        title_detail = f"「{custom_instruction[:30]}」" if summary_mode == "カスタムプロンプト" else ""
+        job_id = job_manager.submit(
+            owner=job_owner,
+            title=f"{mode_label}{title_detail}（{total_docs}件）",
+            total_batches=total_batches,
+            run=run_job
+        )
+        st.session_state["summary_job_id"] = job_id
+        current_job = job_manager.get(job_id)
     
-    # ===== セッションステートから結果を復元して表示 =====
-    # ダウンロードボタンを押した後もこのセクションで結果が再表示される
-    if 'summary_result' in st.session_state and 'summary_mode' in st.session_state:
+    # ===== ジョブの進捗・結果を表示 =====
+    if current_job is not None:
         st.markdown("---")
-        st.markdown("# 🎯 最終統合結果")
-        st.markdown(st.session_state['summary_result'])
-        
-        # 完了情報
-        st.success(f"""
-        ✅ {st.session_state.get('summary_mode', '要約')}が完了しました
-        
-        - 処理済み: {st.session_state.get('summary_total_docs', 0)}件（{st.session_state.get('summary_batch_count', 0)}バッチ + 統合1回）
-        - 処理時間: {st.session_state.get('summary_processing_time', 0) // 60:.0f}分{st.session_state.get('summary_processing_time', 0) % 60:.0f}秒
-        """)
-        
-        # ダウンロードボタン
-        col1, col2, col3 = st.columns([2, 2, 4])
-        with col1:
-            st.download_button(
-                label="📥 完全版をダウンロード",
-                data=st.session_state.get('summary_download_content', ''),
-                file_name=f"summary_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                key="download_full_persistent"
-            )
-        with col2:
-            st.download_button(
-                label="📊 統合結果のみダウンロード",
-                data=st.session_state.get('summary_result', ''),
-                file_name=f"summary_final_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                key="download_final_persistent"
+        if current_job.is_finished:
+            _render_finished_job(current_job)
+        else:
+            # 実行中はこの部分だけを定期的に再描画（検索結果の再取得は行わない）
+            st.fragment(_render_job_progress, run_every=JOB_POLL_INTERVAL)(job_manager, current_job.job_id)
+    
+    # 過去のジョブ（再計算せずに結果を再表示）
+    past_jobs = [job for job in job_manager.list_jobs(job_owner) if job.is_finished]
+    if past_jobs:
+        with st.expander(f"🗂️ 過去の要約ジョブ（{len(past_jobs)}件）"):
+            job_labels = {
+                job.job_id: (
+                    f"{datetime.datetime.fromtimestamp(job.created_at).strftime('%Y-%m-%d %H:%M')} "
+                    f"{job.title} [{STATUS_LABELS.get(job.status, job.status)}]"
+                )
+                for job in past_jobs
+            }
+            selected_job_id = st.selectbox(
+                "表示するジョブ",
+                options=list(job_labels.keys()),
+                format_func=lambda job_id: job_labels[job_id],
+                key="past_summary_job"
             )
+            if st.button("📂 このジョブの結果を表示", key="show_past_summary_job"):
+                st.session_state["summary_job_id"] = selected_job_id
+                st.rerun()
+    
+    # 利用状況（実測したトークン数・コストの集計）
+    with st.expander("📈 AI要約の利用状況（直近30日）"):
+        usage_df = telemetry.usage_by_user(days=30)
+        if usage_df.empty:
+            st.caption("まだ利用記録がありません。")
+        elif is_operator():
+            # 運用担当者には全ユーザーの集計を表示
+            st.dataframe(usage_df, hide_index=True, use_container_width=True)
+        else:
+            own_usage = usage_df[usage_df["ユーザー"] == job_owner]
+            st.dataframe(own_usage, hide_index=True, use_container_width=True)
     
     # 使用上の注意
     with st.expander("ℹ️ AI要約の使用上の注意"):
         st.markdown(f"""
         - AIによる要約は参考情報です。重要な決定には必ず原文を確認してください
-        - **文書数制限**: 分析対象は上限{MAX_DOCS_FOR_SUMMARY}件までです
-        - **バッチ処理**: {BATCH_SIZE}件ずつ処理し、最後に統合します
+        - **文書数制限**: 分析対象は上限{MAX_DOCS_FOR_SUMMARY}件までです。検索結果が上限（表示件数）を超える場合は、自治体×カテゴリごとにスコア上位の文書を均等に抽出して要約できます（抽出した範囲は完了時に表示します）
+        - **多段統合**: バッチ結果が多い場合は、隣接するバッチ結果を並列に中間統合してから最終統合します
+        - **自治体単位のバッチ**: 「自治体単位」を選ぶと、自治体別の分析はバッチ結果をそのまま連結し、最終統合では全体の傾向だけを生成します（1自治体が1バッチに収まらない場合のみ、その自治体のバッチ結果を統合します）
+        - **バッチ処理**: モデルごとのトークン予算（{map_model}: 約{token_budget:,}トークン）まで文書を詰めて処理し、最後に統合します。同じ自治体の文書はなるべく同じバッチにまとめます
+        - **モデルの使い分け**: バッチ要約（抽出）は軽量モデル、統合は選択したモデルで実行できます。応答の遅延やレート制限が予算を超えた段階は、以降の呼び出しを高速なモデルに自動で切り替えます
         - **データ並び替え**: 分析前に団体コード・年度・ファイルIDで並び替えを行います
-        - 本文は最大{MAX_CHARS_PER_DOC}文字まで使用されます
-        - 処理中に中断ボタンで停止できます
-        - エラー時は自動リトライを行います（最大3回）
+        - 本文は検索語の周辺を抜き出した最大{MAX_CHARS_PER_DOC}文字の抜粋を使用します（検索語がない場合は本文の先頭）
+        - **重複除去**: 同じ自治体で本文がほぼ同じページ（年度違いの計画・繰り返しページ等）は代表1件だけを送信し、件数を注記します
+        - **本文の圧縮**（オプション）: 検索語を含む文・特徴的な文・冒頭の文を優先して1件あたり{COMPRESSED_CHARS_PER_DOC}文字以内に絞り込みます（省略箇所は「…」）。圧縮率・バッチ数・推定処理時間の変化を実行前に表示します
+        - **推定値**: 処理時間・コストの推定は直近の実測（所要時間・トークン数）から計算します。実行後は実際のトークン数とコストを表示します
+        - **並列処理**: 最大{MAX_CONCURRENT_BATCHES}バッチを同時に処理します（APIのレート制限内で自動調整）
+        - **キャッシュ**: 同じ文書・モデル・指示のバッチ要約は保存済みの結果を再利用し、変更のあったバッチと統合処理のみAPIを呼び出します
+        - **ストリーミング表示**: 各バッチと最終統合の生成途中テキストを逐次表示します
+        - **バックグラウンド実行**: 要約はバックグラウンドで実行されるため、処理中に画面を操作しても中断されません。中断ボタンで処理中のAPI呼び出しも停止します
+        - **過去の結果**: 終了した要約は「過去の要約ジョブ」から再計算せずに再表示できます
+        - エラー時は指数バックオフで自動リトライを行います（最大{MAX_RETRIES}回、レート制限時はサーバー指定の待機時間に従います）
         - **トークン最適化**: 不要な列を送信から除外し、トークン数を削減しています
+        - **プロンプトキャッシュ**: 指示・出力形式をプロンプトの先頭、文書・バッチ番号を末尾に置き、同じ実行の全バッチで先頭部分を共通にしています（OpenAIでは共通部分が1,024トークン以上の場合に割引・高速化が適用されます。キャッシュが効いた入力トークン数を結果に表示します）
         - **表示**: 統合結果のみ表示されます。各バッチの詳細は完全版ダウンロードで確認できます
         - **ダウンロード後も結果表示**: ダウンロードボタンを押しても結果は消えません
         """)
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+トークン数計測モジュール
+ローカルのトークナイザー（tiktoken）でプロンプトのトークン数を計測
+"""
+
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken未インストール時は文字数ベースの概算にフォールバック
+    tiktoken = None
+
+
+DEFAULT_ENCODING = "o200k_base"  # gpt-4o系のエンコーディング
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """
+    モデルに対応するエンコーディングを取得（取得できない場合はNone）
+    
+    Args:
+        model: モデル名
+    
+    Returns:
+        tiktoken.Encoding or None
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        # エンコーディングファイルをダウンロードできない環境など
+        return None
+    try:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        return None
+
+
+def estimate_tokens_by_chars(text: str) -> int:
+    """
+    文字種から概算トークン数を計算（ASCIIは約4文字、それ以外は約1文字で1トークン）
+    
+    Args:
+        text: 対象テキスト
+    
+    Returns:
+        int: 概算トークン数
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    テキストのトークン数を計測
+    
+    Args:
+        text: 対象テキスト
+        model: モデル名
+    
+    Returns:
+        int: トークン数（トークナイザーが使えない場合は概算値）
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens_by_chars(text)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,404 @@
+"""
+処理時間の計測モジュール
+1回の再実行（rerun）の中の処理段階（マスター読み込み・サイドバー構築・ES検索・テーブル構築・タブ表示など）を
+スパンとして記録し、運用担当者向けの内訳表示とJSON Lines形式での書き出しに使用
+"""
+
+import contextvars
+import functools
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import streamlit as st
+from config import get_secret, get_secret_int
+
+
+DEFAULT_TRACE_PATH = Path(__file__).parent / ".cache" / "traces" / "spans.jsonl"
+SUMMARY_RERUNS = 50  # 処理段階ごとの集計に使う直近の再実行数
+
+
+@dataclass
+class Span:
+    """1つの処理段階の計測値"""
+    name: str  # 処理段階の名前（関数名など）
+    start: float  # 再実行の開始からの経過時間（秒）
+    duration: float = 0.0  # 所要時間（秒）
+    depth: int = 0  # 入れ子の深さ（0が最上位）
+    parent: Optional[int] = None  # 親スパンの番号
+    error: str = ""  # 例外が発生した場合の例外クラス名
+    attrs: dict = field(default_factory=dict)  # 追加情報（キャッシュの利用有無・件数など）
+
+
+class RerunTrace:
+    """1回の再実行で記録したスパン"""
+    
+    def __init__(self, session_id: str):
+        """
+        Args:
+            session_id: セッションの識別子
+        """
+        self.run_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.user = ""
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+        self._origin = time.perf_counter()
+        self._stack: List[int] = []
+    
+    def open(self, name: str, attrs: dict) -> int:
+        """スパンを開始して番号を返す"""
+        span = Span(
+            name=name,
+            start=time.perf_counter() - self._origin,
+            depth=len(self._stack),
+            parent=self._stack[-1] if self._stack else None,
+            attrs=attrs,
+        )
+        self.spans.append(span)
+        self._stack.append(len(self.spans) - 1)
+        return len(self.spans) - 1
+    
+    def close(self, index: int, error: str = ""):
+        """スパンを終了"""
+        span = self.spans[index]
+        span.duration = time.perf_counter() - self._origin - span.start
+        span.error = error
+        if self._stack and self._stack[-1] == index:
+            self._stack.pop()
+    
+    def current(self) -> Optional[Span]:
+        """実行中で最も内側のスパン"""
+        return self.spans[self._stack[-1]] if self._stack else None
+    
+    def finish(self):
+        """再実行の記録を終了"""
+        self.duration = time.perf_counter() - self._origin
+    
+    def to_records(self) -> List[dict]:
+        """
+        スパンをJSON Lines形式で書き出す記録に変換
+        
+        Returns:
+            List[dict]: スパンごとの記録（再実行の情報・ミリ秒に換算した開始時刻と所要時間を含む）
+        """
+        records = []
+        for index, span in enumerate(self.spans):
+            record = asdict(span)
+            record.update({
+                "run_id": self.run_id,
+                "session": self.session_id,
+                "user": self.user,
+                "rerun_started_at": self.started_at,
+                "rerun_ms": round(self.duration * 1000, 3),
+                "index": index,
+                "start_ms": round(span.start * 1000, 3),
+                "duration_ms": round(span.duration * 1000, 3),
+            })
+            del record["start"], record["duration"]
+            records.append(record)
+        return records
+
+
+# 実行中の再実行の記録（Streamlitのスクリプト実行スレッドごと。別スレッドからの呼び出しは記録しない）
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    処理段階をスパンとして計測（再実行の記録中でなければ何もしない）
+    
+    Args:
+        name: 処理段階の名前
+        **attrs: 追加情報
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    index = trace.open(name, attrs)
+    error = ""
+    try:
+        yield trace.spans[index]
+    except BaseException as e:
+        # st.stop() / st.rerun() も例外として通知されるため、クラス名だけ記録して再送出
+        error = type(e).__name__
+        raise
+    finally:
+        trace.close(index, error)
+
+
+def traced(name: Optional[str] = None, cached: bool = False):
+    """
+    関数の呼び出しをスパンとして計測するデコレーター
+    
+    st.cache_data / st.cache_resource より外側に付けると、キャッシュから返した場合の所要時間も計測できる
+    
+    Args:
+        name: 処理段階の名前（省略時は関数名）
+        cached: キャッシュ付きの関数か（Trueなら関数本体で mark_cache_miss を呼ばない限りキャッシュ利用として記録）
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attrs = {"cache": "hit"} if cached else {}
+            with span(span_name, **attrs):
+                return func(*args, **kwargs)
+        
+        # st.cache_data / st.cache_resource のキャッシュ削除（fetch_counts.clear() など）を引き続き使えるように
+        if hasattr(func, "clear"):
+            wrapper.clear = func.clear
+        return wrapper
+    return decorator
+
+
+def mark_cache_miss():
+    """キャッシュ付きの関数の本体から呼び、実行中のスパンをキャッシュ未利用として記録"""
+    trace = _current_trace.get()
+    current = trace.current() if trace is not None else None
+    if current is not None and "cache" in current.attrs:
+        current.attrs["cache"] = "miss"
+
+
+def start_trace() -> RerunTrace:
+    """
+    再実行の記録を開始（app.pyの先頭で呼ぶ）
+    
+    Returns:
+        RerunTrace: 再実行の記録
+    """
+    session_id = st.session_state.setdefault("trace_session_id", uuid.uuid4().hex[:8])
+    trace = RerunTrace(session_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace() -> Optional[RerunTrace]:
+    """
+    再実行の記録を終了して保存（app.pyの末尾で呼ぶ）
+    
+    Returns:
+        Optional[RerunTrace]: 再実行の記録（記録中でない場合はNone）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    trace.finish()
+    trace.user = st.session_state.get("user_name", "")
+    get_trace_store().append_trace(trace)
+    return trace
+
+
+class TraceStore:
+    """
+    スパンの保存先（JSON Lines形式で追記し、直近の記録をメモリに保持）
+    """
+    
+    def __init__(self, path: Path, max_records: int):
+        """
+        Args:
+            path: 記録ファイルのパス
+            max_records: メモリ・ファイルに保持するスパン数
+        """
+        self.path = Path(path)
+        self.max_records = max(1, max_records)
+        self._records = deque(maxlen=self.max_records)
+        self._lock = threading.Lock()
+        self._lines_written = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+    
+    def _load(self):
+        """保存済みの記録を読み込み"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._records.append(json.loads(line))
+                    except ValueError:
+                        continue
+                    self._lines_written += 1
+        except OSError:
+            pass
+    
+    def _compact(self):
+        """ファイルを直近の記録だけに書き直す（ロック取得済みで呼ぶ）"""
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self._records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        tmp_path.replace(self.path)
+        self._lines_written = len(self._records)
+    
+    def append_trace(self, trace: RerunTrace):
+        """
+        1回の再実行のスパンを追加
+        
+        Args:
+            trace: 再実行の記録
+        """
+        records = trace.to_records()
+        lines = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records)
+        with self._lock:
+            self._records.extend(records)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self._lines_written += len(records)
+            if self._lines_written > self.max_records * 2:
+                self._compact()
+    
+    def records(self, **filters) -> List[dict]:
+        """
+        条件に一致するスパンを古い順に取得
+        
+        Args:
+            **filters: 項目名=値 の絞り込み条件
+        
+        Returns:
+            List[dict]: スパンの記録
+        """
+        with self._lock:
+            records = list(self._records)
+        return [r for r in records if all(r.get(k) == v for k, v in filters.items())]
+    
+    def export_jsonl(self, **filters) -> str:
+        """
+        条件に一致するスパンをJSON Lines形式の文字列に変換（ダウンロード用）
+        
+        Args:
+            **filters: 項目名=値 の絞り込み条件
+        
+        Returns:
+            str: 1行1スパンのJSON Lines
+        """
+        return "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in self.records(**filters))
+    
+    def stage_summary(self, reruns: int = SUMMARY_RERUNS) -> pd.DataFrame:
+        """
+        直近の再実行について処理段階ごとの所要時間を集計
+        
+        Args:
+            reruns: 集計対象とする直近の再実行数
+        
+        Returns:
+            pd.DataFrame: 処理段階ごとの回数・中央値・95パーセンタイル・最大（ミリ秒）・キャッシュ利用率
+        """
+        df = pd.DataFrame(self.records())
+        if df.empty:
+            return df
+        recent_runs = df.drop_duplicates("run_id")["run_id"].tail(reruns)
+        df = df[df["run_id"].isin(recent_runs)]
+        cache = df["attrs"].apply(lambda a: (a or {}).get("cache"))
+        rows = []
+        for name, group in df.groupby("name", sort=False):
+            durations = group["duration_ms"]
+            group_cache = cache[group.index].dropna()
+            rows.append({
+                "処理段階": name,
+                "回数": len(group),
+                "中央値(ms)": round(durations.median(), 1),
+                "95%(ms)": round(durations.quantile(0.95), 1),
+                "最大(ms)": round(durations.max(), 1),
+                "キャッシュ利用率": f"{(group_cache == 'hit').mean() * 100:.0f}%" if len(group_cache) else "",
+            })
+        return pd.DataFrame(rows).sort_values("95%(ms)", ascending=False)
+
+
+@st.cache_resource(show_spinner=False)
+def get_trace_store() -> TraceStore:
+    """
+    スパンの記録先を取得（全セッション共通）
+    
+    保存先はSecretsの TRACE_PATH、保持件数は TRACE_MAX_RECORDS で変更可能
+    
+    Returns:
+        TraceStore: 記録先
+    """
+    path = get_secret("TRACE_PATH") or DEFAULT_TRACE_PATH
+    return TraceStore(Path(path), get_secret_int("TRACE_MAX_RECORDS", 20000))
+
+
+def trace_frame(trace: RerunTrace) -> pd.DataFrame:
+    """
+    再実行の記録を表示用のDataFrameに変換
+    
+    Args:
+        trace: 再実行の記録
+    
+    Returns:
+        pd.DataFrame: スパンごとの処理段階（入れ子は字下げ）・開始・終了・所要時間（ミリ秒）
+    """
+    rows = []
+    for index, s in enumerate(trace.spans):
+        label = "　" * s.depth + s.name
+        if s.attrs.get("cache"):
+            label += f"（キャッシュ{'利用' if s.attrs['cache'] == 'hit' else '未利用'}）"
+        rows.append({
+            "#": index,
+            "処理段階": label,
+            "開始(ms)": round(s.start * 1000, 1),
+            "終了(ms)": round((s.start + s.duration) * 1000, 1),
+            "所要時間(ms)": round(s.duration * 1000, 1),
+            "深さ": s.depth,
+            "エラー": s.error,
+        })
+    return pd.DataFrame(rows)
+
+
+def show_trace_panel(trace: Optional[RerunTrace]):
+    """
+    運用担当者向けに再実行の処理時間の内訳を表示
+    
+    Args:
+        trace: 表示する再実行の記録
+    """
+    if trace is None:
+        return
+    store = get_trace_store()
+    with st.expander(f"⏱️ 処理時間の内訳（今回の再実行 {trace.duration * 1000:,.0f}ms）"):
+        df = trace_frame(trace)
+        if df.empty:
+            st.caption("記録された処理段階がありません。")
+        else:
+            # ウォーターフォール（開始〜終了を横棒で表示）
+            try:
+                import altair as alt
+                chart = alt.Chart(df).mark_bar().encode(
+                    x=alt.X("開始(ms):Q", title="再実行の開始からの経過時間(ms)"),
+                    x2="終了(ms):Q",
+                    y=alt.Y("処理段階:N", sort=df["処理段階"].tolist(), title=None),
+                    color=alt.Color("深さ:O", legend=None),
+                    tooltip=["処理段階", "開始(ms)", "所要時間(ms)", "エラー"],
+                ).properties(height=max(120, 22 * len(df)))
+                st.altair_chart(chart, use_container_width=True)
+            except ImportError:
+                pass
+            st.dataframe(df.drop(columns=["深さ"]), hide_index=True, use_container_width=True)
+        
+        st.markdown(f"**直近{SUMMARY_RERUNS}回の再実行（全ユーザー）の処理段階ごとの所要時間**")
+        summary = store.stage_summary()
+        if summary.empty:
+            st.caption("まだ記録がありません。")
+        else:
+            st.dataframe(summary, hide_index=True, use_container_width=True)
+        
+        st.download_button(
+            "📥 記録をダウンロード（JSON Lines）",
+            data=store.export_jsonl(),
+            file_name=f"spans_{time.strftime('%Y%m%d_%H%M%S')}.jsonl",
+            mime="application/x-ndjson",
+            key="download_trace_spans"
+        )
+        st.caption(f"記録ファイル: {store.path}（1行1スパン）")
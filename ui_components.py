@@ -6,8 +6,10 @@ UI部品モジュール
 import pandas as pd
 import streamlit as st
 from table_builder import fmt_month_from_epoch
+from tracing import traced
 
 
+@traced()
 def show_df(df: pd.DataFrame, latest: bool = False):
     """
     DataFrameを整形して表示
@@ -3,9 +3,14 @@
 GCSからユーザー別のクエリファイルを読み込み、制限を適用
 """
 
-from typing import Optional, Dict, List
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple, FrozenSet
+import threading
+import pandas as pd
 import streamlit as st
 from gcs_loader import load_query_from_gcs
+from query_builder import BaseFilter, classify_base_query
+from tracing import traced
 
 
 def extract_allowed_codes(query_data: Dict) -> List[str]:
@@ -74,19 +79,23 @@ def get_user_restrictions() -> Dict:
     can_modify = st.session_state.get("user_can_modify_query", True)
     
     # クエリファイルが指定されていない = 無制限ユーザー
-    if not query_file:
-        return {
-            "has_query_file": False,
-            "can_modify_query": True,
-            "allowed_codes": [],
-            "allowed_categories": [],
-            "base_query": None
-        }
+    query_data = load_query_from_gcs(query_file) if query_file else None
+    return _restrictions_from_query(query_data, can_modify)
+
+
+def _restrictions_from_query(query_data: Optional[Dict], can_modify: bool) -> Dict:
+    """
+    クエリファイルの内容からユーザー制限情報を組み立て
     
-    # GCSからクエリファイルを読み込み
-    query_data = load_query_from_gcs(query_file)
+    Args:
+        query_data: クエリファイルの内容（Noneなら制限なし）
+        can_modify: クエリ修正可能フラグ
+    
+    Returns:
+        Dict: ユーザー制限情報（get_user_restrictions と同じ形式）
+    """
+    # クエリファイルがない・読み込めない場合は制限なしとして扱う
     if not query_data:
-        # エラー時は制限なしとして扱う
         return {
             "has_query_file": False,
             "can_modify_query": True,
@@ -109,4 +118,146 @@ def get_user_restrictions() -> Dict:
         "allowed_codes": allowed_codes,
         "allowed_categories": allowed_categories,
         "base_query": query_data.get("query", {})
-    }
\ No newline at end of file
+    }
+
+
+# ===== ログイン時に一度だけ組み立てる制限コンテキスト =====
+@dataclass(frozen=True)
+class RestrictionContext:
+    """
+    ユーザー制限を前処理した結果（ログイン後の再実行ではそのまま再利用し、変更しない）
+    """
+    has_query_file: bool
+    can_modify_query: bool
+    allowed_codes: Tuple[str, ...]  # 許可された自治体コード（空=制限なし）
+    allowed_categories: Tuple[int, ...]  # 許可されたカテゴリ（空=制限なし）
+    base_query: Optional[Dict]
+    base_filter: BaseFilter  # 分類済みのベースクエリ
+    jichitai: pd.DataFrame  # 許可された自治体のみの自治体マスター
+    city_type_options: Tuple[str, ...]  # 自治体区分の選択肢
+    short_unique: pd.DataFrame  # 全カテゴリ（略称で重複除去済み、表示順。件数・最新収集月の表の列に使用）
+    category_names: Tuple[str, ...]  # カテゴリ選択の選択肢（許可されたカテゴリのみ、初期値は全選択）
+    query_data: Optional[Dict] = None  # 元のクエリファイル（更新の検出用）
+    _trees: Dict[Tuple[str, ...], tuple] = field(default_factory=dict, repr=False, compare=False)
+    _tree_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    
+    @property
+    def allowed_code_set(self) -> FrozenSet[str]:
+        """許可された自治体コードの集合"""
+        return frozenset(self.allowed_codes)
+    
+    @property
+    def allowed_category_set(self) -> FrozenSet[int]:
+        """許可されたカテゴリの集合"""
+        return frozenset(self.allowed_categories)
+    
+    def tree_for(self, sel_city_types: List[str]) -> tuple:
+        """
+        自治体区分の選択に対応するツリーを取得（区分の組み合わせごとに一度だけ構築）
+        
+        Args:
+            sel_city_types: 選択された自治体区分
+        
+        Returns:
+            tuple: (ツリー構造のデータ, value→codeのマッピング辞書)
+        """
+        # 循環importを避けるため関数内でimport
+        from sidebar import build_jichitai_tree
+        
+        key = tuple(sorted(sel_city_types or []))
+        with self._tree_lock:
+            tree = self._trees.get(key)
+            if tree is None:
+                tree = build_jichitai_tree(self.jichitai, list(key))
+                self._trees[key] = tree
+        return tree
+    
+    def as_dict(self) -> Dict:
+        """get_user_restrictions と同じ形式の辞書に変換"""
+        return {
+            "has_query_file": self.has_query_file,
+            "can_modify_query": self.can_modify_query,
+            "allowed_codes": list(self.allowed_codes),
+            "allowed_categories": list(self.allowed_categories),
+            "base_query": self.base_query
+        }
+
+
+@traced()
+def compile_restrictions(
+    restrictions: Dict,
+    jichitai: pd.DataFrame,
+    catmap: pd.DataFrame,
+    query_data: Optional[Dict] = None
+) -> RestrictionContext:
+    """
+    ユーザー制限情報から制限コンテキストを組み立て
+    
+    Args:
+        restrictions: get_user_restrictions の戻り値
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+        query_data: 元のクエリファイル（更新の検出用）
+    
+    Returns:
+        RestrictionContext: 制限コンテキスト
+    """
+    allowed_codes = tuple(str(c) for c in restrictions["allowed_codes"])
+    allowed_categories = tuple(int(c) for c in restrictions["allowed_categories"])
+    
+    # 自治体マスターを許可された自治体に絞り込み
+    if allowed_codes:
+        jichitai_filtered = jichitai[jichitai["code"].isin(allowed_codes)].copy()
+    else:
+        jichitai_filtered = jichitai.copy()
+    city_type_options = tuple(sorted(jichitai_filtered["city_type"].dropna().unique().tolist()))
+    
+    # 表の列に使う全カテゴリと、許可されたカテゴリに絞り込んだ選択肢
+    short_unique = catmap.sort_values("order").drop_duplicates(subset=["short_name"], keep="first")
+    allowed_short = short_unique[short_unique["category"].isin(allowed_categories)] if allowed_categories else short_unique
+    
+    context = RestrictionContext(
+        has_query_file=restrictions["has_query_file"],
+        can_modify_query=restrictions["can_modify_query"],
+        allowed_codes=allowed_codes,
+        allowed_categories=allowed_categories,
+        base_query=restrictions["base_query"],
+        base_filter=classify_base_query(restrictions["base_query"], restrictions["can_modify_query"]),
+        jichitai=jichitai_filtered,
+        city_type_options=city_type_options,
+        short_unique=short_unique,
+        category_names=tuple(allowed_short["short_name"].tolist()),
+        query_data=query_data
+    )
+    # 自治体区分を選択していない場合のツリーは最初の表示で必ず使うので先に構築
+    context.tree_for([])
+    return context
+
+
+def get_restriction_context(jichitai: pd.DataFrame, catmap: pd.DataFrame) -> RestrictionContext:
+    """
+    現在のユーザーの制限コンテキストを取得（セッションごとに一度だけ組み立てて再利用）
+    
+    ユーザー・クエリファイル・クエリファイルの内容が変わった場合のみ組み立て直す
+    
+    Args:
+        jichitai: 自治体マスターデータ
+        catmap: カテゴリマスターデータ
+    
+    Returns:
+        RestrictionContext: 制限コンテキスト
+    """
+    query_file = st.session_state.get("user_query_file")
+    can_modify = st.session_state.get("user_can_modify_query", True)
+    key = (st.session_state.get("user_name"), query_file, can_modify)
+    
+    # クエリファイルは読み込み済みの結果を返すだけなので、毎回取得して更新の有無を確認
+    query_data = load_query_from_gcs(query_file) if query_file else None
+    
+    cached = st.session_state.get("restriction_context")
+    if cached is not None and cached[0] == key and cached[1].query_data is query_data:
+        return cached[1]
+    
+    context = compile_restrictions(_restrictions_from_query(query_data, can_modify), jichitai, catmap, query_data)
+    st.session_state["restriction_context"] = (key, context)
+    return context